@@ -6,3 +6,4 @@ class OmnipyConfiguration(object):
         self.mqtt_command_topic = ""
         self.mqtt_response_topic = ""
         self.mqtt_rate_topic = ""
+        self.packet_capture = True
@@ -6,14 +6,17 @@ import jsonpickle
 from configuration import OmnipyConfiguration
 from podcomm.pdm import Pdm, PdmLock
 from podcomm.pod import Pod
+from podcomm.pulses import Pulses
+from podcomm.exceptions import PdmError
 from podcomm.pr_rileylink import RileyLink
+from podcomm.radio_broker import RadioBroker
+from podcomm.packet_capture import enable_packet_capture
 from podcomm.definitions import *
 from logging import FileHandler
 import simplejson as json
 from threading import Thread
 import signal
 import base64
-from decimal import *
 from threading import Lock, Event
 import paho.mqtt.client as mqtt
 
@@ -33,6 +36,8 @@ class MqOperator(object):
             for line in lines:
                 txt = txt + line
         self.configuration = jsonpickle.decode(txt)
+        if getattr(self.configuration, "packet_capture", True):
+            enable_packet_capture()
         self.client = mqtt.Client(client_id=self.configuration.mqtt_clientid, protocol=mqtt.MQTTv311)
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
@@ -71,18 +76,23 @@ class MqOperator(object):
     def on_message(self, client, userdata, message: mqtt.MQTTMessage):
         ratestr = message.payload.decode()
         self.logger.info("Message %s %s %s " % (message.topic, message.timestamp, ratestr))
+        if message.topic == self.configuration.mqtt_command_topic and ratestr.startswith("metrics"):
+            self.send_metrics(ratestr)
+            return
         try:
             ratespl = ratestr.split(' ')
-            rate1 = Decimal(ratespl[0])
-            rate2 = Decimal(ratespl[1])
+            rate1 = Pulses.from_units(ratespl[0], exact=True)
+            rate2 = Pulses.from_units(ratespl[1], exact=True)
             self.set_rate(rate1, rate2)
+        except PdmError as pe:
+            self.send_msg("failed to parse message: %s" % pe.error_message)
         except:
             self.send_msg("failed to parse message")
 
     def on_disconnect(self, client, userdata, rc):
         self.logger.info("Disconnected from mqtt server")
 
-    def set_rate(self, rate1: Decimal, rate2: Decimal):
+    def set_rate(self, rate1: Pulses, rate2: Pulses):
         self.logger.info("Rate request: Insulin %02.2fU/h Glucagon %02.2fU/h" % (rate1, rate2))
         with self.rate_request_lock:
             self.rate_requested = rate1, rate2
@@ -90,9 +100,11 @@ class MqOperator(object):
 
     def pdm_loop(self):
         self.i_pod = Pod.Load("/home/pi/omnipy/data/pod.json", "/home/pi/omnipy/data/pod.db")
-        self.i_pdm = Pdm(self.i_pod)
         self.g_pod = Pod.Load("/home/pi/glucopy/data/pod.json", "/home/pi/glucopy/data/pod.db")
-        self.g_pdm = Pdm(self.g_pod)
+        # both pods share one rileylink connection, insulin goes first when both are waiting
+        self.radio_broker = RadioBroker()
+        self.i_pdm = Pdm(self.i_pod, packet_radio=self.radio_broker.get_session("insulin", priority=0))
+        self.g_pdm = Pdm(self.g_pod, packet_radio=self.radio_broker.get_session("glucagon", priority=1))
         self.check_wait = 3600
         while(True):
             if self.rate_check_event.wait(self.check_wait):
@@ -105,19 +117,22 @@ class MqOperator(object):
             wait2 = 3600
 
             if self.i_pod.state_progress == 8 or self.i_pod.state_progress == 9:
-                self.i_pdm.start_radio()
-                self.rate_check(i_requested, 1.6, self.i_pod, self.i_pdm)
+                self.rate_check(i_requested, Pulses.from_units("1.6"), self.i_pod, self.i_pdm)
                 wait1 = self.check_wait
-                self.i_pdm.stop_radio()
 
             if self.g_pod.state_progress == 8 or self.g_pod.state_progress == 9:
-                self.g_pdm.start_radio()
-                self.rate_check(g_requested, 0.3, self.g_pod, self.g_pdm)
+                self.rate_check(g_requested, Pulses.from_units("0.3"), self.g_pod, self.g_pdm)
                 wait2 = self.check_wait
-                self.g_pdm.stop_radio()
 
             self.check_wait = min(wait1, wait2)
 
+            # the next temp basal renewal is known, have the link ready for it
+            next_check = time.time() + self.check_wait
+            if self.i_pod.state_progress == 8 or self.i_pod.state_progress == 9:
+                self.i_pdm.expect_request(next_check)
+            if self.g_pod.state_progress == 8 or self.g_pod.state_progress == 9:
+                self.g_pdm.expect_request(next_check)
+
     def trigger_check(self):
         self.rate_check_event.set()
 
@@ -131,7 +146,7 @@ class MqOperator(object):
             requested_for = 120 * 60
             rerequest_threshold = 40 * 60
 
-        requested_hours = Decimal(int(requested_for / 1800)) / Decimal("2")
+        requested_hours = int(requested_for / 1800) / 2
 
         if current_rate != requested:
             self.send_msg(
@@ -190,14 +205,27 @@ class MqOperator(object):
                 temp_basal_end = pod.last_enacted_temp_basal_start + \
                                           (pod.last_enacted_temp_basal_duration * 3600)
                 if now <= temp_basal_end:
-                    return self.fix_decimal(pod.last_enacted_temp_basal_amount), int(temp_basal_end - now)
+                    return Pulses.from_units(pod.last_enacted_temp_basal_amount), int(temp_basal_end - now)
 
         return scheduled, 7 * 24 * 60
 
-    def fix_decimal(self, f):
-        f = Decimal(int(f * 20))
-        f = f / Decimal("20")
-        return f
+    def send_metrics(self, command):
+        try:
+            window = None
+            args = command.split(' ')
+            if len(args) > 1:
+                window = float(args[1])
+            metrics = dict()
+            if self.i_pdm is not None:
+                metrics["insulin"] = self.i_pdm.metrics.get_snapshot(window)
+                metrics["insulin"]["connection"] = self.i_pdm.connection.get_statistics()
+            if self.g_pdm is not None:
+                metrics["glucagon"] = self.g_pdm.metrics.get_snapshot(window)
+                metrics["glucagon"]["connection"] = self.g_pdm.connection.get_statistics()
+            self.send_msg(json.dumps(metrics))
+        except:
+            self.logger.exception("Error while sending metrics")
+            self.send_msg("failed to get metrics")
 
     def send_result(self, pod):
         self.send_msg(pod.GetString())
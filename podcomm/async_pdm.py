@@ -0,0 +1,179 @@
+from .protocol_radio import REQUEST_PRIORITY_NORMAL
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from threading import Lock
+import asyncio
+import functools
+
+
+class PdmCommand:
+    # a pdm call running on the executor and the radio request it is waiting on
+    def __init__(self):
+        self.cancelled = False
+        self.request = None
+        self.lock = Lock()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            if self.request is not None:
+                self.request.future.cancel()
+
+    def on_request(self, request):
+        with self.lock:
+            if self.cancelled:
+                raise CancelledError()
+            self.request = request
+
+
+class AsyncPdmRadio:
+    # only send_message_get_message can be cancelled, the other calls run to
+    # completion on the executor of the pod once they have been started
+    def __init__(self, radio, executor=None):
+        self.radio = radio
+        self.executor = executor
+
+    def submit_message(self, message, **kwargs):
+        return asyncio.wrap_future(self.radio.submit_message(message, **kwargs))
+
+    async def send_message_get_message(self, message,
+                                       message_address=None,
+                                       ack_address_override=None,
+                                       tx_power=None, double_take=False,
+                                       expect_critical_follow_up=False,
+                                       priority=REQUEST_PRIORITY_NORMAL,
+                                       deadline=None):
+        # cancelling the awaiting task cancels the radio request as long as
+        # the radio thread has not started sending it
+        return await self.submit_message(message, message_address=message_address,
+                                         ack_address_override=ack_address_override,
+                                         tx_power=tx_power, double_take=double_take,
+                                         expect_critical_follow_up=expect_critical_follow_up,
+                                         priority=priority, deadline=deadline)
+
+    async def get_packet(self, timeout=30000):
+        return await self._run(self.radio.get_packet, timeout)
+
+    async def start(self):
+        await self._run(self.radio.start)
+
+    async def stop(self):
+        await self._run(self.radio.stop)
+
+    async def _run(self, method, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, method, *args)
+
+
+class AsyncPdm:
+    def __init__(self, pdm, executor=None):
+        self.pdm = pdm
+        self.radio = None
+        self.command = None
+        self.own_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdm")
+        self.executor = executor
+        pdm.request_listener = self._on_radio_request
+
+    @property
+    def pod(self):
+        return self.pdm.pod
+
+    @property
+    def status_snapshot(self):
+        return self.pdm.status_snapshot
+
+    @property
+    def exchange(self):
+        # the radio request of the running command, None between exchanges
+        command = self.command
+        if command is None or command.request is None:
+            return None
+        return asyncio.wrap_future(command.request.future)
+
+    def get_radio(self, new=False):
+        radio = self.pdm.get_radio(new=new)
+        if self.radio is None or self.radio.radio is not radio:
+            self.radio = AsyncPdmRadio(radio, self.executor)
+        return self.radio
+
+    async def start_radio(self):
+        return await self._run(self.pdm.start_radio)
+
+    async def stop_radio(self):
+        return await self._run(self.pdm.stop_radio)
+
+    async def prime_nonce(self, nonces=None, processes=None):
+        return await self._run(self.pdm.prime_nonce, nonces=nonces, processes=processes)
+
+    async def update_status(self, update_type=0):
+        return await self._run(self.pdm.update_status, update_type=update_type)
+
+    async def acknowledge_alerts(self, alert_mask):
+        return await self._run(self.pdm.acknowledge_alerts, alert_mask)
+
+    async def hf_silence_will_fall(self):
+        return await self._run(self.pdm.hf_silence_will_fall)
+
+    async def is_busy(self):
+        # only peeks at the pdm lock, a command on the executor must not hold it up
+        return self.pdm.is_busy()
+
+    async def bolus(self, bolus_amount):
+        return await self._run(self.pdm.bolus, bolus_amount)
+
+    async def cancel_bolus(self):
+        return await self._run(self.pdm.cancel_bolus)
+
+    async def set_temp_basal(self, basalRate, hours, confidenceReminder=False):
+        return await self._run(self.pdm.set_temp_basal, basalRate, hours,
+                               confidenceReminder=confidenceReminder)
+
+    async def cancel_temp_basal(self):
+        return await self._run(self.pdm.cancel_temp_basal)
+
+    async def set_basal_schedule(self, schedule):
+        return await self._run(self.pdm.set_basal_schedule, schedule)
+
+    async def deactivate_pod(self):
+        return await self._run(self.pdm.deactivate_pod)
+
+    async def pair_pod(self, candidate_address, utc_offset):
+        return await self._run(self.pdm.pair_pod, candidate_address, utc_offset)
+
+    async def activate_pod(self):
+        return await self._run(self.pdm.activate_pod)
+
+    async def inject_and_start(self, basal_schedule):
+        return await self._run(self.pdm.inject_and_start, basal_schedule)
+
+    def close(self):
+        if self.pdm.request_listener == self._on_radio_request:
+            self.pdm.request_listener = None
+        if self.own_executor:
+            self.executor.shutdown(wait=False)
+
+    async def _run(self, method, *args, **kwargs):
+        # pdm commands are serialized on the executor. Cancelling the caller
+        # cancels the radio request it waits on if that has not been sent yet,
+        # and refuses any further exchange of the same command
+        command = PdmCommand()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._execute, command, functools.partial(method, *args, **kwargs))
+        except asyncio.CancelledError:
+            command.cancel()
+            raise
+
+    def _execute(self, command, call):
+        if command.cancelled:
+            raise CancelledError()
+        self.command = command
+        try:
+            return call()
+        finally:
+            self.command = None
+
+    def _on_radio_request(self, request):
+        command = self.command
+        if command is not None:
+            command.on_request(request)
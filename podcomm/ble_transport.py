@@ -0,0 +1,113 @@
+from .exceptions import PacketRadioError
+from .metrics import LatencyHistogram
+from .definitions import *
+from collections import deque
+import time
+
+GATT_WRITE = "write"
+GATT_NOTIFY = "notify"
+GATT_READ = "read"
+GATT_COMMAND = "command"
+
+GATT_OPERATIONS = (GATT_WRITE, GATT_NOTIFY, GATT_READ, GATT_COMMAND)
+
+# bluepy characteristic property bit for write without response
+GATT_PROPERTY_WRITE_NO_RESPONSE = 0x04
+
+ATT_DEFAULT_MTU = 23
+ATT_WRITE_OVERHEAD = 3
+
+
+class BleCommandTransport:
+    # ble_rfspy takes a command on the data characteristic, raises a
+    # notification with its response count on the response characteristic
+    # and leaves the response on the data characteristic to be read.
+    # Commands are written ahead up to depth; firmware that holds a single
+    # command needs depth 1, the notification count still tells whether a
+    # response went missing. Writes are acknowledged unless a payload limit
+    # for writes without response is given, longer commands are always
+    # acknowledged as they would not fit in a single unacknowledged write.
+    def __init__(self, peripheral, data_handle, response_handle, write_without_response_limit=None, depth=1,
+                 timings=None, clock=time):
+        self.peripheral = peripheral
+        self.data_handle = data_handle
+        self.response_handle = response_handle
+        self.write_without_response_limit = write_without_response_limit
+        self.depth = depth
+        self.clock = clock
+        self.logger = getLogger()
+
+        self.notifications = deque()
+        self.response_count = None
+        self.missed_responses = 0
+        if timings is None:
+            timings = dict()
+            for operation in GATT_OPERATIONS:
+                timings[operation] = LatencyHistogram()
+        self.timings = timings
+
+        self.peripheral.withDelegate(self)
+
+    def handleNotification(self, handle, data):
+        if handle == self.response_handle:
+            self.notifications.append(data)
+
+    def drain(self, timeout=0.05):
+        while self.peripheral.waitForNotifications(timeout):
+            self.peripheral.readCharacteristic(self.data_handle)
+        self.notifications.clear()
+
+    def execute(self, data, timeout=10.0):
+        return self.execute_batch([data], timeout)[0]
+
+    def execute_batch(self, commands, timeout=10.0):
+        responses = []
+        started = []
+        written = 0
+        while len(responses) < len(commands):
+            while written < len(commands) and written - len(responses) < self.depth:
+                started.append(self.clock.time())
+                self._write(commands[written])
+                written += 1
+            self._wait_notification(timeout)
+            responses.append(self._read())
+            self.timings[GATT_COMMAND].record(self.clock.time() - started[len(responses) - 1])
+        return responses
+
+    def get_timings(self):
+        timings = dict()
+        for operation, histogram in self.timings.items():
+            timings[operation] = histogram.get_values()
+        timings["missed_responses"] = self.missed_responses
+        return timings
+
+    def _write(self, data):
+        t = self.clock.time()
+        limit = self.write_without_response_limit
+        with_response = limit is None or len(data) > limit
+        self.peripheral.writeCharacteristic(self.data_handle, data, withResponse=with_response)
+        self.timings[GATT_WRITE].record(self.clock.time() - t)
+
+    def _wait_notification(self, timeout):
+        t = self.clock.time()
+        deadline = t + timeout
+        while len(self.notifications) == 0:
+            remaining = deadline - self.clock.time()
+            if remaining <= 0 or not self.peripheral.waitForNotifications(remaining):
+                raise PacketRadioError("Timed out while waiting for a response from RileyLink")
+        notification = self.notifications.popleft()
+        self.timings[GATT_NOTIFY].record(self.clock.time() - t)
+
+        if len(notification) > 0:
+            count = notification[0]
+            if self.response_count is not None and count != (self.response_count + 1) % 256:
+                self.missed_responses += 1
+                self.logger.warning("RileyLink response count jumped from %d to %d"
+                                    % (self.response_count, count))
+            self.response_count = count
+
+    def _read(self):
+        t = self.clock.time()
+        response = self.peripheral.readCharacteristic(self.data_handle)
+        self.timings[GATT_READ].record(self.clock.time() - t)
+        return response
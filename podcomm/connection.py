@@ -0,0 +1,150 @@
+from collections import deque
+from threading import Lock, Timer
+import time
+
+
+class ConnectionManager:
+    # idle_cost is how many seconds of reconnect latency one second of keeping
+    # an idle link is worth, the link is kept while that is the cheaper option
+    def __init__(self, idle_cost=0.01, min_idle=5.0, max_idle=900.0, sample_count=64,
+                 reconnect_cost=5.0, smoothing=0.25, preconnect_margin=2.0, clock=time):
+        self.idle_cost = idle_cost
+        self.min_idle = min_idle
+        self.max_idle = max_idle
+        self.smoothing = smoothing
+        self.preconnect_margin = preconnect_margin
+        self.clock = clock
+
+        self.gaps = deque(maxlen=sample_count)
+        self.reconnect_cost = reconnect_cost
+        self.reconnects = 0
+        self.connected = False
+        self.last_request = None
+        self.expected_request = None
+        self.preconnect_callback = None
+        self.timer = None
+        self.lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.preconnects = 0
+        self.idle_disconnects = 0
+
+    def attach(self, preconnect_callback):
+        with self.lock:
+            self.preconnect_callback = preconnect_callback
+            self._arm_timer()
+
+    def detach(self):
+        with self.lock:
+            self.preconnect_callback = None
+            self._cancel_timer()
+            self.connected = False
+
+    def on_request(self, queued):
+        with self.lock:
+            if self.last_request is not None:
+                self.gaps.append(max(0.0, queued - self.last_request))
+            self.last_request = queued
+            if self.expected_request is not None and \
+                    queued >= self.expected_request - self.reconnect_cost - self.preconnect_margin:
+                self.expected_request = None
+            if self.connected:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def on_connected(self, duration):
+        with self.lock:
+            self.connected = True
+            self.reconnects += 1
+            self.reconnect_cost += (duration - self.reconnect_cost) * self.smoothing
+            self._cancel_timer()
+
+    def on_disconnected(self, idle=False):
+        with self.lock:
+            self.connected = False
+            if idle:
+                self.idle_disconnects += 1
+            self._arm_timer()
+
+    def on_preconnect(self):
+        with self.lock:
+            self.preconnects += 1
+
+    def expect_request(self, at):
+        with self.lock:
+            self.expected_request = at
+            self._arm_timer()
+
+    def get_idle_timeout(self, now=None):
+        if now is None:
+            now = self.clock.time()
+        with self.lock:
+            timeout = self._get_break_even()
+            if self.expected_request is not None:
+                wait = self.expected_request - now
+                # within the preconnect window the link stays up for the request regardless
+                lead = self.reconnect_cost + self.preconnect_margin
+                if 0 < wait and (wait <= lead or wait * self.idle_cost < self.reconnect_cost):
+                    timeout = max(timeout, wait + self.preconnect_margin)
+            return min(self.max_idle, max(self.min_idle, timeout))
+
+    def get_statistics(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {"connected": self.connected,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": self.hits / total if total > 0 else None,
+                    "preconnects": self.preconnects,
+                    "idle_disconnects": self.idle_disconnects,
+                    "reconnects": self.reconnects,
+                    "reconnect_cost": self.reconnect_cost,
+                    "idle_timeout": self._get_break_even(),
+                    "expected_request": self.expected_request}
+
+    def _get_break_even(self):
+        # the idle timeout that would have cost least over the recent request gaps:
+        # gaps within the timeout pay for the idle link, longer ones pay for it
+        # up to the timeout and then for a reconnect
+        if len(self.gaps) == 0:
+            return self.min_idle
+        gaps = sorted(self.gaps)
+        best_timeout = 0.0
+        best_cost = len(gaps) * self.reconnect_cost
+        below = 0.0
+        for i, timeout in enumerate(gaps):
+            below += timeout
+            above = len(gaps) - i - 1
+            cost = self.idle_cost * (below + above * timeout) + above * self.reconnect_cost
+            if cost < best_cost:
+                best_cost = cost
+                best_timeout = timeout
+        return best_timeout
+
+    def _arm_timer(self):
+        self._cancel_timer()
+        if self.connected or self.preconnect_callback is None or self.expected_request is None:
+            return
+        now = self.clock.time()
+        if now > self.expected_request + self.preconnect_margin:
+            # it did not come when expected, stop holding the link for it
+            self.expected_request = None
+            return
+        delay = self.expected_request - self.reconnect_cost - self.preconnect_margin - now
+        self.timer = Timer(max(0.0, delay), self._fire)
+        self.timer.setDaemon(True)
+        self.timer.start()
+
+    def _cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def _fire(self):
+        with self.lock:
+            self.timer = None
+            callback = self.preconnect_callback
+        if callback is not None:
+            callback()
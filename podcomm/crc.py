@@ -1,3 +1,5 @@
+import struct
+
 crc8_table =   [0x00, 0x07, 0x0e, 0x09, 0x1c, 0x1b, 0x12, 0x15,
                 0x38, 0x3f, 0x36, 0x31, 0x24, 0x23, 0x2a, 0x2d,
                 0x70, 0x77, 0x7e, 0x79, 0x6c, 0x6b, 0x62, 0x65,
@@ -60,14 +62,185 @@ crc16_table = [0x0000,0x8005,0x800f,0x000a,0x801b,0x001e,0x0014,0x8011,0x8033,
                0x827f,0x027a,0x826b,0x026e,0x0264,0x8261,0x0220,0x8225,0x822f,
                0x022a,0x823b,0x023e,0x0234,0x8231,0x8213,0x0216,0x021c,0x8219,
                0x0208,0x820d,0x8207,0x0202]
-def crc16(msg):
-    crc = 0x0000
-    for x in msg:
-        crc = (crc >> 8) ^ crc16_table[(crc ^ x) & 0xff]
+
+SLICE_SIZE = 8
+SLICE_THRESHOLD = 32
+
+_slice_unpack = struct.Struct("%dB" % SLICE_SIZE).iter_unpack
+
+
+def _build_crc16_slices(table, count):
+    slices = [list(table)]
+    for k in range(1, count):
+        previous = slices[-1]
+        slices.append([(previous[x] >> 8) ^ table[previous[x] & 0xff] for x in range(256)])
+    return slices
+
+
+def _build_crc8_slices(table, count):
+    slices = [list(table)]
+    for k in range(1, count):
+        previous = slices[-1]
+        slices.append([table[previous[x]] for x in range(256)])
+    return slices
+
+
+crc16_slices = _build_crc16_slices(crc16_table, SLICE_SIZE)
+crc8_slices = _build_crc8_slices(crc8_table, SLICE_SIZE)
+
+
+def _as_bytes_view(data):
+    # buffers are read in place, lists and other iterables of ints are copied once
+    kind = type(data)
+    if kind is bytes or kind is bytearray:
+        return memoryview(data)
+    if kind is not memoryview:
+        try:
+            data = memoryview(data)
+        except TypeError:
+            return memoryview(bytes(data))
+    if data.format != "B":
+        data = data.cast("B")
+    return data
+
+
+def crc16_update(crc, data):
+    kind = type(data)
+    if (kind is not bytes and kind is not bytearray) or len(data) >= SLICE_THRESHOLD:
+        data = _as_bytes_view(data)
+        length = len(data)
+        if length >= SLICE_THRESHOLD:
+            bulk = length - (length % SLICE_SIZE)
+            t0, t1, t2, t3, t4, t5, t6, t7 = crc16_slices
+            for a, b, c, d, e, f, g, h in _slice_unpack(data[:bulk]):
+                crc = t7[(crc ^ a) & 0xff] ^ t6[(crc >> 8) ^ b] ^ t5[c] ^ t4[d] \
+                      ^ t3[e] ^ t2[f] ^ t1[g] ^ t0[h]
+            data = data[bulk:]
+
+    # frames shorter than the threshold, and the tail of longer ones, go byte by byte
+    table = crc16_table
+    for x in data:
+        crc = (crc >> 8) ^ table[(crc ^ x) & 0xff]
     return crc
 
-def crc8(msg):
-    crc = 0x0000
-    for x in msg:
-        crc = (crc >> 8) ^ crc8_table[(crc ^ x) & 0xff]
+
+def crc8_update(crc, data):
+    kind = type(data)
+    if (kind is not bytes and kind is not bytearray) or len(data) >= SLICE_THRESHOLD:
+        data = _as_bytes_view(data)
+        length = len(data)
+        if length >= SLICE_THRESHOLD:
+            bulk = length - (length % SLICE_SIZE)
+            t0, t1, t2, t3, t4, t5, t6, t7 = crc8_slices
+            for a, b, c, d, e, f, g, h in _slice_unpack(data[:bulk]):
+                crc = t7[crc ^ a] ^ t6[b] ^ t5[c] ^ t4[d] ^ t3[e] ^ t2[f] ^ t1[g] ^ t0[h]
+            data = data[bulk:]
+
+    table = crc8_table
+    for x in data:
+        crc = table[crc ^ x]
     return crc
+
+
+_crc16_zero_shifts = []
+
+
+def _crc16_zero_shift_operator(power):
+    # linear operator advancing a crc16 over 2**power zero bytes, as lookup tables
+    # for the low and high byte of the crc
+    while len(_crc16_zero_shifts) <= power:
+        if len(_crc16_zero_shifts) == 0:
+            table = crc16_table
+            lo = [(x >> 8) ^ table[x & 0xff] for x in range(256)]
+            hi = [((x << 8) >> 8) ^ table[(x << 8) & 0xff] for x in range(256)]
+        else:
+            p_lo, p_hi = _crc16_zero_shifts[-1]
+            lo = [p_lo[c & 0xff] ^ p_hi[c >> 8] for c in (p_lo[x] for x in range(256))]
+            hi = [p_lo[c & 0xff] ^ p_hi[c >> 8] for c in (p_hi[x] for x in range(256))]
+        _crc16_zero_shifts.append((lo, hi))
+    return _crc16_zero_shifts[power]
+
+
+def crc16_shift_zeros(crc, count):
+    power = 0
+    while count > 0:
+        if count & 1:
+            lo, hi = _crc16_zero_shift_operator(power)
+            crc = lo[crc & 0xff] ^ hi[crc >> 8]
+        count >>= 1
+        power += 1
+    return crc
+
+
+def crc16_patch(crc, old_data, new_data, trailing_length):
+    # crc16 with a zero initial value is linear, so replacing old_data with new_data
+    # in a message changes its crc by the crc of their difference shifted over the
+    # bytes that follow it
+    delta = bytes([a ^ b for a, b in zip(old_data, new_data)])
+    return crc ^ crc16_shift_zeros(crc16_update(0x0000, delta), trailing_length)
+
+
+def crc16(msg):
+    kind = type(msg)
+    if (kind is bytes or kind is bytearray) and len(msg) < SLICE_THRESHOLD:
+        crc = 0x0000
+        table = crc16_table
+        for x in msg:
+            crc = (crc >> 8) ^ table[(crc ^ x) & 0xff]
+        return crc
+    return crc16_update(0x0000, msg)
+
+
+def crc8(msg):
+    kind = type(msg)
+    if (kind is bytes or kind is bytearray) and len(msg) < SLICE_THRESHOLD:
+        crc = 0x00
+        table = crc8_table
+        for x in msg:
+            crc = table[crc ^ x]
+        return crc
+    return crc8_update(0x00, msg)
+
+
+class Crc16State:
+    __slots__ = ("crc",)
+
+    def __init__(self, data=None, crc=0x0000):
+        self.crc = crc
+        if data is not None:
+            self.crc = crc16_update(self.crc, data)
+
+    def update(self, data):
+        self.crc = crc16_update(self.crc, data)
+        return self
+
+    def copy(self):
+        return Crc16State(crc=self.crc)
+
+    def digest(self):
+        return self.crc
+
+    def digest_bytes(self):
+        return struct.pack(">H", self.crc)
+
+
+class Crc8State:
+    __slots__ = ("crc",)
+
+    def __init__(self, data=None, crc=0x00):
+        self.crc = crc
+        if data is not None:
+            self.crc = crc8_update(self.crc, data)
+
+    def update(self, data):
+        self.crc = crc8_update(self.crc, data)
+        return self
+
+    def copy(self):
+        return Crc8State(crc=self.crc)
+
+    def digest(self):
+        return self.crc
+
+    def digest_bytes(self):
+        return bytes([self.crc])
@@ -13,6 +13,7 @@ POD_FILE_SUFFIX = ".json"
 
 POD_DB_SUFFIX = ".db"
 LOGFILE_SUFFIX = ".log"
+CAPTURE_SUFFIX = ".cap"
 
 OMNIPY_LOGGER = "OMNIPY"
 OMNIPY_LOGFILE = "omnipy"
@@ -22,6 +23,8 @@ OMNIPY_PACKET_LOGFILE = "packet"
 
 OMNIPY_DATABASE = "omni.db"
 
+DEVICE_CACHE_FILE = "devices.json"
+
 API_VERSION_MAJOR = 1
 API_VERSION_MINOR = 4
 API_VERSION_REVISION = 3
@@ -49,6 +52,7 @@ REST_URL_PAIR_POD = "/pdm/pair"
 REST_URL_ACTIVATE_POD = "/pdm/activate"
 REST_URL_START_POD = "/pdm/start"
 REST_URL_STATUS = "/pdm/status"
+REST_URL_METRICS = "/pdm/metrics"
 REST_URL_PDM_BUSY = "/pdm/isbusy"
 REST_URL_ACK_ALERTS = "/pdm/ack"
 REST_URL_DEACTIVATE_POD = "/pdm/deactivate"
@@ -60,6 +64,7 @@ REST_URL_SET_BASAL_SCHEDULE = "/pdm/setbasalschedule"
 
 logger = None
 packet_logger = None
+log_path = None
 
 
 def ensure_log_dir():
@@ -67,16 +72,41 @@ def ensure_log_dir():
         os.mkdir(DATA_PATH)
 
 
+def set_log_path(path):
+    # simulations and benches log here, so their traffic stays out of the
+    # data directory and the packet log the nonce is recovered from
+    global log_path
+
+    log_path = path
+    for existing, name in ((logger, OMNIPY_LOGFILE), (packet_logger, OMNIPY_PACKET_LOGFILE)):
+        if existing is None:
+            continue
+        for handler in list(existing.handlers):
+            if isinstance(handler, logging.FileHandler):
+                existing.removeHandler(handler)
+                handler.close()
+                fh = logging.FileHandler(_get_log_file(name))
+                fh.setLevel(handler.level)
+                fh.setFormatter(handler.formatter)
+                existing.addHandler(fh)
+
+
+def _get_log_file(name):
+    if log_path is None:
+        ensure_log_dir()
+        return DATA_PATH + name + LOGFILE_SUFFIX
+    return os.path.join(log_path, name + LOGFILE_SUFFIX)
+
+
 def getLogger(with_console=False):
     global logger
 
     if logger is None:
-        ensure_log_dir()
         logger = logging.getLogger(OMNIPY_LOGGER)
         logger.setLevel(logging.DEBUG)
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
-        fh = logging.FileHandler(DATA_PATH + OMNIPY_LOGFILE + LOGFILE_SUFFIX)
+        fh = logging.FileHandler(_get_log_file(OMNIPY_LOGFILE))
         fh.setLevel(logging.DEBUG)
         fh.setFormatter(formatter)
         logger.addHandler(fh)
@@ -94,12 +124,11 @@ def get_packet_logger(with_console=False):
     global packet_logger
 
     if packet_logger is None:
-        ensure_log_dir()
         packet_logger = logging.getLogger(OMNIPY_PACKET_LOGGER)
         packet_logger.setLevel(logging.INFO)
         formatter = logging.Formatter('%(asctime)s %(message)s')
 
-        fh = logging.FileHandler(DATA_PATH + OMNIPY_PACKET_LOGFILE + LOGFILE_SUFFIX)
+        fh = logging.FileHandler(_get_log_file(OMNIPY_PACKET_LOGFILE))
         fh.setLevel(logging.INFO)
         fh.setFormatter(formatter)
         packet_logger.addHandler(fh)
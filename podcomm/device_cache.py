@@ -0,0 +1,70 @@
+from .definitions import *
+from threading import RLock
+import simplejson as json
+import os
+import time
+
+
+class DeviceCache:
+    # radio devices seen before, keyed by backend, so a new process can go
+    # straight to the last known device instead of discovering it again
+    def __init__(self, path):
+        self.path = path
+        self.lock = RLock()
+        self.logger = getLogger()
+        self.devices = dict()
+        try:
+            with open(path, "r") as stream:
+                devices = json.load(stream)
+            if isinstance(devices, dict):
+                self.devices = devices
+        except FileNotFoundError:
+            pass
+        except Exception:
+            self.logger.exception("Ignoring unreadable device cache %s" % path)
+
+    def get(self, kind):
+        with self.lock:
+            entry = self.devices.get(kind)
+            if entry is None:
+                return None
+            return dict(entry)
+
+    def update(self, kind, **values):
+        with self.lock:
+            entry = self.devices.get(kind)
+            if entry is None:
+                entry = dict()
+                self.devices[kind] = entry
+            if "address" in values and entry.get("address") != values["address"]:
+                entry.clear()
+            entry.update(values)
+            entry["updated"] = time.time()
+            self._save()
+
+    def forget(self, kind):
+        with self.lock:
+            if self.devices.pop(kind, None) is not None:
+                self._save()
+
+    def _save(self):
+        try:
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as stream:
+                json.dump(self.devices, stream, indent=4, sort_keys=True)
+            os.replace(temp_path, self.path)
+        except Exception:
+            self.logger.exception("Error while saving device cache")
+
+
+device_cache = None
+
+
+def get_device_cache():
+    global device_cache
+
+    if device_cache is None:
+        ensure_log_dir()
+        device_cache = DeviceCache(DATA_PATH + DEVICE_CACHE_FILE)
+
+    return device_cache
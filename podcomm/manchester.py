@@ -1,4 +1,8 @@
 import random
+import struct
+
+FRAME_LENGTH = 80
+INVALID_SYMBOL = -1
 
 
 def encodeSingleByte(d):
@@ -13,16 +17,49 @@ def encodeSingleByte(d):
         d = d >> 1
     return bytes([(e >> 8), e & 0xff])
 
+
+def _build_tables():
+    encode_table = []
+    decode_table = [INVALID_SYMBOL] * 65536
+    for i in range(0, 256):
+        enc = encodeSingleByte(i)
+        encode_table.append(enc)
+        decode_table[(enc[0] << 8) | enc[1]] = i
+    return encode_table, decode_table
+
+
+ENCODE_TABLE, DECODE_TABLE = _build_tables()
+
+_word_structs = dict()
+
+
+def _word_struct(count):
+    s = _word_structs.get(count)
+    if s is None:
+        s = struct.Struct(">%dH" % count)
+        _word_structs[count] = s
+    return s
+
+
+def _decode_symbols(data):
+    count = len(data) >> 1
+    if count == 0:
+        return [], 0
+    table = DECODE_TABLE
+    decoded = [table[w] for w in _word_struct(count).unpack_from(data)]
+    try:
+        valid = decoded.index(INVALID_SYMBOL)
+    except ValueError:
+        valid = count
+    return decoded, valid
+
+
 class ManchesterCodec:
     def __init__(self):
         #self.preamble = bytes([0x65,0x66]) * 20 + bytes([0xa5, 0x5a])
         self.preamble = bytes()
-        self.decode_dict = dict()
-        self.encode_dict = dict()
-        for i in range(0, 256):
-            enc = encodeSingleByte(i)
-            self.decode_dict[enc] = i
-            self.encode_dict[i] = enc
+        self.encode_table = ENCODE_TABLE
+        self.decode_table = DECODE_TABLE
 
         self.noiseSeq = 0
         noiseNibbles = '0123478bcdef'
@@ -31,24 +68,59 @@ class ManchesterCodec:
             noiseLine = "f"
             for i in range(0, 79):
                 noiseLine += random.choice(noiseNibbles)
-            self.noiseLines.append(bytearray.fromhex(noiseLine))
+            self.noiseLines.append(bytes.fromhex(noiseLine))
 
     def decode(self, data):
-        decoded = bytes()
-        for i in range(0, len(data), 2):
-            word = data[i:i+2]
-            if word in self.decode_dict:
-                decoded += bytes([self.decode_dict[word]])
-            else:
-                break
-        return decoded
+        decoded, valid = _decode_symbols(data)
+        return bytes(decoded[:valid])
+
+    def decode_into(self, data, buffer, offset=0):
+        # returns the number of bytes written and the index of the first
+        # invalid symbol in data, or -1 if every symbol decoded
+        count = len(data) >> 1
+        if offset + count > len(buffer):
+            raise ValueError("Buffer too small for decoded data")
+        if count == 0:
+            return 0, -1
+        table = self.decode_table
+        position = offset
+        for w in _word_struct(count).unpack_from(data):
+            d = table[w]
+            if d == INVALID_SYMBOL:
+                written = position - offset
+                return written, written
+            buffer[position] = d
+            position += 1
+        return count, -1
 
     def encode(self, data):
-        encoded = self.preamble
-        for i in data:
-            encoded += self.encode_dict[i]
-        encoded += self.noiseLines[self.noiseSeq]
+        table = self.encode_table
+        encoded = self.preamble + b"".join([table[i] for i in data])
+        length = len(encoded)
+        if length < FRAME_LENGTH:
+            encoded += self.noiseLines[self.noiseSeq][:FRAME_LENGTH - length]
+        elif length > FRAME_LENGTH:
+            encoded = encoded[:FRAME_LENGTH]
         self.noiseSeq += 1
         self.noiseSeq %= 32
-        return encoded[0:80]
+        return encoded
 
+    def encode_into(self, data, buffer, offset=0):
+        limit = offset + FRAME_LENGTH
+        if limit > len(buffer):
+            raise ValueError("Buffer too small for encoded frame")
+        end = offset + len(self.preamble)
+        buffer[offset:end] = self.preamble
+        table = self.encode_table
+        for i in data:
+            if end >= limit:
+                break
+            buffer[end:end + 2] = table[i]
+            end += 2
+        if end < limit:
+            noise = self.noiseLines[self.noiseSeq][:limit - end]
+            buffer[end:end + len(noise)] = noise
+            end += len(noise)
+        self.noiseSeq += 1
+        self.noiseSeq %= 32
+        return min(end, limit) - offset
@@ -0,0 +1,203 @@
+from .protocol_common import PdmRequest
+from threading import Lock
+import time
+
+OUTCOME_OK = "ok"
+
+EXCHANGE_COUNTERS = ("unique_packets", "repeated_sends", "receive_timeouts", "repeated_receives",
+                     "protocol_errors", "bad_packets", "radio_errors")
+
+
+class LatencyHistogram:
+    # log-linear buckets in the manner of HdrHistogram: each power of two of
+    # milliseconds is split into sub_buckets linear steps, so the relative
+    # error stays below 1 / sub_buckets over the whole range
+    def __init__(self, sub_buckets=32, highest_ms=3600000):
+        self.sub_buckets = sub_buckets
+        self.highest_ms = highest_ms
+        self.bucket_count = self._get_index(highest_ms) + 1
+        self.counts = dict()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        ms = int(seconds * 1000)
+        if ms < 0:
+            ms = 0
+        index = self._get_index(min(ms, self.highest_ms))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def reset(self):
+        self.counts.clear()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def get_percentile(self, percentile):
+        if self.count == 0:
+            return None
+        rank = max(1, int(self.count * percentile / 100.0 + 0.5))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._get_value(index), self.max)
+        return self.max
+
+    def get_mean(self):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def get_values(self):
+        return {"count": self.count,
+                "mean": self.get_mean(),
+                "min": self.min,
+                "max": self.max,
+                "p50": self.get_percentile(50),
+                "p95": self.get_percentile(95),
+                "p99": self.get_percentile(99)}
+
+    def _get_index(self, ms):
+        if ms < self.sub_buckets:
+            return ms
+        magnitude = ms.bit_length() - self.sub_buckets.bit_length()
+        return (magnitude + 1) * self.sub_buckets + (ms >> magnitude) - self.sub_buckets
+
+    def _get_value(self, index):
+        # upper edge of the bucket, in seconds
+        if index < self.sub_buckets:
+            return index / 1000.0
+        magnitude = index // self.sub_buckets - 1
+        sub_bucket = index % self.sub_buckets + self.sub_buckets
+        return (((sub_bucket + 1) << magnitude) - 1) / 1000.0
+
+
+class _MetricsEntry:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.queue_wait = LatencyHistogram()
+        self.counters = dict.fromkeys(EXCHANGE_COUNTERS, 0)
+
+    def add(self, exchange):
+        self.latency.record(exchange.ended - exchange.started)
+        if exchange.queued:
+            self.queue_wait.record(max(0, exchange.started - exchange.queued))
+        for counter in EXCHANGE_COUNTERS:
+            self.counters[counter] += getattr(exchange, counter)
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.queue_wait.merge(other.queue_wait)
+        for counter in EXCHANGE_COUNTERS:
+            self.counters[counter] += other.counters[counter]
+
+
+class _MetricsWindow:
+    def __init__(self):
+        self.index = None
+        self.entries = dict()
+
+    def reset(self, index):
+        self.index = index
+        self.entries.clear()
+
+
+def get_request_name(message):
+    # an insulin schedule is always followed by the part saying what it is for
+    parts = message.get_parts()
+    if len(parts) == 0:
+        return "Unknown"
+    cmd_type = parts[-1][0]
+    try:
+        return PdmRequest(cmd_type).name
+    except ValueError:
+        return "0x%02x" % cmd_type
+
+
+def get_outcome(error):
+    if error is None:
+        return OUTCOME_OK
+    return type(error).__name__
+
+
+class ExchangeMetrics:
+    def __init__(self, window_length=3600, window_count=24, clock=time):
+        self.window_length = window_length
+        self.window_count = window_count
+        self.clock = clock
+        self.windows = [_MetricsWindow() for _ in range(0, window_count)]
+        self.totals = dict()
+        self.started = clock.time()
+        self.lock = Lock()
+
+    def add(self, request_name, outcome, exchange):
+        index = int(exchange.ended // self.window_length)
+        key = (request_name, outcome)
+        with self.lock:
+            window = self.windows[index % self.window_count]
+            if window.index != index:
+                window.reset(index)
+            if key not in window.entries:
+                window.entries[key] = _MetricsEntry()
+            window.entries[key].add(exchange)
+
+            if key not in self.totals:
+                self.totals[key] = _MetricsEntry()
+            self.totals[key].add(exchange)
+
+    def get_snapshot(self, window=None, now=None):
+        if now is None:
+            now = self.clock.time()
+        merged = dict()
+        with self.lock:
+            if window is None:
+                sources = [self.totals]
+            else:
+                window_count = min(self.window_count, max(1, int(-(-window // self.window_length))))
+                first = int(now // self.window_length) - window_count + 1
+                sources = [w.entries for w in self.windows if w.index is not None and w.index >= first]
+            for entries in sources:
+                for key, entry in entries.items():
+                    if key not in merged:
+                        merged[key] = _MetricsEntry()
+                    merged[key].merge(entry)
+
+        requests = dict()
+        for (request_name, outcome), entry in merged.items():
+            if request_name not in requests:
+                requests[request_name] = {"count": 0, "errors": 0, "outcomes": dict()}
+            summary = requests[request_name]
+            summary["count"] += entry.latency.count
+            if outcome != OUTCOME_OK:
+                summary["errors"] += entry.latency.count
+            values = entry.latency.get_values()
+            values["queue_wait"] = entry.queue_wait.get_values()
+            values.update(entry.counters)
+            summary["outcomes"][outcome] = values
+
+        for summary in requests.values():
+            summary["error_rate"] = summary["errors"] / summary["count"]
+
+        return {"since": self.started if window is None else max(self.started, now - window),
+                "until": now,
+                "requests": requests}
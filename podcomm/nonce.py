@@ -1,20 +1,45 @@
 from .crc import crc16_table
+from .definitions import getLogger
 
 FAKE_NONCE = 0xD012FA62
+NONCE_STATE_VERSION = 1
+NONCE_SEEK_LIMIT = 10000
 
 
 class Nonce:
-    def __init__(self, lot, tid, seekNonce = None, seed = 0):
+    def __init__(self, lot, tid, seekNonce = None, seed = 0, state = None):
         self.lot = lot
         self.tid = tid
         self.lastNonce = None
         self.seed = seed
         self.ptr = None
         self.nonce_runs = 0
+        if state is not None and self._restore(state):
+            return
         self._initialize()
         if seekNonce is not None:
-            while self.lastNonce != seekNonce:
-                self.getNext(True)
+            self._seek(seekNonce)
+
+    def get_state(self):
+        return {"version": NONCE_STATE_VERSION,
+                "lot": self.lot,
+                "tid": self.tid,
+                "seed": self.seed,
+                "table": list(self.table),
+                "ptr": self.ptr,
+                "runs": self.nonce_runs,
+                "last": self.lastNonce}
+
+    def copy(self):
+        return Nonce(self.lot, self.tid, state=self.get_state())
+
+    def can_seek(self, seekNonce, limit = NONCE_SEEK_LIMIT):
+        probe = self.copy()
+        for i in range(0, limit):
+            probe.getNext(True)
+            if probe.lastNonce == seekNonce:
+                return True
+        return False
 
     def getNext(self, seeking = False):
         if not seeking and self.nonce_runs > 200:
@@ -27,6 +52,35 @@ class Nonce:
         self.nonce_runs += 1
         return nonce
 
+    def _restore(self, state):
+        try:
+            if state.get("version") != NONCE_STATE_VERSION:
+                return False
+            if state["lot"] != self.lot or state["tid"] != self.tid:
+                return False
+            table = [int(v) & 0xFFFFFFFF for v in state["table"]]
+            ptr = int(state["ptr"])
+            if len(table) != 18 or ptr < 2 or ptr > 17:
+                return False
+            self.table = table
+            self.ptr = ptr
+            self.seed = int(state["seed"])
+            self.nonce_runs = int(state["runs"])
+            self.lastNonce = state["last"]
+            return True
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return False
+
+    def _seek(self, seekNonce):
+        for i in range(0, NONCE_SEEK_LIMIT):
+            self.getNext(True)
+            if self.lastNonce == seekNonce:
+                return True
+        getLogger().warning("Nonce 0x%08x not found within %d steps, starting over" % (seekNonce, NONCE_SEEK_LIMIT))
+        self.nonce_runs = 0
+        self._initialize()
+        return False
+
     def reset(self):
         self.nonce_runs = 255
 
@@ -0,0 +1,151 @@
+from .nonce import Nonce, FAKE_NONCE
+from .protocol_common import PdmRequest
+from .definitions import *
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import re
+
+NONCE_SOLVER_MAX_POSITION = 256
+NONCE_SOLVER_SAMPLE = 3
+NONCE_SOLVER_MIN_SAMPLE = 2
+NONCE_SOLVER_CHUNK = 4096
+
+NONCE_REQUESTS = {PdmRequest.SetDeliveryFlags,
+                  PdmRequest.AcknowledgeAlerts,
+                  PdmRequest.ConfigureAlerts,
+                  PdmRequest.InsulinSchedule,
+                  PdmRequest.DeactivatePod,
+                  PdmRequest.CancelDelivery}
+
+_sent_msg_re = re.compile("SENT MSG ([0-9A-Fa-f]{8}) [0-9A-Fa-f]{2} (?:True|False) (.*)$")
+
+
+def _setup_pod_identity(tokens):
+    # SetupPod body: address, 0x14 0x04, month day year hour minute, lot, tid
+    body = bytes.fromhex(tokens[1])
+    if len(body) < 19:
+        return None
+    return int.from_bytes(body[0:4], "big"), int.from_bytes(body[11:15], "big"), \
+        int.from_bytes(body[15:19], "big")
+
+
+def nonces_from_packet_log(lines, radio_address=None, lot=None, tid=None):
+    # when lot and tid are given, a pod setup naming this pod starts its nonces over
+    # and a setup of another pod on the same radio address ends them
+    nonces = []
+    accepting = True
+    for line in lines:
+        m = _sent_msg_re.search(line)
+        if m is None:
+            continue
+
+        tokens = m.group(2).split()
+        if lot is not None and tid is not None and len(tokens) >= 2 \
+                and int(tokens[0], 16) == PdmRequest.SetupPod:
+            identity = _setup_pod_identity(tokens)
+            if identity is not None and (radio_address is None or identity[0] == radio_address):
+                nonces = []
+                accepting = identity[1] == lot and identity[2] == tid
+            continue
+
+        if not accepting:
+            continue
+        if radio_address is not None and int(m.group(1), 16) != radio_address:
+            continue
+
+        i = 0
+        while i + 1 < len(tokens):
+            cmd_type = int(tokens[i], 16)
+            if cmd_type in NONCE_REQUESTS and i + 2 < len(tokens):
+                nonces.append(int(tokens[i + 1], 16))
+                i += 3
+            else:
+                i += 2
+    return nonces
+
+
+def nonces_from_messages(messages):
+    nonces = []
+    for message in messages:
+        for part in message.get_parts():
+            if len(part) == 3:
+                cmd_type, _, nonce = part
+            else:
+                cmd_type, cmd_body = part
+                nonce = None
+                if cmd_type in NONCE_REQUESTS and len(cmd_body) >= 4:
+                    nonce = int.from_bytes(cmd_body[0:4], "big")
+            if nonce is not None and cmd_type in NONCE_REQUESTS:
+                nonces.append(nonce)
+    return nonces
+
+
+def _match_position(lot, tid, seed, observed, max_position):
+    # the observed nonces have to follow each other in the sequence, a partial
+    # match rules the seed out
+    nonce = Nonce(lot, tid, seed=seed)
+    for position in range(1, max_position + 1):
+        if nonce.getNext(True) == observed[0]:
+            for expected in observed[1:]:
+                if nonce.getNext(True) != expected:
+                    return None
+            return position + len(observed) - 1
+    return None
+
+
+def _search_seeds(lot, tid, seeds, observed, max_position):
+    for seed in seeds:
+        position = _match_position(lot, tid, seed, observed, max_position)
+        if position is not None:
+            return seed, position
+    return None
+
+
+def solve_nonce_seed(lot, tid, nonces, max_position=NONCE_SOLVER_MAX_POSITION, processes=None):
+    observed = [n for n in nonces if n is not None and n != FAKE_NONCE]
+    if len(observed) < NONCE_SOLVER_MIN_SAMPLE:
+        return None
+
+    # a single nonce matches a wrong seed too often, the shorter sample is only
+    # there for a resync between the last few nonces
+    samples = [observed[-NONCE_SOLVER_SAMPLE:]]
+    if len(samples[0]) > NONCE_SOLVER_MIN_SAMPLE:
+        samples.append(observed[-NONCE_SOLVER_MIN_SAMPLE:])
+
+    for sample in samples:
+        # nonce resyncs only ever produce 8-bit seeds, so try those on their own first
+        result = _search_seeds(lot, tid, range(0, 256), sample, max_position)
+        if result is not None:
+            return result
+
+        chunks = [range(start, min(start + NONCE_SOLVER_CHUNK, 65536))
+                  for start in range(256, 65536, NONCE_SOLVER_CHUNK)]
+        if processes is not None and processes > 1:
+            executor = ProcessPoolExecutor(max_workers=processes)
+            try:
+                futures = [executor.submit(_search_seeds, lot, tid, chunk, sample, max_position)
+                           for chunk in chunks]
+                for future in as_completed(futures):
+                    result = future.result()
+                    if result is not None:
+                        return result
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            for chunk in chunks:
+                result = _search_seeds(lot, tid, chunk, sample, max_position)
+                if result is not None:
+                    return result
+    return None
+
+
+def recover_nonce(lot, tid, nonces, max_position=NONCE_SOLVER_MAX_POSITION, processes=None):
+    result = solve_nonce_seed(lot, tid, nonces, max_position=max_position, processes=processes)
+    if result is None:
+        return None
+
+    seed, position = result
+    nonce = Nonce(lot, tid, seed=seed)
+    for i in range(0, position):
+        nonce.getNext(True)
+    getLogger().info("Recovered nonce seed 0x%04x at position %d" % (seed, position))
+    return nonce
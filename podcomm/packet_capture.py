@@ -0,0 +1,235 @@
+from .definitions import *
+from .protocol_common import RadioPacket
+from threading import Lock
+from datetime import datetime
+import fcntl
+import math
+import mmap
+import struct
+import time
+
+CAPTURE_SEND = 0
+CAPTURE_RECV = 1
+CAPTURE_RECV_BAD = 2
+CAPTURE_RECV_NONE = 3
+CAPTURE_SILENCE = 4
+CAPTURE_WAKE = 5
+
+CAPTURE_MAGIC = b"OPCR"
+CAPTURE_VERSION = 1
+CAPTURE_FRAME_SIZE = 64
+CAPTURE_NO_RSSI = -32768
+
+# magic, version, record count, records written
+_capture_header = struct.Struct("<4sHxxIQ")
+# timestamp, direction, rssi in half dBm, frame length, frame
+_capture_record = struct.Struct("<dBhB%ds" % CAPTURE_FRAME_SIZE)
+# wake window samples ride in the frame: gap (nan when unknown), candidate, responded, duration
+_wake_sample = struct.Struct("<dB?d")
+
+
+class CaptureRecord:
+    __slots__ = ("timestamp", "direction", "rssi", "frame")
+
+    def __init__(self, timestamp, direction, rssi, frame):
+        self.timestamp = timestamp
+        self.direction = direction
+        self.rssi = rssi
+        self.frame = frame
+
+    def __str__(self):
+        ts = datetime.fromtimestamp(self.timestamp)
+        return "%s,%03d %s" % (ts.strftime("%Y-%m-%d %H:%M:%S"), ts.microsecond // 1000, self.get_message())
+
+    def get_wake_sample(self):
+        gap, candidate_index, responded, duration = _wake_sample.unpack_from(self.frame)
+        if math.isnan(gap):
+            gap = None
+        return gap, candidate_index, responded, duration
+
+    def get_message(self):
+        if self.direction == CAPTURE_WAKE:
+            gap, candidate_index, responded, duration = self.get_wake_sample()
+            return "Wake gap: %s candidate: %d responded: %s duration: %.3f" % \
+                   (gap, candidate_index, responded, duration)
+        elif self.direction == CAPTURE_SEND:
+            return "SEND PKT %s" % self._get_packet_string()
+        elif self.direction == CAPTURE_RECV:
+            return "RECV PKT %s" % self._get_packet_string()
+        elif self.direction == CAPTURE_RECV_BAD:
+            return "RECV PKT BAD DATA: %s" % self.frame.hex()
+        elif self.direction == CAPTURE_SILENCE:
+            return "Silence"
+        else:
+            return "RECV PKT None"
+
+    def _get_packet_string(self):
+        p = RadioPacket.parse(self.frame)
+        if p is None:
+            return self.frame.hex()
+        return str(p)
+
+
+class PacketCapture:
+    # the capture file can be shared by several processes, every access takes
+    # an flock on it and the record counter is only ever read from the header
+    def __init__(self, path, record_count=4096):
+        self.path = path
+        self.lock = Lock()
+        self.file = open(path, "a+b")
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        try:
+            self.file.seek(0)
+            header = self.file.read(_capture_header.size)
+            self.file.seek(0, 2)
+            existing = self.file.tell()
+
+            valid = False
+            if len(header) == _capture_header.size:
+                magic, version, count, written = _capture_header.unpack(header)
+                if magic == CAPTURE_MAGIC and version == CAPTURE_VERSION:
+                    if record_count is None:
+                        record_count = count
+                    valid = count == record_count
+            if record_count is None:
+                record_count = 4096
+
+            self.record_count = record_count
+            size = _capture_header.size + record_count * _capture_record.size
+            if existing != size:
+                self.file.truncate(size)
+            self.map = mmap.mmap(self.file.fileno(), size)
+            if not valid:
+                _capture_header.pack_into(self.map, 0, CAPTURE_MAGIC, CAPTURE_VERSION, record_count, 0)
+        finally:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+    def add(self, timestamp, direction, frame=b"", rssi=None):
+        # the timestamp comes from the caller's clock, so simulated runs line up with their logs
+        if rssi is None:
+            rssi = CAPTURE_NO_RSSI
+        else:
+            rssi = int(rssi * 2)
+        length = min(len(frame), CAPTURE_FRAME_SIZE)
+        with self.lock:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            try:
+                written = self.get_written()
+                offset = _capture_header.size + (written % self.record_count) * _capture_record.size
+                _capture_record.pack_into(self.map, offset, timestamp, direction, rssi, length,
+                                          bytes(frame[:length]))
+                _capture_header.pack_into(self.map, 0, CAPTURE_MAGIC, CAPTURE_VERSION, self.record_count,
+                                          written + 1)
+            finally:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+    def add_wake_sample(self, timestamp, gap, candidate_index, responded, duration):
+        if gap is None:
+            gap = math.nan
+        self.add(timestamp, CAPTURE_WAKE, _wake_sample.pack(gap, candidate_index, responded, duration))
+
+    def get_wake_samples(self, last=None):
+        return [r.get_wake_sample() for r in self.get_records(last) if r.direction == CAPTURE_WAKE]
+
+    def get_written(self):
+        return _capture_header.unpack_from(self.map, 0)[3]
+
+    def get_records(self, last=None, since=None):
+        records, written = self._read_records(last, since)
+        return records
+
+    def export(self, stream, last=None):
+        for record in self.get_records(last):
+            stream.write("%s\n" % record)
+
+    def tail(self, stream, last=20, interval=0.5):
+        since = max(0, self.get_written() - last)
+        while True:
+            records, since = self._read_records(since=since)
+            for record in records:
+                stream.write("%s\n" % record)
+            stream.flush()
+            time.sleep(interval)
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        with self.lock:
+            self.map.close()
+            self.file.close()
+
+    def _read_records(self, last=None, since=None):
+        # returns the records and the counter they were read up to
+        with self.lock:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_SH)
+            try:
+                written = self.get_written()
+                first = max(0, written - self.record_count)
+                if last is not None:
+                    first = max(first, written - last)
+                if since is not None:
+                    first = max(first, since)
+                raw = []
+                for i in range(first, written):
+                    offset = _capture_header.size + (i % self.record_count) * _capture_record.size
+                    raw.append(_capture_record.unpack_from(self.map, offset))
+            finally:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+        records = []
+        for timestamp, direction, rssi, length, frame in raw:
+            if rssi == CAPTURE_NO_RSSI:
+                rssi = None
+            else:
+                rssi = rssi / 2
+            records.append(CaptureRecord(timestamp, direction, rssi, frame[:length]))
+        return records, written
+
+
+class NullPacketCapture:
+    def add(self, timestamp, direction, frame=b"", rssi=None):
+        pass
+
+    def add_wake_sample(self, timestamp, gap, candidate_index, responded, duration):
+        pass
+
+
+packet_capture = None
+null_packet_capture = NullPacketCapture()
+
+
+def enable_packet_capture(path=None):
+    global packet_capture
+
+    if packet_capture is None:
+        if path is None:
+            ensure_log_dir()
+            path = DATA_PATH + OMNIPY_PACKET_LOGFILE + CAPTURE_SUFFIX
+        packet_capture = PacketCapture(path)
+
+    return packet_capture
+
+
+def get_packet_capture():
+    # capture is off unless the process turned it on
+    if packet_capture is None:
+        return null_packet_capture
+    return packet_capture
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Print the binary packet capture in packet log format")
+    parser.add_argument("path", nargs="?", default=DATA_PATH + OMNIPY_PACKET_LOGFILE + CAPTURE_SUFFIX)
+    parser.add_argument("-n", "--last", type=int, default=None)
+    parser.add_argument("-f", "--follow", action="store_true")
+    args = parser.parse_args()
+
+    capture = PacketCapture(args.path, record_count=None)
+    if args.follow:
+        capture.tail(sys.stdout, last=args.last or 20)
+    else:
+        capture.export(sys.stdout, args.last)
@@ -1,5 +1,6 @@
 import abc
 from enum import IntEnum
+from .device_cache import get_device_cache
 
 
 class TxPower(IntEnum):
@@ -11,6 +12,9 @@ class TxPower(IntEnum):
 
 
 class PacketRadio(abc.ABC):
+    device_kind = None
+    device_cache = None
+
     @abc.abstractmethod
     def __init__(self):
         pass
@@ -53,4 +57,44 @@ class PacketRadio(abc.ABC):
 
     @abc.abstractmethod
     def send_packet(self, packet, repeat_count, delay_ms, preamble_extension_ms):
-        pass
\ No newline at end of file
+        pass
+
+    def get_tx_level_count(self):
+        return 0
+
+    def get_tx_level(self, tx_power):
+        return None
+
+    def set_tx_level(self, level):
+        pass
+
+    def encode_packet(self, packet):
+        # radios that encode on the host return a frame for send_and_receive_encoded
+        return None
+
+    def send_and_receive_encoded(self, encoded, repeat_count, delay_ms, timeout_ms, retry_count, preamble_ext_ms):
+        raise NotImplementedError()
+
+    def get_cached_device(self):
+        if self.device_kind is None:
+            return None
+        return self._get_device_cache().get(self.device_kind)
+
+    def update_cached_device(self, **values):
+        if self.device_kind is not None:
+            self._get_device_cache().update(self.device_kind, **values)
+
+    def _get_device_cache(self):
+        if self.device_cache is None:
+            self.device_cache = get_device_cache()
+        return self.device_cache
+
+    def reset_link(self):
+        # the next connect has to start over, a shared link may drop it later
+        self.disconnect(ignore_errors=True)
+
+    def begin_exchange(self, priority=None):
+        pass
+
+    def end_exchange(self):
+        pass
@@ -1,17 +1,31 @@
 from .protocol import *
 from .protocol_radio import PdmRadio
+from .metrics import ExchangeMetrics
+from .connection import ConnectionManager
 from .nonce import *
+from .nonce_solver import recover_nonce, nonces_from_packet_log
 from .exceptions import PdmError, OmnipyError, PdmBusyError, StatusUpdateRequired
 from .definitions import *
 from .packet_radio import TxPower
-from decimal import *
+from .pulses import Pulses
 from datetime import datetime, timedelta
-from threading import RLock
+from threading import RLock, Thread
 import time
 
 
 g_lock = RLock()
 
+NONCE_PRIME_LOCK_TIMEOUT = 30
+
+MINIMUM_BASAL_RATE = Pulses(1)
+MAXIMUM_BASAL_RATE = Pulses.from_units(30)
+
+
+def _schedule_units(schedule):
+    if schedule is None:
+        return None
+    return [Pulses.from_units(entry).to_units() for entry in schedule]
+
 
 class PdmLock():
     def __init__(self, timeout=2):
@@ -27,15 +41,22 @@ class PdmLock():
 
 
 class Pdm:
-    def __init__(self, pod):
+    def __init__(self, pod, packet_radio=None, clock=time, retry_policy=None):
         if pod is None:
             raise PdmError("Cannot instantiate pdm without pod")
 
         self.pod = pod
+        self.packet_radio = packet_radio
+        self.clock = clock
+        self.retry_policy = retry_policy
         self.nonce = None
         self.radio = None
         self.time_adjustment = 0
         self.debug_status_skip = False
+        self.status_snapshot = None
+        self.metrics = ExchangeMetrics(clock=clock)
+        self.connection = ConnectionManager(clock=clock)
+        self.request_listener = None
         self.logger = getLogger()
 
     def stop_radio(self):
@@ -46,16 +67,66 @@ class Pdm:
     def start_radio(self):
         self.get_radio(new=True)
 
+    def expect_request(self, at):
+        self.connection.expect_request(at)
+
     def get_nonce(self):
         if self.nonce is None:
             if self.pod.id_lot is None or self.pod.id_t is None:
                 return None
             if self.pod.nonce_last is None or self.pod.nonce_seed is None:
-                self.nonce = Nonce(self.pod.id_lot, self.pod.id_t)
+                self.nonce = Nonce(self.pod.id_lot, self.pod.id_t, state=self.pod.nonce_state)
             else:
-                self.nonce = Nonce(self.pod.id_lot, self.pod.id_t, self.pod.nonce_last, self.pod.nonce_seed)
+                self.nonce = Nonce(self.pod.id_lot, self.pod.id_t, self.pod.nonce_last, self.pod.nonce_seed,
+                                   state=self.pod.nonce_state)
         return self.nonce
 
+    def prime_nonce(self, nonces=None, processes=None):
+        if self.pod.id_lot is None or self.pod.id_t is None:
+            return False
+
+        # held for the whole search so that no request goes out with a nonce behind the log
+        with PdmLock(NONCE_PRIME_LOCK_TIMEOUT):
+            if nonces is None:
+                log_path = DATA_PATH + OMNIPY_PACKET_LOGFILE + LOGFILE_SUFFIX
+                if not os.path.isfile(log_path):
+                    return False
+                with open(log_path, "r") as stream:
+                    nonces = nonces_from_packet_log(stream, self.pod.radio_address,
+                                                    self.pod.id_lot, self.pod.id_t)
+
+            if len(nonces) == 0:
+                return False
+
+            saved = self.get_nonce()
+            if saved.lastNonce == nonces[-1] or saved.can_seek(nonces[-1]):
+                return False
+
+            self.logger.info("Nonce state is behind the packet log, recovering nonce seed")
+            nonce = recover_nonce(self.pod.id_lot, self.pod.id_t, nonces, processes=processes)
+            if nonce is None:
+                self.logger.warning("Failed to recover nonce seed, resync will be needed")
+                return False
+
+            if saved.lastNonce is not None and nonce.can_seek(saved.lastNonce):
+                self.logger.info("Nonce state is ahead of the packet log, keeping it")
+                return False
+
+            self.nonce = nonce
+            self._savePod()
+            return True
+
+    def start_nonce_priming(self, processes=None):
+        t = Thread(target=self._prime_nonce_background, args=(processes,))
+        t.setDaemon(True)
+        t.start()
+
+    def _prime_nonce_background(self, processes):
+        try:
+            self.prime_nonce(processes=processes)
+        except:
+            self.logger.exception("Error while priming nonce from packet log")
+
     def get_radio(self, new=False):
         if self.radio is not None and new:
             self.radio.stop()
@@ -68,13 +139,26 @@ class Pdm:
 
             self.radio = PdmRadio(self.pod.radio_address,
                                   msg_sequence=self.pod.radio_message_sequence,
-                                  pkt_sequence=self.pod.radio_packet_sequence)
+                                  pkt_sequence=self.pod.radio_packet_sequence,
+                                  tx_level=self.pod.radio_tx_level,
+                                  wake_model_state=self.pod.radio_wake_model,
+                                  packet_radio=self.packet_radio,
+                                  metrics=self.metrics,
+                                  connection=self.connection,
+                                  clock=self.clock,
+                                  retry_policy=self.retry_policy)
+            self.radio.request_listener = self._on_radio_request
 
         return self.radio
 
+    def _on_radio_request(self, request):
+        listener = self.request_listener
+        if listener is not None:
+            listener(request)
+
     def send_request(self, request, with_nonce=False, double_take=False,
                         expect_critical_follow_up=False,
-                        tx_power=TxPower.Normal):
+                        tx_power=None):
 
         nonce_obj = self.get_nonce()
         if with_nonce:
@@ -85,7 +169,7 @@ class Pdm:
         response = self.get_radio().send_message_get_message(request, double_take=double_take,
                                                              expect_critical_follow_up=expect_critical_follow_up,
                                                              tx_power=tx_power)
-        response_parse(response, self.pod)
+        self._parse_response(response)
 
         if with_nonce and self.pod.nonce_syncword is not None:
             self.logger.info("Nonce resync requested")
@@ -96,12 +180,17 @@ class Pdm:
             self.get_radio().message_sequence = request.sequence
             response = self.get_radio().send_message_get_message(request, double_take=double_take,
                                                                  expect_critical_follow_up=expect_critical_follow_up)
-            response_parse(response, self.pod)
+            self._parse_response(response)
             if self.pod.nonce_syncword is not None:
                 self.get_nonce().reset()
                 raise PdmError("Nonce sync failed")
 
 
+    def _parse_response(self, response):
+        for snapshot in response_parse(response, self.pod):
+            if isinstance(snapshot, StatusSnapshot):
+                self.status_snapshot = snapshot
+
     def _internal_update_status(self, update_type=0):
         if self.debug_status_skip:
             return
@@ -238,7 +327,8 @@ class Pdm:
     def bolus(self, bolus_amount):
         try:
             with PdmLock():
-                self.pod.last_command = {"command": "BOLUS", "units": bolus_amount, "success": False}
+                bolus_amount = Pulses.from_units(bolus_amount, exact=True)
+                self.pod.last_command = {"command": "BOLUS", "units": bolus_amount.to_units(), "success": False}
 
                 self._assert_pod_address_assigned()
                 self._assert_can_generate_nonce()
@@ -247,16 +337,17 @@ class Pdm:
                 self._assert_not_faulted()
                 self._assert_status_running()
 
-                if self.pod.var_maximum_bolus is not None and bolus_amount > self.pod.var_maximum_bolus:
+                if self.pod.var_maximum_bolus is not None and \
+                        bolus_amount > Pulses.from_units(self.pod.var_maximum_bolus):
                     raise PdmError("Bolus exceeds defined maximum bolus of %.2fU" % self.pod.var_maximum_bolus)
 
-                if bolus_amount < DECIMAL_0_05:
+                if bolus_amount.count < 1:
                     raise PdmError("Cannot do a bolus less than 0.05U")
 
                 if self._is_bolus_running():
                     raise PdmError("A previous bolus is already running")
 
-                if bolus_amount > self.pod.insulin_reservoir:
+                if bolus_amount > Pulses.from_units(self.pod.insulin_reservoir):
                     raise PdmError("Cannot bolus %.2f units, insulin_reservoir capacity is at: %.2f")
 
                 self.logger.debug("Bolusing %0.2f" % float(bolus_amount))
@@ -267,7 +358,7 @@ class Pdm:
                     raise PdmError("Pod did not confirm bolus")
 
                 self.pod.last_enacted_bolus_start = self.get_time()
-                self.pod.last_enacted_bolus_amount = float(bolus_amount)
+                self.pod.last_enacted_bolus_amount = bolus_amount.to_units()
                 self.pod.last_command["success"] = True
         except StatusUpdateRequired:
             self.logger.info("Requesting status update first")
@@ -351,10 +442,11 @@ class Pdm:
     def set_temp_basal(self, basalRate, hours, confidenceReminder=False):
         try:
             with PdmLock():
+                basalRate = Pulses.from_units(basalRate, exact=True)
                 self.logger.debug("Setting temp basal %02.2fU/h for %02.1fh"% (float(basalRate), float(hours)))
                 self.pod.last_command = {"command": "TEMPBASAL",
                                          "duration_hours": hours,
-                                         "hourly_rate": basalRate,
+                                         "hourly_rate": basalRate.to_units(),
                                          "success": False}
                 if not self.debug_status_skip:
                     self._assert_pod_address_assigned()
@@ -368,9 +460,9 @@ class Pdm:
                         raise PdmError("Requested duration is not valid")
 
                     if self.pod.var_maximum_temp_basal_rate is not None and \
-                            basalRate > Decimal(self.pod.var_maximum_temp_basal_rate):
+                            basalRate > Pulses.from_units(self.pod.var_maximum_temp_basal_rate):
                         raise PdmError("Requested rate exceeds maximum temp basal setting")
-                    if basalRate > Decimal(30):
+                    if basalRate > MAXIMUM_BASAL_RATE:
                         raise PdmError("Requested rate exceeds maximum temp basal capability")
 
                     if self._is_temp_basal_active():
@@ -388,7 +480,7 @@ class Pdm:
                 else:
                     self.pod.last_enacted_temp_basal_duration = float(hours)
                     self.pod.last_enacted_temp_basal_start = self.get_time()
-                    self.pod.last_enacted_temp_basal_amount = float(basalRate)
+                    self.pod.last_enacted_temp_basal_amount = basalRate.to_units()
                     self.pod.last_command["success"] = True
 
         except StatusUpdateRequired:
@@ -405,7 +497,7 @@ class Pdm:
             with PdmLock():
                 self.logger.debug("Setting basal schedule: %s"% schedule)
                 self.pod.last_command = {"command": "BASALSCHEDULE",
-                                         "hourly_rates": schedule,
+                                         "hourly_rates": _schedule_units(schedule),
                                          "success": False}
                 self._assert_pod_address_assigned()
                 self._assert_can_generate_nonce()
@@ -432,7 +524,7 @@ class Pdm:
                 if self.pod.state_basal != BasalState.Program:
                     raise PdmError("Failed to set basal schedule")
                 else:
-                    self.pod.var_basal_schedule = schedule
+                    self.pod.var_basal_schedule = _schedule_units(schedule)
                     self.pod.last_command["success"] = True
 
         except StatusUpdateRequired:
@@ -496,7 +588,7 @@ class Pdm:
                     response = self.get_radio().send_message_get_message(request, message_address=0xffffffff,
                                                                          ack_address_override=candidate_address,
                                                                          tx_power=TxPower.Low)
-                    response_parse(response, self.pod)
+                    self._parse_response(response)
 
                     self._assert_pod_can_activate()
                 else:
@@ -525,7 +617,7 @@ class Pdm:
                     response = self.get_radio().send_message_get_message(request, message_address=0xffffffff,
                                                                          ack_address_override=candidate_address,
                                                                          tx_power=TxPower.Low)
-                    response_parse(response, self.pod)
+                    self._parse_response(response)
                     self._assert_pod_paired()
 
                 self.pod.last_command["success"] = True
@@ -560,6 +652,7 @@ class Pdm:
 
                     self.pod.nonce_seed = 0
                     self.pod.nonce_last = None
+                    self.pod.nonce_state = None
 
                     # if self.pod.var_alert_low_reservoir is not None:
                     #     if not self.pod.var_alert_low_reservoir_set:
@@ -588,11 +681,11 @@ class Pdm:
                     request = request_prime_cannula()
                     self.send_request(request, with_nonce=True)
 
-                    time.sleep(55)
+                    self.clock.sleep(55)
 
                 self._internal_update_status()
                 while self.pod.state_progress != PodProgress.ReadyForInjection:
-                    time.sleep(5)
+                    self.clock.sleep(5)
                     self._internal_update_status()
 
                 # if self.pod.state_progress == PodProgress.ReadyForInjection:
@@ -619,7 +712,7 @@ class Pdm:
 
                 self.logger.debug("Starting pod")
                 self.pod.last_command = {"command": "START",
-                                         "hourly_rates": basal_schedule,
+                                         "hourly_rates": _schedule_units(basal_schedule),
                                          "success": False}
                 self._internal_update_status()
                 if self.pod.state_progress >= PodProgress.Running:
@@ -675,7 +768,7 @@ class Pdm:
                         raise PdmError("Pod did not acknowledge cannula insertion start")
 
                 if self.pod.state_progress == PodProgress.Inserting:
-                    time.sleep(13)
+                    self.clock.sleep(13)
                     self._internal_update_status()
                     if self.pod.state_progress != PodProgress.Running:
                         raise PdmError("Pod did not get to running state")
@@ -697,11 +790,14 @@ class Pdm:
             if radio is not None:
                 self.pod.radio_message_sequence = radio.message_sequence
                 self.pod.radio_packet_sequence = radio.packet_sequence
+                self.pod.radio_tx_level = radio.tx_power_controller.level
+                self.pod.radio_wake_model = radio.wake_model.get_state()
 
             nonce = self.get_nonce()
             if nonce is not None:
                 self.pod.nonce_last = nonce.lastNonce
                 self.pod.nonce_seed = nonce.seed
+                self.pod.nonce_state = nonce.get_state()
 
             return self.pod.Save()
         except Exception as e:
@@ -769,13 +865,11 @@ class Pdm:
         if len(schedule) != 48:
             raise PdmError("A full schedule of 48 half hours is needed")
 
-        min_rate = Decimal("0.05")
-        max_rate = Decimal("30")
-
         for entry in schedule:
-            if entry < min_rate:
+            entry = Pulses.from_units(entry, exact=True)
+            if entry < MINIMUM_BASAL_RATE:
                 raise PdmError("A basal rate schedule entry cannot be less than 0.05U/h")
-            if entry > max_rate:
+            if entry > MAXIMUM_BASAL_RATE:
                 raise PdmError("A basal rate schedule entry cannot be more than 30U/h")
 
     def _assert_pod_address_not_assigned(self):
@@ -862,4 +956,4 @@ class Pdm:
         self.time_adjustment = adjustment
 
     def get_time(self):
-        return time.time() + self.time_adjustment
\ No newline at end of file
+        return self.clock.time() + self.time_adjustment
\ No newline at end of file
@@ -17,10 +17,13 @@ class Pod:
         self.radio_message_sequence = 0
         self.radio_low_gain = None
         self.radio_rssi = None
+        self.radio_tx_level = None
+        self.radio_wake_model = None
 
         self.nonce_last = None
         self.nonce_seed = 0
         self.nonce_syncword = None
+        self.nonce_state = None
 
         self.state_last_updated = None
         self.state_progress = PodProgress.InitialState
@@ -116,6 +119,8 @@ class Pod:
             p.radio_message_sequence = d.get("radio_message_sequence", None)
             p.radio_low_gain = d.get("radio_low_gain", None)
             p.radio_rssi = d.get("radio_rssi", None)
+            p.radio_tx_level = d.get("radio_tx_level", None)
+            p.radio_wake_model = d.get("radio_wake_model", None)
 
             p.state_last_updated = d.get("state_last_updated", None)
             p.state_progress = d.get("state_progress", None)
@@ -142,6 +147,7 @@ class Pod:
             p.nonce_last = d.get("nonce_last", None)
             p.nonce_seed = d.get("nonce_seed", None)
             p.nonce_syncword = d.get("nonce_syncword", None)
+            p.nonce_state = d.get("nonce_state", None)
 
             p.last_command = d.get("last_command", None)
             p.last_enacted_temp_basal_start = d.get("last_enacted_temp_basal_start", None)
@@ -0,0 +1,221 @@
+from .packet_radio import PacketRadio, TxPower
+from .exceptions import PacketRadioError
+from collections import deque
+import math
+import random
+import time
+
+# manchester encoded at 40.625 kbps, in milliseconds per byte
+AIR_MS_PER_BYTE = 16 / 40.625
+
+
+class ChannelProfile:
+    def __init__(self, name, loss=0.0, burst_enter=0.0, burst_exit=1.0, burst_loss=0.0,
+                 rssi=-70.0, rssi_deviation=0.0, sensitivity=-100.0, rssi_slope=2.0,
+                 corruption=0.0, duplication=0.0, reorder=0.0,
+                 stall=0.0, stall_ms=0, stall_error=False,
+                 ble_latency_ms=15, pod_turnaround_ms=10, tx_levels=8, tx_step_db=3.0):
+        self.name = name
+        # uniform frame loss
+        self.loss = loss
+        # gilbert-elliott: chance per frame to enter and leave the burst state,
+        # and the loss while in it
+        self.burst_enter = burst_enter
+        self.burst_exit = burst_exit
+        self.burst_loss = burst_loss
+        # frames received below sensitivity are increasingly lost
+        self.rssi = rssi
+        self.rssi_deviation = rssi_deviation
+        self.sensitivity = sensitivity
+        self.rssi_slope = rssi_slope
+        self.corruption = corruption
+        self.duplication = duplication
+        self.reorder = reorder
+        # ble command stalls, optionally ending in a radio error
+        self.stall = stall
+        self.stall_ms = stall_ms
+        self.stall_error = stall_error
+        self.ble_latency_ms = ble_latency_ms
+        self.pod_turnaround_ms = pod_turnaround_ms
+        self.tx_levels = tx_levels
+        self.tx_step_db = tx_step_db
+
+
+PROFILE_CLEAN = ChannelProfile("clean")
+PROFILE_LOSSY = ChannelProfile("lossy", loss=0.1, corruption=0.02)
+PROFILE_BURSTY = ChannelProfile("bursty", loss=0.02, burst_enter=0.05, burst_exit=0.25, burst_loss=0.9)
+PROFILE_WEAK = ChannelProfile("weak", rssi=-96.0, rssi_deviation=4.0, sensitivity=-100.0)
+PROFILE_NOISY = ChannelProfile("noisy", loss=0.05, corruption=0.1, duplication=0.05, reorder=0.05)
+PROFILE_STALLS = ChannelProfile("stalls", loss=0.02, stall=0.03, stall_ms=2500, stall_error=True)
+
+CHANNEL_PROFILES = [PROFILE_CLEAN, PROFILE_LOSSY, PROFILE_BURSTY, PROFILE_WEAK, PROFILE_NOISY, PROFILE_STALLS]
+
+
+class ChannelStatistics:
+    def __init__(self):
+        self.calls = 0
+        self.frames_sent = 0
+        self.frames_lost = 0
+        self.frames_corrupted = 0
+        self.frames_duplicated = 0
+        self.frames_reordered = 0
+        self.stalls = 0
+
+
+class ChannelModel(PacketRadio):
+    def __init__(self, radio, profile=PROFILE_CLEAN, clock=None, seed=0):
+        self.radio = radio
+        self.profile = profile
+        self.clock = clock
+        self.random = random.Random(seed)
+        self.burst = False
+        self.pending = deque()
+        self.statistics = ChannelStatistics()
+        self.tx_level = self.get_tx_level(TxPower.Normal)
+
+    def connect(self, force_initialize=False):
+        self._stall()
+        return self.radio.connect(force_initialize=force_initialize)
+
+    def disconnect(self, ignore_errors=True):
+        return self.radio.disconnect(ignore_errors=ignore_errors)
+
+    def get_info(self):
+        return self.radio.get_info()
+
+    def init_radio(self, force_init=False):
+        return self.radio.init_radio(force_init=force_init)
+
+    def tx_up(self):
+        self.set_tx_level(self.tx_level + 1)
+
+    def tx_down(self):
+        self.set_tx_level(self.tx_level - 1)
+
+    def set_tx_power(self, tx_power):
+        self.set_tx_level(self.get_tx_level(tx_power))
+
+    def get_tx_level_count(self):
+        return self.profile.tx_levels
+
+    def get_tx_level(self, tx_power):
+        return int(round(int(tx_power) * (self.profile.tx_levels - 1) / int(TxPower.Highest)))
+
+    def set_tx_level(self, level):
+        self.tx_level = min(max(0, level), self.profile.tx_levels - 1)
+
+    def get_packet(self, timeout=5.0):
+        self._stall()
+        if len(self.pending) > 0:
+            self._sleep_ms(self.profile.ble_latency_ms)
+            return self.pending.popleft()
+        self._sleep_ms(timeout * 1000)
+        return None
+
+    def send_and_receive_packet(self, packet, repeat_count, delay_ms, timeout_ms, retry_count, preamble_ext_ms):
+        self._stall()
+        self.statistics.calls += 1
+        self._sleep_ms(self.profile.ble_latency_ms)
+
+        for attempt in range(0, retry_count + 1):
+            received = self._transmit(packet, repeat_count, delay_ms, preamble_ext_ms)
+            response = None
+            if received:
+                response = self.radio.send_and_receive_packet(packet, 0, 0, timeout_ms, 0, 0)
+            if response is not None:
+                response = self._receive(response)
+
+            # a frame held back earlier shows up in place of the current one
+            if len(self.pending) > 0:
+                if response is not None:
+                    self.pending.append(response)
+                response = self.pending.popleft()
+
+            if response is not None:
+                self._sleep_ms(self.profile.pod_turnaround_ms + (len(response) - 2) * AIR_MS_PER_BYTE)
+                return response
+            self._sleep_ms(timeout_ms)
+        return None
+
+    def send_packet(self, packet, repeat_count, delay_ms, preamble_extension_ms):
+        self._stall()
+        self.statistics.calls += 1
+        self._sleep_ms(self.profile.ble_latency_ms)
+        if self._transmit(packet, repeat_count, delay_ms, preamble_extension_ms):
+            self.radio.send_packet(packet, 0, 0, 0)
+
+    def _transmit(self, packet, repeat_count, delay_ms, preamble_ext_ms):
+        # the pod hears the packet if any of the repeats gets through intact
+        received = False
+        for i in range(0, repeat_count + 1):
+            self.statistics.frames_sent += 1
+            self._sleep_ms(preamble_ext_ms + len(packet) * AIR_MS_PER_BYTE + delay_ms)
+            if self._lost(self.profile.tx_step_db * (self.tx_level - self.get_tx_level(TxPower.Normal))):
+                continue
+            if self.random.random() < self.profile.corruption:
+                self.statistics.frames_corrupted += 1
+                continue
+            received = True
+        return received
+
+    def _receive(self, response):
+        if self._lost(0):
+            return None
+
+        response = bytearray(response)
+        if self.random.random() < self.profile.corruption:
+            self.statistics.frames_corrupted += 1
+            bit = self.random.randrange(16, len(response) * 8)
+            response[bit // 8] ^= 1 << (bit % 8)
+        rssi = self._get_rssi(0)
+        response[0] = min(255, max(0, int(255 + 2 * (rssi + 73))))
+        response = bytes(response)
+
+        if self.random.random() < self.profile.duplication:
+            self.statistics.frames_duplicated += 1
+            self.pending.append(response)
+        if self.random.random() < self.profile.reorder:
+            self.statistics.frames_reordered += 1
+            self.pending.append(response)
+            return None
+        return response
+
+    def _lost(self, gain):
+        profile = self.profile
+        if self.burst:
+            if self.random.random() < profile.burst_exit:
+                self.burst = False
+        elif self.random.random() < profile.burst_enter:
+            self.burst = True
+
+        loss = profile.loss
+        if self.burst:
+            loss = max(loss, profile.burst_loss)
+        margin = (self._get_rssi(gain) - profile.sensitivity) / profile.rssi_slope
+        loss = 1 - (1 - loss) * (1 - 1 / (1 + math.exp(min(50.0, margin))))
+
+        if self.random.random() < loss:
+            self.statistics.frames_lost += 1
+            return True
+        return False
+
+    def _get_rssi(self, gain):
+        rssi = self.profile.rssi + gain
+        if self.profile.rssi_deviation > 0:
+            rssi += self.random.gauss(0, self.profile.rssi_deviation)
+        return rssi
+
+    def _stall(self):
+        if self.profile.stall > 0 and self.random.random() < self.profile.stall:
+            self.statistics.stalls += 1
+            self._sleep_ms(self.profile.stall_ms)
+            if self.profile.stall_error:
+                raise PacketRadioError("Simulated BLE stall")
+
+    def _sleep_ms(self, ms):
+        if ms <= 0:
+            return
+        if self.clock is None:
+            time.sleep(ms / 1000)
+        else:
+            self.clock.sleep(ms / 1000)
@@ -5,17 +5,32 @@ import time
 from .packet_radio import PacketRadio, TxPower
 from .definitions import *
 from enum import IntEnum
-from threading import Event
+from threading import Event, Thread, Lock
 from .exceptions import PacketRadioError
-from .manchester import ManchesterCodec
+from .manchester import ManchesterCodec, FRAME_LENGTH
+from .crc import crc16
+from .ble_transport import BleCommandTransport, GATT_PROPERTY_WRITE_NO_RESPONSE, ATT_DEFAULT_MTU, \
+    ATT_WRITE_OVERHEAD
 
-from bluepy.btle import Peripheral, Scanner, BTLEException
+try:
+    from bluepy.btle import Peripheral, Scanner, BTLEException
+except ImportError:
+    # left to fail on first use, so a fake peripheral can stand in without bluepy
+    Peripheral = None
+    Scanner = None
+
+    class BTLEException(Exception):
+        pass
 
 XGATT_BATTERYSERVICE_UUID = "180f"
 XGATT_BATTERY_CHAR_UUID = "2a19"
 RILEYLINK_SERVICE_UUID = "0235733b-99c5-4197-b856-69219c2a3845"
 RILEYLINK_DATA_CHAR_UUID = "c842e849-5028-42e2-867c-016adada9155"
 RILEYLINK_RESPONSE_CHAR_UUID = "6e6c7910-b89e-43a5-a0fe-50c5e2b81f4a"
+RILEYLINK_REQUESTED_MTU = 185
+
+_send_and_listen_header = struct.Struct(">BBHBLBH")
+_send_packet_header = struct.Struct(">BBHH")
 
 class Command(IntEnum):
     GET_STATE = 1
@@ -87,14 +102,103 @@ PA_LEVELS = [0x0E,
              0x84, 0x84,
              0xC8]
 
+TX_POWER_PA_LEVELS = {TxPower.Lowest: 0x0E,
+                      TxPower.Low: 0x1D,
+                      TxPower.Normal: 0x84,
+                      TxPower.High: 0xC8,
+                      TxPower.Highest: 0xC8}
+
 g_rl_address = None
 g_rl_version = None
 g_rl_v_major = None
 g_rl_v_minor = None
+g_rl_shadows = dict()
+g_rl_rescan = None
+g_rl_rescan_lock = Lock()
+
+RADIO_FREQUENCY = int(433910000 / (24000000 / pow(2, 16)))
+
+RADIO_REGISTERS = [(Register.FREQ0, RADIO_FREQUENCY & 0xff),
+                   (Register.FREQ1, (RADIO_FREQUENCY >> 8) & 0xff),
+                   (Register.FREQ2, (RADIO_FREQUENCY >> 16) & 0xff),
+                   # (Register.FREQ0, 0x5f), (Register.FREQ1, 0x14), (Register.FREQ2, 0x12),
+                   (Register.DEVIATN, 0x44),
+                   (Register.PKTCTRL1, 0x20),
+                   (Register.PKTCTRL0, 0x00),
+                   (Register.PKTLEN, 0x50),
+                   # (Register.PKTCTRL1, 0x60), (Register.PKTCTRL0, 0x04),
+                   (Register.FSCTRL1, 0x06),
+                   (Register.MDMCFG4, 0xCA),
+                   (Register.MDMCFG3, 0xBC),
+                   (Register.MDMCFG2, 0x06),
+                   (Register.MDMCFG1, 0x70),
+                   (Register.MDMCFG0, 0x11),
+                   (Register.MCSM0, 0x18),
+                   # (Register.MDMCFG4, 0xDA), (Register.MDMCFG3, 0xB5), (Register.MDMCFG2, 0x12),
+                   # (Register.MDMCFG1, 0x23), (Register.MDMCFG0, 0x11), (Register.MCSM0, 0x18),
+                   (Register.FOCCFG, 0x17),
+                   (Register.FSCAL3, 0xE9),
+                   (Register.FSCAL2, 0x2A),
+                   (Register.FSCAL1, 0x00),
+                   (Register.FSCAL0, 0x1F),
+                   (Register.TEST1, 0x35),
+                   (Register.TEST0, 0x09)]
+                   # (Register.TEST2, 0x81) ## register not defined on RL
+
+# registers the radio does not change by itself (unlike the FSCAL calibration
+# results), read back to tell whether the rileylink still holds our settings
+VERIFY_REGISTERS = [Register.PKTLEN, Register.FREQ0, Register.MDMCFG4, Register.SYNC0]
+
+# firmware from this version on queues commands written ahead of their
+# responses, earlier versions hold a single command
+QUEUED_COMMANDS_VERSION = (3, 0)
+QUEUED_COMMAND_DEPTH = 4
+
+
+class RegisterShadow:
+    def __init__(self):
+        self.values = dict()
+        self.configured = False
+        self.fingerprint = None
+
+    def reset(self):
+        self.values.clear()
+        self.configured = False
+        self.fingerprint = None
+
+    def restore(self, registers, fingerprint):
+        self.values = dict(registers)
+        self.configured = True
+        self.fingerprint = fingerprint
+
+
+def get_register_shadow(address):
+    shadow = g_rl_shadows.get(address)
+    if shadow is None:
+        shadow = RegisterShadow()
+        g_rl_shadows[address] = shadow
+    return shadow
+
+
+def get_command_depth(v_major, v_minor):
+    if (v_major, v_minor) >= QUEUED_COMMANDS_VERSION:
+        return QUEUED_COMMAND_DEPTH
+    return 1
+
+
+def get_register_fingerprint(registers):
+    return "%04x" % crc16(bytes([b for register_value in registers for b in register_value]))
+
 
 class RileyLink(PacketRadio):
-    def __init__(self):
+    device_kind = "rileylink"
+
+    def __init__(self, clock=time):
+        self.clock = clock
         self.peripheral = None
+        self.transport = None
+        self.command_depth = None
+        self.write_without_response = True
         self.pa_level_index = PA_LEVELS.index(0x84)
         self.data_handle = None
         self.logger = getLogger()
@@ -108,10 +212,15 @@ class RileyLink(PacketRadio):
 
     def connect(self, force_initialize=False):
         try:
+            if self.address is None:
+                self.address = self._get_cached_address()
+
             if self.address is None:
                 self.address = self._findRileyLink()
 
             if self.peripheral is None:
+                if Peripheral is None:
+                    raise PacketRadioError("bluepy is not installed")
                 self.peripheral = Peripheral()
 
             try:
@@ -121,7 +230,10 @@ class RileyLink(PacketRadio):
             except BTLEException:
                 pass
 
-            self._connect_retry(3)
+            if not self._connect_retry(3):
+                # the rileylink may have been replaced, look for it without holding up the caller
+                self._start_rescan()
+                raise PacketRadioError("Could not connect to RileyLink at %s" % self.address)
 
             self.service = self.peripheral.getServiceByUUID(RILEYLINK_SERVICE_UUID)
             data_char = self.service.getCharacteristics(RILEYLINK_DATA_CHAR_UUID)[0]
@@ -130,12 +242,25 @@ class RileyLink(PacketRadio):
             char_response = self.service.getCharacteristics(RILEYLINK_RESPONSE_CHAR_UUID)[0]
             self.response_handle = char_response.getHandle()
 
+            timings = None
+            if self.transport is not None:
+                timings = self.transport.timings
+            write_without_response_limit = None
+            if self.write_without_response and data_char.properties & GATT_PROPERTY_WRITE_NO_RESPONSE:
+                write_without_response_limit = self._get_mtu() - ATT_WRITE_OVERHEAD
+            self.transport = BleCommandTransport(self.peripheral, self.data_handle, self.response_handle,
+                                                 write_without_response_limit=write_without_response_limit,
+                                                 depth=self.command_depth or 1, timings=timings, clock=self.clock)
+
             response_notify_handle = self.response_handle + 1
             notify_setup = b"\x01\x00"
             self.peripheral.writeCharacteristic(response_notify_handle, notify_setup)
 
-            while self.peripheral.waitForNotifications(0.05):
-                self.peripheral.readCharacteristic(self.data_handle)
+            self.transport.drain()
+
+            if self.command_depth is None:
+                version, v_major, v_minor = self._read_version()
+                self.transport.depth = get_command_depth(v_major, v_minor)
 
             if self.initialized:
                 self.init_radio(force_initialize)
@@ -197,11 +322,17 @@ class RileyLink(PacketRadio):
             if g_rl_version is not None:
                 return g_rl_version, g_rl_v_major, g_rl_v_minor
             else:
-                response = self._command(Command.GET_VERSION)
-                if response is not None and len(response) > 0:
-                    version = response.decode("ascii")
-                    self.logger.debug("RL reports version string: %s" % version)
+                cached = self._get_cached_rileylink()
+                if cached is not None and cached.get("version") is not None:
+                    version = cached["version"]
                     g_rl_version = version
+                else:
+                    response = self._command(Command.GET_VERSION)
+                    if response is not None and len(response) > 0:
+                        version = response.decode("ascii")
+                        self.logger.debug("RL reports version string: %s" % version)
+                        g_rl_version = version
+                        self.update_cached_device(address=self.address, version=version)
 
             if version is None:
                 return "0.0", 0, 0
@@ -234,100 +365,103 @@ class RileyLink(PacketRadio):
                 raise PacketRadioError("Unsupported RileyLink firmware %d.%d (%s)" %
                                         (v_major, v_minor, version))
 
-            if not force_init:
-                if v_major == 2 and v_minor < 3:
-                    response = self._command(Command.READ_REGISTER, bytes([Register.PKTLEN, 0x00]))
+            shadow = get_register_shadow(self.address)
+            target = self._get_target_registers()
+            fingerprint = get_register_fingerprint([r for r in target if r[0] != Register.PATABLE0])
+
+            if not shadow.configured:
+                # configured by an earlier process, trusted once it reads back right
+                cached = self._get_cached_rileylink()
+                if cached is not None and cached.get("fingerprint") == fingerprint:
+                    shadow.restore([r for r in target if r[0] != Register.PATABLE0], fingerprint)
+                    force_init = True
+
+            # the shadow holds what was last written to this rileylink, a few
+            # reads tell whether it still holds it or has been reset since
+            if shadow.configured:
+                if force_init:
+                    verify = VERIFY_REGISTERS
                 else:
-                    response = self._command(Command.READ_REGISTER, bytes([Register.PKTLEN]))
-                if response is not None and len(response) > 0 and response[0] == 0x50:
-                    return
-
-            self._command(Command.RADIO_RESET_CONFIG)
-            self._command(Command.SET_SW_ENCODING, bytes([Encoding.NONE]))
-            self._command(Command.SET_PREAMBLE, bytes([0x66, 0x65]))
-            #self._command(Command.SET_PREAMBLE, bytes([0, 0]))
-
-            frequency = int(433910000 / (24000000 / pow(2, 16)))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.FREQ0, frequency & 0xff]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.FREQ1, (frequency >> 8) & 0xff]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.FREQ2, (frequency >> 16) & 0xff]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.FREQ0, 0x5f]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.FREQ1, 0x14]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.FREQ2, 0x12]))
-
-            self._command(Command.UPDATE_REGISTER, bytes([Register.DEVIATN, 0x44]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.DEVIATN, 0x44]))
-
-            self._command(Command.UPDATE_REGISTER, bytes([Register.PKTCTRL1, 0x20]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.PKTCTRL0, 0x00]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.PKTLEN, 0x50]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.PKTCTRL1, 0x60]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.PKTCTRL0, 0x04]))
-
-            self._command(Command.UPDATE_REGISTER, bytes([Register.FSCTRL1, 0x06]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.FSCTRL1, 0x06]))
-
-            self._command(Command.UPDATE_REGISTER, bytes([Register.MDMCFG4, 0xCA]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.MDMCFG3, 0xBC]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.MDMCFG2, 0x06]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.MDMCFG1, 0x70]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.MDMCFG0, 0x11]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.MCSM0, 0x18]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.MDMCFG4, 0xDA]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.MDMCFG3, 0xB5]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.MDMCFG2, 0x12]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.MDMCFG1, 0x23]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.MDMCFG0, 0x11]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.MCSM0, 0x18]))
-
-            self._command(Command.UPDATE_REGISTER, bytes([Register.FOCCFG, 0x17]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.FSCAL3, 0xE9]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.FSCAL2, 0x2A]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.FSCAL1, 0x00]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.FSCAL0, 0x1F]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.TEST1, 0x35]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.TEST0, 0x09]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.FOCCFG, 0x17]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.FSCAL3, 0xE9]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.FSCAL2, 0x2A]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.FSCAL1, 0x00]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.FSCAL0, 0x1F]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.TEST2, 0x81])) ## register not defined on RL
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.TEST1, 0x35]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.TEST0, 0x09]))
-
-
-            self._command(Command.UPDATE_REGISTER, bytes([Register.PATABLE0, PA_LEVELS[self.pa_level_index]]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.FREND0, 0x00]))
-            #self._command(Command.UPDATE_REGISTER, bytes([Register.SYNC1, 0xA5]))
-            #self._command(Command.UPDATE_REGISTER, bytes([Register.SYNC0, 0x5A]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.PATABLE0, PA_LEVELS[self.pa_level_index]]))
-            # self._command(Command.UPDATE_REGISTER, bytes([Register.FREND0, 0x00]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.SYNC1, 0xA5]))
-            self._command(Command.UPDATE_REGISTER, bytes([Register.SYNC0, 0x5A]))
-
-            response = self._command(Command.GET_STATE)
-            if response != b"OK":
-                raise PacketRadioError("Rileylink state is not OK. Response returned: %s" % response)
+                    verify = VERIFY_REGISTERS[:1]
+                values = self._read_registers(verify, v_major, v_minor)
+                if values != [shadow.values.get(register) for register in verify]:
+                    self.logger.info("RileyLink registers differ from the shadow, reconfiguring")
+                    shadow.reset()
+
+            if not shadow.configured:
+                self._commands([(Command.RADIO_RESET_CONFIG, None),
+                                (Command.SET_SW_ENCODING, bytes([Encoding.NONE])),
+                                (Command.SET_PREAMBLE, bytes([0x66, 0x65]))])
+                                #(Command.SET_PREAMBLE, bytes([0, 0]))
+                shadow.configured = True
+
+            written = self._update_registers([(register, value) for register, value in target
+                                              if shadow.values.get(register) != value])
+            self.logger.debug("Updated %d of %d registers" % (written, len(target)))
+
+            if force_init or written > 0:
+                response = self._command(Command.GET_STATE)
+                if response != b"OK":
+                    shadow.reset()
+                    raise PacketRadioError("Rileylink state is not OK. Response returned: %s" % response)
 
             self.initialized = True
+            if shadow.fingerprint != fingerprint:
+                shadow.fingerprint = fingerprint
+                self.update_cached_device(address=self.address, version=version, fingerprint=fingerprint)
 
         except Exception as e:
             raise PacketRadioError("Error while initializing rileylink radio: %s", e)
 
+    def get_register_fingerprint(self):
+        return get_register_shadow(self.address).fingerprint
+
+    def _get_target_registers(self):
+        return RADIO_REGISTERS + [(Register.PATABLE0, PA_LEVELS[self.pa_level_index]),
+                                  (Register.FREND0, 0x00),
+                                  (Register.SYNC1, 0xA5),
+                                  (Register.SYNC0, 0x5A)]
+
+    def get_transport_timings(self):
+        if self.transport is None:
+            return None
+        return self.transport.get_timings()
+
+    def _update_registers(self, registers):
+        if len(registers) == 0:
+            return 0
+        shadow = get_register_shadow(self.address)
+        for register, value in registers:
+            shadow.values.pop(register, None)
+        self._commands([(Command.UPDATE_REGISTER, bytes([register, value])) for register, value in registers])
+        for register, value in registers:
+            shadow.values[register] = value
+        return len(registers)
+
+    def _read_registers(self, registers, v_major, v_minor):
+        if v_major == 2 and v_minor < 3:
+            commands = [(Command.READ_REGISTER, bytes([register, 0x00])) for register in registers]
+        else:
+            commands = [(Command.READ_REGISTER, bytes([register])) for register in registers]
+        values = []
+        for response in self._commands(commands):
+            if response is None or len(response) == 0:
+                values.append(None)
+            else:
+                values.append(response[0])
+        return values
+
     def tx_up(self):
         try:
             if self.pa_level_index < len(PA_LEVELS) - 1:
-                self.pa_level_index += 1
-                self._set_amp(self.pa_level_index)
+                self._set_amp(self.pa_level_index + 1)
         except Exception as e:
             raise PacketRadioError("Error while setting tx up") from e
 
     def tx_down(self):
         try:
             if self.pa_level_index > 0:
-                self.pa_level_index -= 1
-                self._set_amp(self.pa_level_index)
+                self._set_amp(self.pa_level_index - 1)
         except Exception as e:
             raise PacketRadioError("Error while setting tx down") from e
 
@@ -335,16 +469,19 @@ class RileyLink(PacketRadio):
         try:
             if tx_power is None:
                 return
-            elif tx_power == TxPower.Lowest:
-                self._set_amp(0)
-            elif tx_power == TxPower.Low:
-                self._set_amp(PA_LEVELS.index(0x1D))
-            elif tx_power == TxPower.Normal:
-                self._set_amp(PA_LEVELS.index(0x84))
-            elif tx_power == TxPower.High:
-                self._set_amp(PA_LEVELS.index(0xC8))
-            elif tx_power == TxPower.Highest:
-                self._set_amp(PA_LEVELS.index(0xC8))
+            self._set_amp(self.get_tx_level(tx_power))
+        except Exception as e:
+            raise PacketRadioError("Error while setting tx level") from e
+
+    def get_tx_level_count(self):
+        return len(PA_LEVELS)
+
+    def get_tx_level(self, tx_power):
+        return PA_LEVELS.index(TX_POWER_PA_LEVELS[tx_power])
+
+    def set_tx_level(self, level):
+        try:
+            self._set_amp(level)
         except Exception as e:
             raise PacketRadioError("Error while setting tx level") from e
 
@@ -353,79 +490,129 @@ class RileyLink(PacketRadio):
             self.connect()
             result = self._command(Command.GET_PACKET, struct.pack(">BL", 0, int(timeout * 1000)),
                                  timeout=float(timeout)+0.5)
-            if result is not None:
-                return result[0:2] + self.manchester.decode(result[2:])
-            else:
-                return None
+            return self._decode_packet(result)
         except Exception as e:
             raise PacketRadioError("Error while getting radio packet") from e
 
     def send_and_receive_packet(self, packet, repeat_count, delay_ms, timeout_ms, retry_count, preamble_ext_ms):
         try:
             self.connect()
-            data = self.manchester.encode(packet)
-            result = self._command(Command.SEND_AND_LISTEN,
-                                  struct.pack(">BBHBLBH",
-                                              0,
-                                              repeat_count,
-                                              delay_ms,
-                                              0,
-                                              timeout_ms,
-                                              retry_count,
-                                              preamble_ext_ms)
-                                              + data,
-                                  timeout=30)
-            if result is not None:
-                return result[0:2] + self.manchester.decode(result[2:])
-            else:
-                return None
+            frame = self._encode_packet_command(Command.SEND_AND_LISTEN, _send_and_listen_header,
+                                                (0, repeat_count, delay_ms, 0, timeout_ms, retry_count,
+                                                 preamble_ext_ms), packet)
+            result = self._execute_with_tx_level(frame, timeout=30)
+            return self._decode_packet(result)
         except Exception as e:
             raise PacketRadioError("Error while sending and receiving data") from e
 
-    def send_packet(self, packet, repeat_count, delay_ms, preamble_extension_ms):
+    def encode_packet(self, packet):
+        return self.manchester.encode(packet)
+
+    def send_and_receive_encoded(self, encoded, repeat_count, delay_ms, timeout_ms, retry_count, preamble_ext_ms):
         try:
             self.connect()
-            data = self.manchester.encode(packet)
-            result = self._command(Command.SEND_PACKET, struct.pack(">BBHH", 0, repeat_count, delay_ms,
-                                                                   preamble_extension_ms) + data,
-                                  timeout=30)
-            return result
+            frame = self._encode_packet_command(Command.SEND_AND_LISTEN, _send_and_listen_header,
+                                                (0, repeat_count, delay_ms, 0, timeout_ms, retry_count,
+                                                 preamble_ext_ms), encoded=encoded)
+            result = self._execute_with_tx_level(frame, timeout=30)
+            return self._decode_packet(result)
         except Exception as e:
-            raise PacketRadioError("Error while sending data") from e
+            raise PacketRadioError("Error while sending and receiving data") from e
 
-    def _set_amp(self, index=None):
+    def send_packet(self, packet, repeat_count, delay_ms, preamble_extension_ms):
         try:
-            if index is not None:
-                previous_level = self.pa_level_index
-                self.pa_level_index = index
-                if PA_LEVELS[previous_level] == PA_LEVELS[index]:
-                    return
             self.connect()
-            self._command(Command.UPDATE_REGISTER, bytes([Register.PATABLE0, PA_LEVELS[self.pa_level_index]]))
-            self.packet_logger.debug("Setting pa to %02X (%d of %d)" % (PA_LEVELS[self.pa_level_index], self.pa_level_index, len(PA_LEVELS)))
-        except PacketRadioError:
-            self.logger.exception("Error while setting tx amplification")
-            raise
+            frame = self._encode_packet_command(Command.SEND_PACKET, _send_packet_header,
+                                                (0, repeat_count, delay_ms, preamble_extension_ms), packet)
+            return self._execute_with_tx_level(frame, timeout=30)
+        except Exception as e:
+            raise PacketRadioError("Error while sending data") from e
 
+    def _set_amp(self, index):
+        # only recorded here, the register is written with the next packet sent
+        previous_level = self.pa_level_index
+        self.pa_level_index = index
+        if PA_LEVELS[previous_level] != PA_LEVELS[index]:
+            self.packet_logger.debug("Setting pa to %02X (%d of %d)" % (PA_LEVELS[index], index, len(PA_LEVELS)))
+
+    def _execute_with_tx_level(self, frame, timeout=10.0):
+        # a changed tx level goes out in the same batch as the packet command
+        pa_level = PA_LEVELS[self.pa_level_index]
+        shadow = get_register_shadow(self.address)
+        if shadow.values.get(Register.PATABLE0) == pa_level:
+            return self._execute([frame], timeout)[0]
+        shadow.values.pop(Register.PATABLE0, None)
+        responses = self._execute([bytes([3, Command.UPDATE_REGISTER, Register.PATABLE0, pa_level]), frame], timeout)
+        shadow.values[Register.PATABLE0] = pa_level
+        return responses[1]
 
     def _findRileyLink(self):
         global g_rl_address
+        if Scanner is None:
+            raise PacketRadioError("bluepy is not installed")
         scanner = Scanner()
-        g_rl_address = None
+        address = None
+        rssi = None
         self.logger.debug("Scanning for RileyLink")
         retries = 10
-        while g_rl_address is None and retries > 0:
+        while address is None and retries > 0:
             retries -= 1
             for result in scanner.scan(1.0):
                 if result.getValueText(7) == RILEYLINK_SERVICE_UUID:
                     self.logger.debug("Found RileyLink")
-                    g_rl_address = result.addr
+                    address = result.addr
+                    rssi = result.rssi
 
-        if g_rl_address is None:
+        if address is None:
             raise PacketRadioError("Could not find RileyLink")
 
+        g_rl_address = address
+        self.update_cached_device(address=address, rssi=rssi)
+        return address
+
+    def _get_cached_address(self):
+        global g_rl_address
+        cached = self.get_cached_device()
+        if cached is None or cached.get("address") is None:
+            return None
+        self.logger.debug("Using cached RileyLink address %s" % cached["address"])
+        g_rl_address = cached["address"]
         return g_rl_address
 
+    def _get_cached_rileylink(self):
+        cached = self.get_cached_device()
+        if cached is None or cached.get("address") != self.address:
+            return None
+        return cached
+
+    def _start_rescan(self):
+        global g_rl_rescan
+        with g_rl_rescan_lock:
+            if g_rl_rescan is not None and g_rl_rescan.is_alive():
+                return
+            g_rl_rescan = Thread(target=self._rescan)
+            g_rl_rescan.setDaemon(True)
+            g_rl_rescan.start()
+
+    def _rescan(self):
+        try:
+            address = self._findRileyLink()
+        except Exception:
+            self.logger.exception("Background scan did not find a RileyLink")
+            return
+        if address != self.address:
+            self.logger.info("RileyLink found at %s, previously %s" % (address, self.address))
+            self.address = address
+
+    def _get_mtu(self):
+        # bluepy reports the mtu agreed with the peripheral in its status response
+        try:
+            response = self.peripheral.setMTU(RILEYLINK_REQUESTED_MTU)
+            return int(response["mtu"][0])
+        except Exception:
+            self.logger.warning("Could not negotiate the ble mtu, assuming the default")
+            return ATT_DEFAULT_MTU
+
     def _connect_retry(self, retries):
         while retries > 0:
             retries -= 1
@@ -434,7 +621,7 @@ class RileyLink(PacketRadio):
             try:
                 self.peripheral.connect(self.address)
                 self.logger.info("Connected")
-                break
+                return True
             except BTLEException as btlee:
                 self.logger.warning("BTLE exception trying to connect: %s" % btlee)
                 try:
@@ -448,35 +635,68 @@ class RileyLink(PacketRadio):
                 except:
                     self.logger.warning("Failed to kill bluepy-helper")
                 time.sleep(1)
+        return False
 
     def _command(self, command_type, command_data=None, timeout=10.0):
-        try:
-            if command_data is None:
-                data = bytes([1, command_type])
-            else:
-                data = bytes([len(command_data) + 1, command_type]) + command_data
-
-            self.peripheral.writeCharacteristic(self.data_handle, data, withResponse=True)
-
-            if not self.peripheral.waitForNotifications(timeout):
-                raise PacketRadioError("Timed out while waiting for a response from RileyLink")
+        return self._commands([(command_type, command_data)], timeout)[0]
 
-            response = self.peripheral.readCharacteristic(self.data_handle)
-
-            if response is None or len(response) == 0:
-                raise PacketRadioError("RileyLink returned no response")
-            else:
-                if response[0] == Response.COMMAND_SUCCESS:
-                    return response[1:]
-                elif response[0] == Response.COMMAND_INTERRUPTED:
-                    self.logger.warning("A previous command was interrupted")
-                    return response[1:]
-                elif response[0] == Response.RX_TIMEOUT:
-                    return None
+    def _commands(self, commands, timeout=10.0):
+        try:
+            batch = []
+            for command_type, command_data in commands:
+                if command_data is None:
+                    batch.append(bytes([1, command_type]))
                 else:
-                    raise PacketRadioError("RileyLink returned error code: %02X. Additional response data: %s"
-                                         % (response[0], response[1:]), response[0])
+                    batch.append(bytes([len(command_data) + 1, command_type]) + command_data)
+
+            return self._execute(batch, timeout)
         except PacketRadioError:
             raise
         except Exception as e:
             raise PacketRadioError("Error executing command") from e
+
+    def _execute(self, batch, timeout=10.0):
+        return [self._get_response(response) for response in self.transport.execute_batch(batch, timeout)]
+
+    def _encode_packet_command(self, command_type, header, values, packet=None, encoded=None):
+        # length, command, header and the manchester encoded packet in a single buffer
+        start = 2 + header.size
+        if encoded is None:
+            frame = bytearray(start + FRAME_LENGTH)
+            length = self.manchester.encode_into(packet, frame, start)
+        else:
+            length = len(encoded)
+            frame = bytearray(start + length)
+            frame[start:] = encoded
+        header.pack_into(frame, 2, *values)
+        end = start + length
+        frame[0] = end - 1
+        frame[1] = command_type
+        del frame[end:]
+        return frame
+
+    def _decode_packet(self, result):
+        if result is None:
+            return None
+        # rssi and packet number are kept, the rest is decoded in place behind them
+        packet = bytearray(2 + ((len(result) - 2) >> 1))
+        packet[0:2] = result[0:2]
+        written, invalid = self.manchester.decode_into(memoryview(result)[2:], packet, 2)
+        if invalid >= 0:
+            del packet[2 + written:]
+        return packet
+
+    def _get_response(self, response):
+        if response is None or len(response) == 0:
+            raise PacketRadioError("RileyLink returned no response")
+        else:
+            if response[0] == Response.COMMAND_SUCCESS:
+                return response[1:]
+            elif response[0] == Response.COMMAND_INTERRUPTED:
+                self.logger.warning("A previous command was interrupted")
+                return response[1:]
+            elif response[0] == Response.RX_TIMEOUT:
+                return None
+            else:
+                raise PacketRadioError("RileyLink returned error code: %02X. Additional response data: %s"
+                                     % (response[0], response[1:]), response[0])
@@ -0,0 +1,504 @@
+from .packet_radio import PacketRadio
+from .protocol_common import *
+from .definitions import *
+from .exceptions import ProtocolError
+from .nonce import Nonce
+from .nonce_solver import NONCE_REQUESTS
+from .crc import crc16, crc16_table
+import random
+import struct
+import time
+
+SIMULATED_LOT = 44147
+SIMULATED_TID = 1100256
+SIMULATED_RESERVOIR = 180.0
+
+LOW_RESERVOIR_PULSES = 1000
+
+_status_struct = struct.Struct(">BII")
+_version_struct = struct.Struct(">BBBBBBBBII")
+_fault_struct = struct.Struct(">BBHBHBHHHBBBBBH")
+_address_struct = struct.Struct(">I")
+
+
+class SimulatedClock:
+    def __init__(self, speed=1.0, start=None):
+        if start is None:
+            start = time.time()
+        self.speed = speed
+        self.start = start
+        self.real_start = time.time()
+        self.skipped = 0.0
+
+    def time(self):
+        return self.start + (time.time() - self.real_start) * self.speed + self.skipped
+
+    def sleep(self, seconds):
+        # sleeping only moves the simulated clock forward
+        if seconds > 0:
+            self.skipped += seconds
+
+
+class _HalfHourProgram:
+    def __init__(self, pulses, anchor, cyclic):
+        self.pulses = pulses
+        self.anchor = anchor
+        self.cyclic = cyclic
+        self.cumulative = [0]
+        for p in pulses:
+            self.cumulative.append(self.cumulative[-1] + p)
+        self.end = None
+        if not cyclic:
+            self.end = anchor + len(pulses) * 1800
+
+    def get_count(self, t):
+        # pulses of a half hour are spread evenly within it
+        elapsed = max(0.0, t - self.anchor)
+        hh, offset = divmod(elapsed, 1800)
+        hh = int(hh)
+        count = len(self.pulses)
+        cycles = 0
+        if self.cyclic:
+            cycles, hh = divmod(hh, count)
+        elif hh >= count:
+            return self.cumulative[-1]
+        return cycles * self.cumulative[-1] + self.cumulative[hh] + int(self.pulses[hh] * offset / 1800)
+
+
+class _Bolus:
+    def __init__(self, pulses, interval, start):
+        self.pulses = pulses
+        self.interval = interval
+        self.start = start
+        self.delivered = 0
+
+    def get_count(self, t):
+        return min(self.pulses, int(max(0.0, t - self.start) / self.interval))
+
+    def get_end(self):
+        return self.start + self.pulses * self.interval
+
+
+class _Alert:
+    def __init__(self, activate, reservoir, value, configured):
+        self.activate = activate
+        self.reservoir = reservoir
+        self.value = value
+        self.configured = configured
+
+
+class SimulatedPod(PacketRadio):
+    def __init__(self, lot=SIMULATED_LOT, tid=SIMULATED_TID, reservoir=SIMULATED_RESERVOIR,
+                 clock=None, rssi=0xff, seed=None):
+        if clock is None:
+            clock = SimulatedClock()
+        self.clock = clock
+        self.lot = lot
+        self.tid = tid
+        self.rssi = rssi
+        self.random = random.Random(seed)
+        self.logger = getLogger()
+
+        self.radio_address = None
+        self.progress = PodProgress.TankFillCompleted
+        self.activated = None
+        self.faulted = False
+        self.fault_event = 0
+        self.fault_time = 0
+        self.last_message_sequence = 0
+
+        self.reservoir = int(reservoir * 20)
+        self.delivered = 0
+        self.canceled = 0
+        self.last_update = self.clock.time()
+
+        self.basal = None
+        self.basal_from = None
+        self.temp_basal = None
+        self.bolus = None
+
+        self.alerts = dict()
+        self.alert_state = 0
+        self.alert_times = [0] * 8
+
+        self.nonce = None
+        self.nonce_expected = None
+        self.nonce_resyncs = 0
+
+        self.last_received = None
+        self.last_response = None
+        self.message = None
+        self.outgoing = []
+
+        self.connected = False
+        self.tx_power = None
+        self.packets_received = 0
+        self.packets_sent = 0
+
+    def connect(self, force_initialize=False):
+        self.connected = True
+
+    def disconnect(self, ignore_errors=True):
+        self.connected = False
+
+    def get_info(self):
+        return {"simulated": True, "radio_address": self.radio_address, "progress": int(self.progress)}
+
+    def init_radio(self, force_init=False):
+        pass
+
+    def tx_up(self):
+        pass
+
+    def tx_down(self):
+        pass
+
+    def set_tx_power(self, tx_power):
+        self.tx_power = tx_power
+
+    def get_packet(self, timeout=5.0):
+        return None
+
+    def send_and_receive_packet(self, packet, repeat_count, delay_ms, timeout_ms, retry_count, preamble_ext_ms):
+        response = self.receive(packet)
+        if response is None:
+            return None
+        return bytes([self.rssi, 0]) + response.get_data()
+
+    def send_packet(self, packet, repeat_count, delay_ms, preamble_extension_ms):
+        self.receive(packet)
+
+    def receive(self, data):
+        data = bytes(data)
+        p = RadioPacket.parse(data)
+        if p is None:
+            return None
+        if p.address != 0xffffffff and p.address != self.radio_address:
+            return None
+
+        self.packets_received += 1
+        if data == self.last_received:
+            response = self.last_response
+        else:
+            self.last_received = data
+            response = self._handle_packet(p)
+            self.last_response = response
+
+        if response is not None:
+            self.packets_sent += 1
+        return response
+
+    def _handle_packet(self, p):
+        if p.type == RadioPacketType.ACK:
+            if len(self.outgoing) == 0:
+                return None
+            return self.outgoing.pop(0).with_sequence(p.sequence + 1)
+
+        self.outgoing = []
+        try:
+            if p.type == RadioPacketType.PDM:
+                self.message = BaseMessage()
+            elif p.type != RadioPacketType.CON or self.message is None:
+                return None
+            complete = self.message.add_radio_packet(p)
+        except ProtocolError:
+            self.message = None
+            return None
+
+        if not complete:
+            return RadioPacket(p.address, RadioPacketType.ACK, p.sequence + 1,
+                               _address_struct.pack(self._get_address(p.address)))
+
+        message = self.message
+        self.message = None
+        response = self._handle_message(message)
+        packets = _get_response_packets(message.address, (message.sequence + 1) % 16,
+                                        p.address, (p.sequence + 1) % 32, response)
+        self.outgoing = packets[1:]
+        return packets[0]
+
+    def _get_address(self, packet_address):
+        if self.radio_address is None:
+            return packet_address
+        return self.radio_address
+
+    def _handle_message(self, message):
+        self._advance()
+        self.last_message_sequence = message.sequence
+        parts = message.get_parts()
+        cmd_type, cmd_body = parts[0]
+
+        if cmd_type in NONCE_REQUESTS:
+            nonce = struct.unpack(">I", cmd_body[0:4])[0]
+            cmd_body = cmd_body[4:]
+            if not self._check_nonce(nonce):
+                return self._resync_response(nonce, message.sequence)
+
+        if cmd_type == PdmRequest.AssignAddress:
+            return self._assign_address(cmd_body)
+        elif cmd_type == PdmRequest.SetupPod:
+            return self._setup_pod(cmd_body)
+        elif cmd_type == PdmRequest.Status:
+            return self._status_request(cmd_body[0])
+        elif cmd_type == PdmRequest.ConfigureAlerts:
+            self._configure_alerts(cmd_body)
+        elif cmd_type == PdmRequest.AcknowledgeAlerts:
+            self.alert_state &= ~cmd_body[0] & 0xff
+        elif cmd_type == PdmRequest.InsulinSchedule:
+            if len(parts) > 1:
+                self._insulin_schedule(cmd_body, parts[1][0], parts[1][1])
+        elif cmd_type == PdmRequest.CancelDelivery:
+            self._cancel_delivery(cmd_body[0])
+        elif cmd_type == PdmRequest.DeactivatePod:
+            self._stop_delivery()
+            self.progress = PodProgress.Inactive
+        elif cmd_type != PdmRequest.SetDeliveryFlags:
+            self.logger.warning("Simulated pod ignoring command 0x%02x" % cmd_type)
+        return self._status_response()
+
+    def _check_nonce(self, nonce):
+        if self.nonce is None:
+            return False
+        if self.nonce_expected is None:
+            self.nonce_expected = self.nonce.getNext(True)
+        if nonce != self.nonce_expected:
+            return False
+        self.nonce_expected = None
+        return True
+
+    def _resync_response(self, nonce, message_sequence):
+        seed = self.random.randrange(0, 256)
+        w_sum = (nonce & 0xFFFF) + (crc16_table[message_sequence] & 0xFFFF) \
+            + (self.lot & 0xFFFF) + (self.tid & 0xFFFF)
+        syncword = ((w_sum & 0xFFFF) ^ seed) & 0xFFFF
+        self.nonce = Nonce(self.lot, self.tid, seed=seed)
+        self.nonce_expected = None
+        self.nonce_resyncs += 1
+        return self._response(PodResponse.ResyncRequest, struct.pack(">BH", 0x14, syncword))
+
+    def _assign_address(self, body):
+        if self.progress <= PodProgress.TankFillCompleted:
+            self.radio_address = _address_struct.unpack(body[0:4])[0]
+        return self._response(PodResponse.VersionInfo, self._version_body() + bytes([self.rssi & 0x3f])
+                              + _address_struct.pack(self.radio_address))
+
+    def _setup_pod(self, body):
+        address, _, _, month, day, year, hour, minute, lot, tid = struct.unpack(">IBBBBBBBII", body)
+        if address == self.radio_address and lot == self.lot and tid == self.tid \
+                and self.progress == PodProgress.TankFillCompleted:
+            self.progress = PodProgress.PairingSuccess
+            self.activated = self.clock.time()
+            self.nonce = Nonce(self.lot, self.tid, seed=0)
+            self.nonce_expected = None
+        return self._response(PodResponse.VersionInfo, bytes(7) + self._version_body()
+                              + _address_struct.pack(self.radio_address))
+
+    def _version_body(self):
+        return _version_struct.pack(2, 7, 0, 2, 7, 0, 2, self.progress, self.lot, self.tid)
+
+    def _configure_alerts(self, body):
+        for i in range(0, len(body) - 5, 6):
+            b0, b1, b2, b3 = body[i:i + 4]
+            index = b0 >> 4
+            value = (b2 << 8) | b3
+            if b0 & 0x08:
+                self.alerts[index] = _Alert(True, (b0 & 0x04) != 0, value, self._get_active_minutes())
+            else:
+                self.alerts.pop(index, None)
+                self.alert_state &= ~(1 << index) & 0xff
+
+    def _insulin_schedule(self, body, schedule_type, schedule_body):
+        table_type = body[0]
+        checksum = struct.unpack(">H", body[1:3])[0]
+        header = body[3:8]
+        hh_count, field1, field2 = struct.unpack(">BHH", header)
+        pulses = _decode_ise_table(body[8:])
+        if checksum != sum(header) + sum(struct.pack(">%dH" % len(pulses), *pulses)):
+            self.logger.warning("Simulated pod rejecting insulin schedule with invalid checksum")
+            return
+
+        now = self.clock.time()
+        if table_type == 0 and schedule_type == PdmRequest.BasalSchedule:
+            if len(pulses) != 48:
+                return
+            current_hh = hh_count
+            seconds_to_hh = field1 // 8
+            anchor = now - (current_hh * 1800 + 1800 - seconds_to_hh)
+            self.basal = _HalfHourProgram(pulses, anchor, True)
+            self.basal_from = now
+            self.temp_basal = None
+            if self.progress == PodProgress.ReadyForInjection:
+                self.progress = PodProgress.BasalScheduleSet
+        elif table_type == 1 and schedule_type == PdmRequest.TempBasalSchedule:
+            if len(pulses) != hh_count:
+                return
+            self.temp_basal = _HalfHourProgram(pulses, now, False)
+        elif table_type == 2 and schedule_type == PdmRequest.BolusSchedule:
+            interval = struct.unpack(">I", schedule_body[3:7])[0] / 100000
+            self.bolus = _Bolus(pulses[0], interval, now)
+            if self.progress == PodProgress.PairingSuccess:
+                self.progress = PodProgress.Purging
+            elif self.progress == PodProgress.BasalScheduleSet:
+                self.progress = PodProgress.Inserting
+
+    def _cancel_delivery(self, flags):
+        if flags & 0x04 and self.bolus is not None:
+            self.canceled = self.bolus.pulses - self.bolus.delivered
+            self.bolus = None
+        if flags & 0x02:
+            self.temp_basal = None
+        if flags & 0x01:
+            self.basal = None
+
+    def _stop_delivery(self):
+        self.bolus = None
+        self.temp_basal = None
+        self.basal = None
+
+    def _advance(self):
+        now = self.clock.time()
+        t0 = self.last_update
+        if now <= t0:
+            return
+        self.last_update = now
+
+        if self.bolus is not None:
+            count = self.bolus.get_count(now)
+            self._deliver(count - self.bolus.delivered)
+            self.bolus.delivered = count
+            if count == self.bolus.pulses:
+                self._bolus_completed(min(now, self.bolus.get_end()))
+
+        if self.basal_from is not None \
+                and (self.progress == PodProgress.Running or self.progress == PodProgress.RunningLow):
+            t0 = max(t0, self.basal_from)
+            temp = self.temp_basal
+            if temp is not None:
+                if now > temp.anchor and t0 < temp.end:
+                    self._deliver(temp.get_count(min(now, temp.end)) - temp.get_count(max(t0, temp.anchor)))
+                self._deliver_basal(t0, min(now, temp.anchor))
+                self._deliver_basal(max(t0, temp.end), now)
+                if now >= temp.end:
+                    self.temp_basal = None
+            else:
+                self._deliver_basal(t0, now)
+
+        minutes = self._get_active_minutes()
+        for index, alert in self.alerts.items():
+            if self.alert_state & (1 << index):
+                continue
+            if alert.reservoir:
+                triggered = self.reservoir * 10 <= alert.value * 20
+            else:
+                triggered = minutes >= alert.configured + alert.value
+            if triggered:
+                self.alert_state |= 1 << index
+                self.alert_times[index] = minutes
+
+        if self.progress == PodProgress.Running and self.reservoir < LOW_RESERVOIR_PULSES:
+            self.progress = PodProgress.RunningLow
+
+    def _deliver_basal(self, t0, t1):
+        if self.basal is not None and t1 > t0:
+            self._deliver(self.basal.get_count(t1) - self.basal.get_count(t0))
+
+    def _deliver(self, pulses):
+        if pulses <= 0 or self.faulted:
+            return
+        if pulses >= self.reservoir:
+            pulses = self.reservoir
+            self._fault(0x14)
+        self.reservoir -= pulses
+        self.delivered += pulses
+
+    def _bolus_completed(self, t):
+        self.bolus = None
+        if self.progress == PodProgress.Purging:
+            self.progress = PodProgress.ReadyForInjection
+        elif self.progress == PodProgress.Inserting:
+            self.progress = PodProgress.Running
+            self.basal_from = t
+
+    def _fault(self, event):
+        self.faulted = True
+        self.fault_event = event
+        self.fault_time = self._get_active_minutes()
+        self.progress = PodProgress.ErrorShuttingDown
+        self._stop_delivery()
+
+    def _get_active_minutes(self):
+        if self.activated is None:
+            return 0
+        return int((self.clock.time() - self.activated) / 60)
+
+    def _get_delivery_state(self):
+        state = 0
+        if self.bolus is not None:
+            state |= 4
+        if self.temp_basal is not None:
+            state |= 2
+        elif self.basal is not None:
+            state |= 1
+        return state
+
+    def _status_request(self, request_type):
+        if request_type == 0:
+            return self._status_response()
+        if request_type == 1:
+            body = bytes([0x01, 0, 0]) + struct.pack(">8H", *[(self._get_active_minutes() - self.alert_times[i])
+                                                               if self.alert_state & (1 << i) else 0
+                                                               for i in range(0, 8)])
+        elif request_type == 2:
+            body = bytes([0x02]) + _fault_struct.pack(self.progress, self._get_delivery_state(),
+                                                      self.canceled & 0xffff, self.last_message_sequence,
+                                                      self.delivered & 0xffff, self.fault_event,
+                                                      self.fault_time, min(self.reservoir, 0x3ff),
+                                                      self._get_active_minutes(), self.alert_state,
+                                                      0, 0, self.rssi & 0x3f, 0, 0)
+        else:
+            body = bytes([request_type])
+        return self._response(PodResponse.DetailInfo, body)
+
+    def _status_response(self):
+        s0 = (self._get_delivery_state() << 4) | self.progress
+        s1 = ((self.delivered & 0x1fff) << 15) | ((self.last_message_sequence & 0x0f) << 11) \
+            | (self.canceled & 0x7ff)
+        s2 = (self.alert_state << 23) | ((self._get_active_minutes() & 0x1fff) << 10) \
+            | min(self.reservoir, 0x3ff)
+        if self.faulted:
+            s2 |= 0x80000000
+        return self._response(PodResponse.Status, _status_struct.pack(s0, s1, s2))
+
+    def _response(self, response_type, body):
+        if response_type == PodResponse.Status:
+            return bytes([response_type]) + body
+        return bytes([response_type, len(body)]) + body
+
+
+def _get_response_packets(message_address, message_sequence, packet_address, first_sequence, body):
+    # the pod counts status parts with their actual length, unlike the pdm side packetizer
+    frame = struct.pack(">IBB", message_address, (message_sequence << 2) | ((len(body) >> 8) & 0x03),
+                        len(body) & 0xff) + body
+    frame += struct.pack(">H", crc16(frame))
+    packets = [RadioPacket(packet_address, RadioPacketType.POD, first_sequence, frame[0:31])]
+    sequence = first_sequence
+    for index in range(31, len(frame), 31):
+        sequence = (sequence + 2) % 32
+        packets.append(RadioPacket(packet_address, RadioPacketType.CON, sequence, frame[index:index + 31]))
+    return packets
+
+
+def _decode_ise_table(body):
+    pulses = []
+    for i in range(0, len(body) - 1, 2):
+        ise = struct.unpack(">H", body[i:i + 2])[0]
+        pulse = ise & 0x03ff
+        repeat = ise >> 12
+        alternate = (ise & 0x0800) != 0
+        pulses.append(pulse)
+        for k in range(1, repeat + 1):
+            if alternate:
+                pulses.append(pulse + (k & 1))
+            else:
+                pulses.append(pulse)
+    return pulses
@@ -1,14 +1,11 @@
 from podcomm.protocol_common import *
 from podcomm.definitions import *
+from podcomm.pulses import Pulses
 from enum import IntEnum
-from decimal import Decimal
 import struct
 import time
 
 
-DECIMAL_0_05 = Decimal("0.05")
-DECIMAL_2_00 = Decimal("2")
-
 class StatusRequestType(IntEnum):
     Standard = 0
 
@@ -80,10 +77,7 @@ def request_alert_setup(alert_configurations):
 
 
 def request_set_basal_schedule(schedule, hour, minute, second):
-    halved_schedule = []
-
-    for entry in schedule:
-        halved_schedule.append(entry / DECIMAL_2_00)
+    compiled = compile_schedule(schedule)
 
     current_hh = hour * 2
     if minute < 30:
@@ -95,26 +89,17 @@ def request_set_basal_schedule(schedule, hour, minute, second):
     seconds_past_hh += second
     seconds_to_hh = 1800 - seconds_past_hh
 
-    pulse_list = getPulsesForHalfHours(halved_schedule)
-    ise_list = getInsulinScheduleTableFromPulses(pulse_list)
-    ise_body = getStringBodyFromTable(ise_list)
-    pulse_body = getStringBodyFromTable(pulse_list)
-
     command_body = bytes([0])
 
-    body_checksum = bytes([current_hh])
-
-    current_hh_pulse_count = pulse_list[current_hh]
+    current_hh_pulse_count = compiled.pulses[current_hh]
     remaining_pulse_count = int(current_hh_pulse_count * seconds_to_hh / 1800)
 
-    body_checksum += struct.pack(">H", seconds_to_hh * 8)
-    body_checksum += struct.pack(">H", remaining_pulse_count)
-
-    checksum = getChecksum(body_checksum + pulse_body)
+    body_checksum = struct.pack(">BHH", current_hh, seconds_to_hh * 8, remaining_pulse_count)
+    checksum = getChecksum(body_checksum) + compiled.pulse_body_checksum
 
     command_body += struct.pack(">H", checksum)
     command_body += body_checksum
-    command_body += ise_body
+    command_body += compiled.ise_body
 
     msg = PdmMessage(PdmRequest.InsulinSchedule, command_body)
 
@@ -124,27 +109,18 @@ def request_set_basal_schedule(schedule, hour, minute, second):
 
     command_body = bytes([reminders])
 
-    pulse_entries = getPulseIntervalEntries(halved_schedule)
-    table_index = 0
-    for pulses10, interval, indices in pulse_entries:
-        if current_hh in indices:
-            command_body += bytes([table_index])
-            ii = indices.index(current_hh)
-
-            pulses_past_intervals = int(ii * 1800000000 / interval)
-            pulses_past_this_interval = int(seconds_past_hh * 1000000 / interval) + 1
-            remaining_pulses_this_interval = pulses10 - pulses_past_this_interval - pulses_past_intervals
-            microseconds_to_next_interval = interval - (seconds_past_hh * 1000000 % interval)
-
-            command_body += struct.pack(">H", remaining_pulses_this_interval)
-            command_body += struct.pack(">I", microseconds_to_next_interval)
-            break
-        else:
-            table_index += 1
+    table_index, ii = compiled.get_interval_position(current_hh)
+    pulses10, interval, _ = compiled.interval_entries[table_index]
 
-    for pulse_count, interval, _ in pulse_entries:
-        command_body += struct.pack(">H", pulse_count)
-        command_body += struct.pack(">I", interval)
+    pulses_past_intervals = int(ii * 1800000000 / interval)
+    pulses_past_this_interval = int(seconds_past_hh * 1000000 / interval) + 1
+    remaining_pulses_this_interval = pulses10 - pulses_past_this_interval - pulses_past_intervals
+    microseconds_to_next_interval = interval - (seconds_past_hh * 1000000 % interval)
+
+    command_body += bytes([table_index])
+    command_body += struct.pack(">H", remaining_pulses_this_interval)
+    command_body += struct.pack(">I", microseconds_to_next_interval)
+    command_body += compiled.interval_body
 
     msg.add_part(PdmRequest.BasalSchedule, command_body)
     return msg
@@ -167,13 +143,13 @@ def request_acknowledge_alerts(alert_mask):
 
 
 def request_purge_insulin(iu_to_purge):
-    return _bolus_message(pulse_count=int(iu_to_purge / DECIMAL_0_05),
+    return _bolus_message(pulse_count=Pulses.from_units(iu_to_purge).count,
                           pulse_speed=8,
                           delivery_delay=1)
 
 
 def request_bolus(iu_bolus):
-    return _bolus_message(pulse_count=int(iu_bolus / DECIMAL_0_05))
+    return _bolus_message(pulse_count=Pulses.from_units(iu_bolus).count)
 
 
 def request_cancel_bolus():
@@ -181,24 +157,19 @@ def request_cancel_bolus():
 
 
 def request_temp_basal(basal_rate_iuhr, duration_hours):
-    half_hour_count = int(duration_hours * DECIMAL_2_00)
-    hh_units = [basal_rate_iuhr / DECIMAL_2_00] * half_hour_count
-    pulseList = getPulsesForHalfHours(hh_units)
-    iseList = getInsulinScheduleTableFromPulses(pulseList)
-
-    iseBody = getStringBodyFromTable(iseList)
-    pulseBody = getStringBodyFromTable(pulseList)
+    half_hour_count = int(duration_hours * 2)
+    compiled = compile_schedule([Pulses.from_units(basal_rate_iuhr)] * half_hour_count)
 
     cmd_body = bytes([0x01])
 
     body_checksum = bytes([half_hour_count])
     body_checksum += struct.pack(">H", 0x3840)
-    body_checksum += struct.pack(">H", pulseList[0])
-    checksum = getChecksum(body_checksum + pulseBody)
+    body_checksum += struct.pack(">H", compiled.pulses[0])
+    checksum = getChecksum(body_checksum) + compiled.pulse_body_checksum
 
     cmd_body += struct.pack(">H", checksum)
     cmd_body += body_checksum
-    cmd_body += iseBody
+    cmd_body += compiled.ise_body
 
     msg = PdmMessage(PdmRequest.InsulinSchedule, cmd_body)
 
@@ -207,15 +178,11 @@ def request_temp_basal(basal_rate_iuhr, duration_hours):
     #     reminders |= 0x40
 
     cmd_body = bytes([reminders, 0x00])
-    pulseEntries = getPulseIntervalEntries(hh_units)
 
-    firstPulseCount, firstInterval, _ = pulseEntries[0]
+    firstPulseCount, firstInterval, _ = compiled.interval_entries[0]
     cmd_body += struct.pack(">H", firstPulseCount)
     cmd_body += struct.pack(">I", firstInterval)
-
-    for pulseCount, interval, _ in pulseEntries:
-        cmd_body += struct.pack(">H", pulseCount)
-        cmd_body += struct.pack(">I", interval)
+    cmd_body += compiled.interval_body
 
     msg.add_part(PdmRequest.TempBasalSchedule, cmd_body)
     return msg
@@ -238,131 +205,229 @@ def request_delivery_flags(byte16, byte17):
     return PdmMessage(PdmRequest.SetDeliveryFlags, cmd_body)
 
 
-def response_parse(response, pod):
-    pod.nonce_syncword = None
-    parts = response.get_parts()
-    for response_type, response_body in parts:
-        if response_type == PodResponse.VersionInfo:
-            parse_version_response(response_body, pod)
-        elif response_type == PodResponse.DetailInfo:
-            parse_information_response(response_body, pod)
-        elif response_type == PodResponse.ResyncRequest:
-            parse_resync_response(response_body, pod)
-        elif response_type == PodResponse.Status:
-            parse_status_response(response_body, pod)
+_status_struct = struct.Struct(">BII")
+_alerts_struct = struct.Struct(">8H")
+_fault_struct = struct.Struct(">BBHBHBHHHBBBBBH")
+_version_struct = struct.Struct(">BBBBBBBBII")
+_address_struct = struct.Struct(">I")
+_syncword_struct = struct.Struct(">H")
+
+_unset = object()
+
+
+class PodSnapshot:
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshots are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Snapshots are immutable")
+
+    def get_values(self):
+        values = dict()
+        for name in self.__slots__:
+            value = getattr(self, name, _unset)
+            if value is not _unset:
+                values[name] = value
+        return values
+
+    def apply(self, pod):
+        pod.__dict__.update(self.get_values())
+        return self
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__,
+                           ", ".join(["%s=%r" % (k, v) for k, v in self.get_values().items()]))
+
+
+class StatusSnapshot(PodSnapshot):
+    __slots__ = ("state_last_updated", "state_bolus", "state_basal", "state_progress",
+                 "radio_message_sequence", "insulin_delivered", "insulin_canceled",
+                 "state_faulted", "state_alert", "state_active_minutes", "insulin_reservoir")
+
+    @staticmethod
+    def parse(response):
+        s0, s1, s2 = _status_struct.unpack(response)
+        state_bolus, state_basal = _delivery_states[s0 >> 4]
+        return StatusSnapshot(state_last_updated=time.time(),
+                              state_bolus=state_bolus,
+                              state_basal=state_basal,
+                              state_progress=PodProgress(s0 & 0xF),
+                              radio_message_sequence=(s1 & 0x00007800) >> 11,
+                              insulin_delivered=Pulses((s1 & 0x0FFF8000) >> 15).to_units(),
+                              insulin_canceled=Pulses(s1 & 0x000007FF).to_units(),
+                              state_faulted=((s2 >> 31) != 0),
+                              state_alert=(s2 >> 23) & 0xFF,
+                              state_active_minutes=(s2 & 0x007FFC00) >> 10,
+                              insulin_reservoir=Pulses(s2 & 0x000003FF).to_units())
+
+
+class DetailInfo(PodSnapshot):
+    __slots__ = ("state_alerts", "state_last_updated", "state_faulted", "state_progress",
+                 "state_bolus", "state_basal", "insulin_canceled", "radio_message_sequence",
+                 "insulin_delivered", "fault_event", "fault_event_rel_time", "insulin_reservoir",
+                 "state_active_minutes", "state_alert", "fault_table_access",
+                 "fault_insulin_state_table_corruption", "fault_internal_variables",
+                 "fault_immediate_bolus_in_progress", "fault_progress_before", "radio_low_gain",
+                 "radio_rssi", "fault_progress_before_2", "fault_information_type2_last_word")
+
+    @staticmethod
+    def parse(response):
+        parser = _detail_parsers.get(response[0], _unset)
+        if parser is _unset:
+            raise ProtocolError("Failed to parse the information response of type 0x%2X with content: %s"
+                                % (response[0], response.hex()))
+        if parser is None:
+            return DetailInfo()
+        return parser(response)
+
+    @staticmethod
+    def _parse_alerts(response):
+        return DetailInfo(state_alerts=_alerts_struct.unpack(response[3:]))
+
+    @staticmethod
+    def _parse_fault(response):
+        f = _fault_struct.unpack_from(response, 1)
+        state_bolus, state_basal = _delivery_states[f[1]]
+        return DetailInfo(state_last_updated=time.time(),
+                          state_faulted=True,
+                          state_progress=f[0],
+                          state_bolus=state_bolus,
+                          state_basal=state_basal,
+                          insulin_canceled=Pulses(f[2]).to_units(),
+                          radio_message_sequence=f[3],
+                          insulin_delivered=Pulses(f[4]).to_units(),
+                          fault_event=f[5],
+                          fault_event_rel_time=f[6],
+                          insulin_reservoir=Pulses(f[7]).to_units(),
+                          state_active_minutes=f[8],
+                          state_alert=f[9],
+                          fault_table_access=f[10],
+                          fault_insulin_state_table_corruption=f[11] >> 7,
+                          fault_internal_variables=(f[11] & 0x60) >> 6,
+                          fault_immediate_bolus_in_progress=(f[11] & 0x10) >> 4,
+                          fault_progress_before=(f[11] & 0x0F),
+                          radio_low_gain=(f[12] & 0xC0) >> 6,
+                          radio_rssi=f[12] & 0x3F,
+                          fault_progress_before_2=(f[13] & 0x0F),
+                          fault_information_type2_last_word=f[14])
+
+
+class VersionInfo(PodSnapshot):
+    __slots__ = ("state_last_updated", "id_version_unknown_7_bytes", "id_version_pm", "id_version_pi",
+                 "id_version_unknown_byte", "state_progress", "id_lot", "id_t",
+                 "radio_low_gain", "radio_rssi", "radio_address")
+
+    @staticmethod
+    def parse(response):
+        values = dict(state_last_updated=time.time())
+        if len(response) == 27:
+            values["id_version_unknown_7_bytes"] = bytes(response[0:7]).hex()
+            response = response[7:]
+
+        mx, my, mz, ix, iy, iz, unknown, progress, lot, tid = _version_struct.unpack_from(response)
+        values["id_version_pm"] = "%d.%d.%d" % (mx, my, mz)
+        values["id_version_pi"] = "%d.%d.%d" % (ix, iy, iz)
+        values["id_version_unknown_byte"] = "%d" % unknown
+        values["state_progress"] = progress & 0x0F
+        values["id_lot"] = lot
+        values["id_t"] = tid
+        if len(response) == 21:
+            values["radio_low_gain"] = response[17] >> 6
+            values["radio_rssi"] = response[17] & 0b00111111
+            values["radio_address"] = _address_struct.unpack_from(response, 17)[0]
         else:
-            raise ProtocolError("Unknown response type %02X" % response_type)
+            values["radio_address"] = _address_struct.unpack_from(response, 16)[0]
+        return VersionInfo(**values)
 
 
-def parse_information_response(response, pod):
-        if response[0] == 0x01:
-            pod.state_alerts = struct.unpack(">8H", response[3:])
-        elif response[0] == 0x02:
-            pod.state_last_updated = time.time()
-            pod.state_faulted = True
-            pod.state_progress = response[1]
-            parse_delivery_state(pod, response[2])
-            pod.insulin_canceled = struct.unpack(">H", response[3:5])[0] * 0.05
-            pod.radio_message_sequence = response[5]
-            pod.insulin_delivered = struct.unpack(">H", response[6:8])[0] * 0.05
-            pod.fault_event = response[8]
-            pod.fault_event_rel_time = struct.unpack(">H", response[9:11])[0]
-            pod.insulin_reservoir = struct.unpack(">H", response[11:13])[0] * 0.05
-            pod.state_active_minutes = struct.unpack(">H", response[13:15])[0]
-            pod.state_alert = response[15]
-            pod.fault_table_access = response[16]
-            pod.fault_insulin_state_table_corruption = response[17] >> 7
-            pod.fault_internal_variables = (response[17] & 0x60) >> 6
-            pod.fault_immediate_bolus_in_progress = (response[17] & 0x10) >> 4
-            pod.fault_progress_before = (response[17] & 0x0F)
-            pod.radio_low_gain = (response[18] & 0xC0) >> 6
-            pod.radio_rssi = response[18] & 0x3F
-            pod.fault_progress_before_2 = (response[19] & 0x0F)
-            pod.fault_information_type2_last_word = struct.unpack(">H", response[20:22])[0]
-        elif response[0] == 0x03:
-            pass
-        elif response[0] == 0x05:
-            pass
-        elif response[0] == 0x06:
-            pass
-        elif response[0] == 0x46:
-            pass
-        elif response[0] == 0x50:
-            pass
-        elif response[0] == 0x51:
-            pass
+class ResyncRequest(PodSnapshot):
+    __slots__ = ("nonce_syncword",)
+
+    @staticmethod
+    def parse(response):
+        if response[0] == 0x14:
+            return ResyncRequest(nonce_syncword=_syncword_struct.unpack(response[1:])[0])
         else:
-            raise ProtocolError("Failed to parse the information response of type 0x%2X with content: %s"
-                                % (response[0], response.hex()))
+            raise ProtocolError("Unknown resync request 0x%2x from pod" % response[0])
 
 
-def parse_resync_response(response, pod):
-    if response[0] == 0x14:
-        pod.nonce_syncword = struct.unpack(">H", response[1:])[0]
+def _get_delivery_states(delivery_state):
+    if delivery_state & 8 > 0:
+        state_bolus = BolusState.Extended
+    elif delivery_state & 4 > 0:
+        state_bolus = BolusState.Immediate
+    else:
+        state_bolus = BolusState.NotRunning
+
+    if delivery_state & 2 > 0:
+        state_basal = BasalState.TempBasal
+    elif delivery_state & 1 > 0:
+        state_basal = BasalState.Program
     else:
-        raise ProtocolError("Unknown resync request 0x%2x from pod" % response[0])
+        state_basal = BasalState.NotRunning
+    return state_bolus, state_basal
 
 
-def parse_status_response(response, pod):
-    pod.state_last_updated = time.time()
-    s = struct.unpack(">BII", response)
+_delivery_states = [_get_delivery_states(d) for d in range(0, 256)]
 
-    parse_delivery_state(pod, s[0] >> 4)
-    pod.state_progress = PodProgress(s[0] & 0xF)
+_detail_parsers = {0x01: DetailInfo._parse_alerts,
+                   0x02: DetailInfo._parse_fault,
+                   0x03: None,
+                   0x05: None,
+                   0x06: None,
+                   0x46: None,
+                   0x50: None,
+                   0x51: None}
 
-    pod.radio_message_sequence = (s[1] & 0x00007800) >> 11
+_response_parsers = {PodResponse.VersionInfo: VersionInfo.parse,
+                     PodResponse.DetailInfo: DetailInfo.parse,
+                     PodResponse.ResyncRequest: ResyncRequest.parse,
+                     PodResponse.Status: StatusSnapshot.parse}
 
-    pod.insulin_delivered = ((s[1] & 0x0FFF8000) >> 15) * 0.05
-    pod.insulin_canceled = (s[1] & 0x000007FF) * 0.05
 
-    pod.state_faulted = ((s[2] >> 31) != 0)
-    pod.state_alert = (s[2] >> 23) & 0xFF
-    pod.state_active_minutes = (s[2] & 0x007FFC00) >> 10
-    pod.insulin_reservoir = (s[2] & 0x000003FF) * 0.05
+def parse_response(response):
+    snapshots = []
+    for response_type, response_body in response.get_parts():
+        parser = _response_parsers.get(response_type)
+        if parser is None:
+            raise ProtocolError("Unknown response type %02X" % response_type)
+        snapshots.append(parser(response_body))
+    return snapshots
 
 
-def parse_delivery_state(pod, delivery_state):
-    if delivery_state & 8 > 0:
-        pod.state_bolus = BolusState.Extended
-    elif delivery_state & 4 > 0:
-        pod.state_bolus = BolusState.Immediate
-    else:
-        pod.state_bolus = BolusState.NotRunning
+def response_parse(response, pod):
+    snapshots = parse_response(response)
+    values = {"nonce_syncword": None}
+    for snapshot in snapshots:
+        values.update(snapshot.get_values())
+    pod.__dict__.update(values)
+    return snapshots
 
-    if delivery_state & 2 > 0:
-        pod.state_basal = BasalState.TempBasal
-    elif delivery_state & 1 > 0:
-        pod.state_basal = BasalState.Program
-    else:
-        pod.state_basal = BasalState.NotRunning
+
+def parse_information_response(response, pod):
+    return DetailInfo.parse(response).apply(pod)
+
+
+def parse_resync_response(response, pod):
+    return ResyncRequest.parse(response).apply(pod)
+
+
+def parse_status_response(response, pod):
+    return StatusSnapshot.parse(response).apply(pod)
+
+
+def parse_delivery_state(pod, delivery_state):
+    pod.state_bolus, pod.state_basal = _delivery_states[delivery_state]
 
 
 def parse_version_response(response, pod):
-    pod.state_last_updated = time.time()
-    if len(response) == 27:
-        pod.id_version_unknown_7_bytes = response[0:7].hex()
-        response = response[7:]
-
-    mx = response[0]
-    my = response[1]
-    mz = response[2]
-    pod.id_version_pm = "%d.%d.%d" % (mx, my, mz)
-
-    ix = response[3]
-    iy = response[4]
-    iz = response[5]
-    pod.id_version_pi = "%d.%d.%d" % (ix, iy, iz)
-
-    pod.id_version_unknown_byte = "%d" % response[6]
-    pod.state_progress = response[7] & 0x0F
-    pod.id_lot = struct.unpack(">I", response[8:12])[0]
-    pod.id_t = struct.unpack(">I", response[12:16])[0]
-    if len(response) == 21:
-        pod.radio_low_gain = response[17] >> 6
-        pod.radio_rssi = response[17] & 0b00111111
-        pod.radio_address = struct.unpack(">I", response[17:21])[0]
-    else:
-        pod.radio_address = struct.unpack(">I", response[16:20])[0]
+    return VersionInfo.parse(response).apply(pod)
 
 
 def _bolus_message(pulse_count, pulse_speed=16, reminders=0, delivery_delay=2):
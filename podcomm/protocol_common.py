@@ -1,9 +1,10 @@
 
 from podcomm.exceptions import PdmError, ProtocolError
 from enum import IntEnum
-from podcomm.crc import crc8, crc16
+from podcomm.crc import crc8, crc16, crc16_patch, Crc16State
 import struct
-from decimal import Decimal
+from podcomm.pulses import Pulses, TENTHS_PER_PULSE
+from collections import OrderedDict
 
 class PdmRequest(IntEnum):
     SetupPod = 0x03
@@ -36,12 +37,30 @@ class RadioPacketType(IntEnum):
     UN6 = 0b11000000,
     POD = 0b11100000
 
+RADIO_PACKET_TYPES = [RadioPacketType(t << 5) for t in range(0, 8)]
+
+_packet_header = struct.Struct(">IB")
+_single_bytes = [bytes([b]) for b in range(0, 256)]
+
+_message_header = struct.Struct(">IBB")
+_message_nonce = struct.Struct(">I")
+_message_crc = struct.Struct(">H")
+
+
+def _pack_packet(address, type, sequence, body):
+    data = _packet_header.pack(address, type | sequence) + body
+    return data + _single_bytes[crc8(data)]
+
+
 class RadioPacket:
+    __slots__ = ("address", "type", "sequence", "body", "data")
+
     def __init__(self, address, type, sequence, body):
         self.address = address
         self.type = type
         self.sequence = sequence % 32
         self.body = body
+        self.data = None
 
     @staticmethod
     def parse(data):
@@ -49,40 +68,88 @@ class RadioPacket:
             #raise ProtocolError("Packet length too small")
             return None
 
-        crc = data[-1]
-        crc_computed = crc8(data[:-1])
+        view = memoryview(data)
+        crc = view[-1]
+        crc_computed = crc8(view[:-1])
         if crc != crc_computed:
             #raise ProtocolError("Packet crc error")
             return None
 
-        address = struct.unpack(">I", data[0:4])[0]
-
-        type = RadioPacketType(data[4] & 0b11100000)
-        sequence = data[4] & 0b00011111
-
-        body = data[5:-1]
-        return RadioPacket(address, type, sequence, body)
+        address, b4 = _packet_header.unpack_from(view)
+        return RadioPacket(address, RADIO_PACKET_TYPES[b4 >> 5], b4 & 0b00011111, view[5:-1])
 
     def with_sequence(self, sequence):
-        self.sequence = sequence
+        if sequence != self.sequence:
+            self.sequence = sequence
+            self.data = None
         return self
 
+    def freeze(self):
+        return FrozenRadioPacket(self.address, self.type, self.sequence, self.body)
+
+    def get_length(self):
+        return len(self.body) + 6
+
+    def pack_into(self, buffer, offset=0):
+        length = len(self.body) + 6
+        _packet_header.pack_into(buffer, offset, self.address, self.type | self.sequence)
+        body_end = offset + length - 1
+        buffer[offset + 5:body_end] = self.body
+        buffer[body_end] = crc8(memoryview(buffer)[offset:body_end])
+        return length
+
     def get_data(self):
-        data = struct.pack(">I", self.address)
-        data += bytes([self.type | self.sequence ])
-        data += self.body
-        data +=  bytes([crc8(data)])
-        return data
+        if self.data is None:
+            self.data = _pack_packet(self.address, self.type, self.sequence, self.body)
+        return self.data
 
     def __str__(self):
             #return "Packet Addr: 0x%08x Type: %s Seq: 0x%02x Body: %s" % (self.address, self.type, self.sequence, self.body.hex())
             if self.type == RadioPacketType.CON:
-                return "%02x %s %08x %s" % (self.sequence, str(self.type)[-3:], self.address, self.body.hex())
+                return "%02x %s %08x %s" % (self.sequence, self.type.name, self.address, self.body.hex())
             else:
-                return "%02x %s %08x %s %s" % (self.sequence, str(self.type)[-3:], self.address,
+                return "%02x %s %08x %s %s" % (self.sequence, self.type.name, self.address,
                                                        self.body[0:4].hex(),
                                                        self.body[4:].hex())
 
+
+class FrozenRadioPacket(RadioPacket):
+    __slots__ = ()
+
+    def __init__(self, address, type, sequence, body):
+        set_slot = object.__setattr__
+        set_slot(self, "address", address)
+        set_slot(self, "type", type)
+        set_slot(self, "sequence", sequence % 32)
+        set_slot(self, "body", bytes(body))
+        set_slot(self, "data", _pack_packet(address, type, sequence % 32, body))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Radio packet is frozen")
+
+    def __delattr__(self, name):
+        raise AttributeError("Radio packet is frozen")
+
+    def __eq__(self, other):
+        if not isinstance(other, RadioPacket):
+            return NotImplemented
+        return self.data == other.get_data()
+
+    def __hash__(self):
+        return hash(self.data)
+
+    def with_sequence(self, sequence):
+        if sequence == self.sequence:
+            return self
+        return FrozenRadioPacket(self.address, self.type, sequence, self.body)
+
+    def freeze(self):
+        return self
+
+    def get_data(self):
+        return self.data
+
+
 class BaseMessage:
     def __init__(self):
         self.address = None
@@ -91,6 +158,12 @@ class BaseMessage:
         self.body_length = 0
         self.body = None
         self.body_prefix = None
+        self.body_received = 0
+        self.body_crc = None
+        self.frame = None
+        self.frame_crc = None
+        self.frame_nonce_offsets = None
+        self.frame_body_length = None
         self.parts = []
         self.message_str_prefix = "\n"
         self.type = None
@@ -103,17 +176,23 @@ class BaseMessage:
             self.expect_critical_followup = (radio_packet.body[4] & 0x80) > 0
             self.body_length = ((radio_packet.body[4] & 0x03) << 8) | radio_packet.body[5]
             self.body_prefix = radio_packet.body[:6]
-            self.body = radio_packet.body[6:]
+            self.body = bytearray(self.body_length + 2)
+            self.body_received = 0
+            self.body_crc = Crc16State(self.body_prefix)
+            self._append_body(memoryview(radio_packet.body)[6:])
         elif radio_packet.type == RadioPacketType.CON:
-            self.body += radio_packet.body
+            if self.body_crc is None:
+                raise ProtocolError("Continuation packet received before message start")
+            self._append_body(radio_packet.body)
         else:
             raise ProtocolError("Packet type invalid")
 
-        if self.body_length == len(self.body) - 2:
+        if self.body_received == self.body_length + 2:
             crc = struct.unpack(">H", self.body[-2:])[0]
-            crc_calculated = crc16(self.body_prefix + self.body[:-2])
+            crc_calculated = self.body_crc.digest()
             if crc == crc_calculated:
-                self.body = self.body[:-2]
+                self.body = bytes(memoryview(self.body)[:-2])
+                self.body_crc = None
 
                 bi = 0
                 while bi < len(self.body):
@@ -137,6 +216,18 @@ class BaseMessage:
         else:
             return False
 
+    def _append_body(self, data):
+        start = self.body_received
+        end = start + len(data)
+        if end > len(self.body):
+            raise ProtocolError("Message body exceeds declared length")
+
+        self.body[start:end] = data
+        crc_end = min(end, self.body_length)
+        if crc_end > start:
+            self.body_crc.update(memoryview(self.body)[start:crc_end])
+        self.body_received = end
+
     def get_parts(self):
         return self.parts
 
@@ -154,63 +245,94 @@ class BaseMessage:
         self.expect_critical_followup = expect_critical_follow_up
         self.address = message_address
 
-        message_body_len = 0
-        for _, cmd_body, nonce in self.parts:
-            message_body_len += len(cmd_body) + 2
-            if nonce is not None:
-                message_body_len += 4
+        if not self._frame_layout_matches():
+            self._build_frame()
 
+        frame = self.frame
+        message_body_len = self.frame_body_length
         if expect_critical_follow_up:
             b0 = 0x80
         else:
             b0 = 0x00
-
         b0 |= (message_sequence << 2)
         b0 |= (message_body_len >> 8) & 0x03
-        b1 = message_body_len & 0xff
 
-        message_body = struct.pack(">I", message_address)
-        message_body +=  bytes([b0, b1])
-        for cmd_type, cmd_body, nonce in self.parts:
-            if nonce is None:
-                if cmd_type == PodResponse.Status:
-                    message_body += bytes([cmd_type])
-                else:
-                    message_body += bytes([cmd_type, len(cmd_body)])
-            else:
-                message_body += bytes([cmd_type, len(cmd_body) + 4])
-                message_body += struct.pack(">I", nonce)
-            message_body += cmd_body
-
-        crc_calculated = crc16(message_body)
-        x = struct.pack(">H", crc_calculated)
-        message_body += x
+        self._patch_frame(0, _message_header.pack(message_address, b0, message_body_len & 0xff))
+        for (cmd_type, cmd_body, nonce), offset in zip(self.parts, self.frame_nonce_offsets):
+            if offset is not None:
+                self._patch_frame(offset, _message_nonce.pack(nonce))
+        _message_crc.pack_into(frame, len(frame) - 2, self.frame_crc)
 
-        index = 0
-        first_packet = True
+        # each packet copies its own slice, the frame is patched again on the next call
+        message_body = memoryview(frame)
         sequence = first_packet_sequence
-        total_body_len = len(message_body)
-        radio_packets = []
-        while(index < total_body_len):
-            to_write = min(31, total_body_len - index)
-            packet_body = message_body[index:index+to_write]
-
-            radio_packets.append(RadioPacket(packet_address,
-                                             self.type if first_packet else RadioPacketType.CON,
-                                             sequence,
-                                             packet_body))
-            first_packet = False
-            index += to_write
+        radio_packets = [RadioPacket(packet_address, self.type, sequence, bytes(message_body[0:31]))]
+        for index in range(31, len(message_body), 31):
             sequence = (sequence + 2) % 32
+            radio_packets.append(RadioPacket(packet_address, RadioPacketType.CON, sequence,
+                                             bytes(message_body[index:index + 31])))
+        message_body.release()
 
         if double_take:
             return [radio_packets[0]] + radio_packets
         else:
             return radio_packets
 
+    def _frame_layout_matches(self):
+        if self.frame is None or len(self.frame_nonce_offsets) != len(self.parts):
+            return False
+        for (cmd_type, cmd_body, nonce), offset in zip(self.parts, self.frame_nonce_offsets):
+            if (nonce is None) != (offset is None):
+                return False
+        return True
+
+    def _build_frame(self):
+        message_body_len = 0
+        for cmd_type, cmd_body, nonce in self.parts:
+            message_body_len += len(cmd_body) + 2
+            if nonce is not None:
+                message_body_len += 4
+
+        frame = bytearray(message_body_len + 8)
+        nonce_offsets = []
+        index = 6
+        for cmd_type, cmd_body, nonce in self.parts:
+            if nonce is None:
+                nonce_offsets.append(None)
+                if cmd_type == PodResponse.Status:
+                    frame[index] = cmd_type
+                    index += 1
+                else:
+                    frame[index] = cmd_type
+                    frame[index + 1] = len(cmd_body)
+                    index += 2
+            else:
+                frame[index] = cmd_type
+                frame[index + 1] = len(cmd_body) + 4
+                nonce_offsets.append(index + 2)
+                _message_nonce.pack_into(frame, index + 2, nonce)
+                index += 6
+            frame[index:index + len(cmd_body)] = cmd_body
+            index += len(cmd_body)
+
+        # status parts carry no length byte but are still counted as two in the header
+        del frame[index + 2:]
+        self.frame = frame
+        self.frame_body_length = message_body_len
+        self.frame_nonce_offsets = nonce_offsets
+        self.frame_crc = crc16(memoryview(frame)[:-2])
+
+    def _patch_frame(self, offset, data):
+        end = offset + len(data)
+        old_data = self.frame[offset:end]
+        if old_data != data:
+            self.frame_crc = crc16_patch(self.frame_crc, old_data, data, len(self.frame) - 2 - end)
+            self.frame[offset:end] = data
+
     def add_part(self, cmd_type, cmd_body):
         part_tuple = cmd_type, cmd_body, None
         self.parts.append(part_tuple)
+        self.frame = None
 
 
 class PodMessage(BaseMessage):
@@ -249,53 +371,113 @@ class PdmMessage(BaseMessage):
 
 
 
+SCHEDULE_CACHE_SIZE = 64
+
+_schedule_cache = OrderedDict()
+_interval_entry = struct.Struct(">HI")
+
+
+class CompiledSchedule:
+    def __init__(self, hourly_pulses):
+        self.hourly_pulses = hourly_pulses
+        self.pulses = []
+        interval_list = []
+
+        # half hour deliveries are accumulated in tenths of a pulse to stay exact
+        total_to_deliver = 0
+        total_delivered = 0
+        for rate in hourly_pulses:
+            hh_tenths = rate * TENTHS_PER_PULSE // 2
+            total_to_deliver += hh_tenths
+            pulse_count = (total_to_deliver - total_delivered) // TENTHS_PER_PULSE
+            total_delivered += pulse_count * TENTHS_PER_PULSE
+            self.pulses.append(pulse_count)
+
+            interval = 1800000000
+            if hh_tenths > 0:
+                interval = 1800000000 // hh_tenths
+            if interval < 200000:
+                raise PdmError()
+            elif interval > 1800000000:
+                raise PdmError()
+            interval_list.append((hh_tenths, interval))
+
+        self.ise_table = getInsulinScheduleTableFromPulses(self.pulses)
+        self.ise_body = getStringBodyFromTable(self.ise_table)
+        self.pulse_body = getStringBodyFromTable(self.pulses)
+        self.pulse_body_checksum = getChecksum(self.pulse_body)
+
+        self.interval_entries = []
+        self.interval_positions = []
+        sub_total_pulses = 0
+        last_interval = None
+        hh_indices = None
+        for index, (pulses10, interval) in enumerate(interval_list):
+            if last_interval == interval and sub_total_pulses + pulses10 < 65536 and sub_total_pulses > 0:
+                sub_total_pulses += pulses10
+                hh_indices.append(index)
+            else:
+                if last_interval is not None:
+                    self.interval_entries.append((sub_total_pulses, last_interval, hh_indices))
+                sub_total_pulses = pulses10
+                last_interval = interval
+                hh_indices = [index]
+            self.interval_positions.append((len(self.interval_entries), len(hh_indices) - 1))
+        if last_interval is not None:
+            self.interval_entries.append((sub_total_pulses, last_interval, hh_indices))
+
+        self.interval_body = b"".join([_interval_entry.pack(pulse_count, interval)
+                                       for pulse_count, interval, _ in self.interval_entries])
+
+    def get_interval_position(self, half_hour):
+        return self.interval_positions[half_hour]
+
+
+def compile_schedule(hourly_rates):
+    key = tuple([Pulses.from_units(rate).count for rate in hourly_rates])
+    compiled = _schedule_cache.get(key)
+    if compiled is None:
+        compiled = CompiledSchedule(key)
+        _schedule_cache[key] = compiled
+        if len(_schedule_cache) > SCHEDULE_CACHE_SIZE:
+            _schedule_cache.popitem(last=False)
+    else:
+        _schedule_cache.move_to_end(key)
+    return compiled
+
+
 def getInsulinScheduleTableFromPulses(pulses):
     iseTable = []
     ptr = 0
-    while ptr < len(pulses):
-        if ptr == len(pulses) - 1:
-            iseTable.append(getIse(pulses[ptr], 0, False))
+    count = len(pulses)
+    while ptr < count:
+        pulse = pulses[ptr]
+        if ptr == count - 1:
+            iseTable.append(getIse(pulse, 0, False))
             break
 
-        alternatingTable = pulses[ptr:]
-        for k in range(1, len(alternatingTable), 2):
-            alternatingTable[k] -= 1
+        # repeat counts are capped at 15, so never look further ahead than that
+        limit = min(count - ptr, 16)
+        repeats = 0
+        for k in range(1, limit):
+            if pulses[ptr + k] - (k & 1) != pulse:
+                break
+            repeats += 1
 
-        pulse = alternatingTable[0]
-        others = alternatingTable[1:]
-        repeats = getRepeatCount(pulse, others)
-        if repeats > 15:
-            repeats = 15
         if repeats > 0:
             iseTable.append(getIse(pulse, repeats, True))
         else:
-            pulse = pulses[ptr]
-            others = pulses[ptr + 1:]
-            repeats = getRepeatCount(pulse, others)
-            if repeats > 15:
-                repeats = 15
+            for k in range(1, limit):
+                if pulses[ptr + k] != pulse:
+                    break
+                repeats += 1
             iseTable.append(getIse(pulse, repeats, False))
         ptr += repeats + 1
     return iseTable
 
-def getPulsesForHalfHours(halfHourUnits):
-    halfHourlyDeliverySubtotals = []
-    totalToDeliver = Decimal(0)
-    for hhunit in halfHourUnits:
-        totalToDeliver += hhunit
-        halfHourlyDeliverySubtotals.append(totalToDeliver)
-
-    pulses = []
-    totalDelivered = Decimal(0)
-    for subtotal in halfHourlyDeliverySubtotals:
-        toDeliver = subtotal - totalDelivered
-        pulseCount = int(toDeliver * Decimal(20))
-        totalDelivered += Decimal(pulseCount) / Decimal(20)
-        pulses.append(pulseCount)
-
-    return pulses
-
 
+def getPulsesForHalfHours(halfHourUnits):
+    return list(compile_schedule([hhu * 2 for hhu in halfHourUnits]).pulses)
 
 
 def getIse(pulses, repeat, alternate):
@@ -315,17 +497,11 @@ def getRepeatCount(pulse, otherPulses):
 
 
 def getStringBodyFromTable(table):
-    st = bytes()
-    for val in table:
-        st += struct.pack(">H", val)
-    return st
+    return struct.pack(">%dH" % len(table), *table)
 
 
 def getChecksum(body):
-    checksum = 0
-    for c in body:
-        checksum += c
-    return checksum
+    return sum(body)
 
 
 def getHalfHourPulseInterval(pulseCount):
@@ -336,47 +512,6 @@ def getHalfHourPulseInterval(pulseCount):
 
 
 def getPulseIntervalEntries(halfHourUnits):
-    list1 = []
-    index = 0
-    for hhu in halfHourUnits:
-        pulses10 = hhu * Decimal("200")
-        interval = 1800000000
-        if hhu > 0:
-            interval = int(Decimal("9000000") / hhu)
-
-        if interval < 200000:
-            raise PdmError()
-        elif interval > 1800000000:
-            raise PdmError()
-
-        list1.append((int(pulses10), int(interval), index))
-        index += 1
-
-    list2 = []
-    lastPulseInterval = None
-    subTotalPulses = 0
-    hh_indices = []
-
-    for pulses, interval, index in list1:
-        if lastPulseInterval is None:
-            subTotalPulses = pulses
-            lastPulseInterval = interval
-            hh_indices.append(index)
-        elif lastPulseInterval == interval:
-            if subTotalPulses + pulses < 65536 and subTotalPulses > 0:
-                subTotalPulses += pulses
-                hh_indices.append(index)
-            else:
-                list2.append((subTotalPulses, lastPulseInterval, hh_indices))
-                subTotalPulses = pulses
-                hh_indices = [index]
-        else:
-            list2.append((subTotalPulses, lastPulseInterval, hh_indices))
-            subTotalPulses = pulses
-            lastPulseInterval = interval
-            hh_indices = [index]
-    else:
-        if lastPulseInterval >= 0:
-            list2.append((subTotalPulses, lastPulseInterval, hh_indices))
-
-    return list2
\ No newline at end of file
+    return [(pulse_count, interval, list(indices))
+            for pulse_count, interval, indices in
+            compile_schedule([hhu * 2 for hhu in halfHourUnits]).interval_entries]
@@ -1,9 +1,18 @@
 from .exceptions import PacketRadioError, OmnipyTimeoutError, RecoverableProtocolError, StatusUpdateRequired
 from podcomm.packet_radio import TxPower
 from podcomm.protocol_common import *
-from .pr_rileylink import RileyLink
 from .definitions import *
-from threading import Thread, Event, RLock
+from .retry_policy import *
+from .tx_power import *
+from .wake_window import *
+from .metrics import *
+from .packet_capture import *
+from .connection import ConnectionManager
+from threading import Thread, Event, Lock, RLock
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from queue import PriorityQueue, Empty
+from collections import deque
+import itertools
 import binascii
 import time
 import subprocess
@@ -13,6 +22,58 @@ def _ack_data(address1, address2, sequence):
                      struct.pack(">I", address2))
 
 
+class AckFrameCache:
+    def __init__(self, radio_address, packet_radio=None):
+        self.radio_address = radio_address
+        self.packet_radio = packet_radio
+        self.frames = dict()
+        self.encoded = dict()
+        if radio_address is not None:
+            for sequence in range(0, 32):
+                self.get(radio_address, sequence)
+                self.get(0, sequence)
+
+    def get(self, ack_address, sequence):
+        key = ack_address, sequence % 32
+        packet = self.frames.get(key)
+        if packet is None:
+            packet = _ack_data(self.radio_address, ack_address, sequence).freeze()
+            self.frames[key] = packet
+            if self.packet_radio is not None:
+                encoded = self.packet_radio.encode_packet(packet.data)
+                if encoded is not None:
+                    self.encoded[packet.data] = encoded
+        return packet
+
+    def get_encoded(self, data):
+        return self.encoded.get(data)
+
+
+REQUEST_PRIORITY_HIGH = 0
+REQUEST_PRIORITY_NORMAL = 10
+REQUEST_PRIORITY_LOW = 20
+
+_REQUEST_PRIORITY_SHUTDOWN = -1
+
+_PRECONNECT = object()
+
+
+class RadioRequest:
+    def __init__(self, message, message_address, ack_address_override=None, tx_power=None,
+                 double_take=False, expect_critical_follow_up=False,
+                 priority=REQUEST_PRIORITY_NORMAL, deadline=None):
+        self.message = message
+        self.message_address = message_address
+        self.ack_address_override = ack_address_override
+        self.tx_power = tx_power
+        self.double_take = double_take
+        self.expect_critical_follow_up = expect_critical_follow_up
+        self.priority = priority
+        self.deadline = deadline
+        self.queued = time.time()
+        self.future = Future()
+
+
 class MessageExchange:
     def __init__(self):
         self.unique_packets = 0
@@ -26,100 +87,157 @@ class MessageExchange:
         self.queued = 0
         self.started = 0
         self.ended = 0
+        self.attempts = []
+        self.rssi = []
+        self.wake_samples = []
 
 
 class PdmRadio:
-    def __init__(self, radio_address, msg_sequence=0, pkt_sequence=0, packet_radio=None):
+    def __init__(self, radio_address, msg_sequence=0, pkt_sequence=0, packet_radio=None, tx_level=None,
+                 wake_model_state=None, metrics=None, connection=None, clock=time, retry_policy=None):
         self.rssi_total = 0
         self.rssi_count = 0
-        self.radio_address = radio_address
+        self.ack_frames = None
         self.message_sequence = msg_sequence
         self.packet_sequence = pkt_sequence
         self.logger = getLogger()
         self.packet_logger = get_packet_logger()
+        self.packet_capture = get_packet_capture()
+        self.clock = clock
 
         if packet_radio is None:
+            from .pr_rileylink import RileyLink
             self.packet_radio = RileyLink()
         else:
             self.packet_radio = packet_radio
+        self.radio_address = radio_address
+
+        if tx_level is None:
+            tx_level = self.packet_radio.get_tx_level(TxPower.Normal)
+        self.tx_power_controller = TxPowerController(self.packet_radio.get_tx_level_count(), level=tx_level)
 
         self.last_packet_received = None
         self.last_sync_timestamp = None
+        self.wake_model = WakeWindowModel(state=wake_model_state)
 
-        self.request_arrived = Event()
-        self.response_received = Event()
-        self.request_shutdown = Event()
-        self.request_message = None
-        self.double_take = False
-        self.tx_power = None
-        self.expect_critical_follow_up = False
-        self.pod_message = None
-        self.response_exception = None
+        self.requests = PriorityQueue()
+        self.request_counter = itertools.count()
+        self.queued_requests = 0
+        self.queued_requests_lock = Lock()
         self.radio_thread = None
+        self.request_listener = None
+        self.final_ack_overlap_after = 3.5
+        if connection is None:
+            connection = ConnectionManager(clock=clock)
+        self.connection = connection
 
-        self.pdm_message = None
-        self.pdm_message_address = None
-        self.ack_address_override = None
         self.debug_cut_last_ack = False
         self.debug_cut_msg_after = None
         self.debug_cut_message_seq = 0
         self.debug_cut_packet_seq = 0
 
-        self.stats = []
+        self.stats = deque(maxlen=32)
+        if metrics is None:
+            metrics = ExchangeMetrics(clock=clock)
+        self.metrics = metrics
         self.current_exchange = MessageExchange()
+        if retry_policy is None:
+            retry_policy = LadderRetryPolicy()
+        self.retry_policy = retry_policy
+        self.link_statistics = LinkStatistics()
         self.radio_lock = RLock()
         self.start()
 
+    @property
+    def radio_address(self):
+        return self._radio_address
+
+    @radio_address.setter
+    def radio_address(self, value):
+        self._radio_address = value
+        self.ack_frames = AckFrameCache(value, self.packet_radio)
+
     def start(self):
         with self.radio_lock:
             self.radio_thread = Thread(target=self._radio_loop)
             self.radio_thread.setDaemon(True)
-            self._radio_init()
+            self._radio_init(reset=False)
             self.radio_thread.start()
+            self.connection.attach(self._preconnect)
 
     def stop(self):
         with self.radio_lock:
-            self.request_shutdown.set()
-            self.request_arrived.set()
-            self.radio_thread.join()
+            radio_thread = self.radio_thread
             self.radio_thread = None
-            self.request_shutdown.clear()
+            self.connection.detach()
+            self._put_request(_REQUEST_PRIORITY_SHUTDOWN, None)
+            radio_thread.join()
+            self._fail_pending_requests()
+
+    def submit_message(self, message,
+                       message_address=None,
+                       ack_address_override=None,
+                       tx_power=None, double_take=False,
+                       expect_critical_follow_up=False,
+                       priority=REQUEST_PRIORITY_NORMAL,
+                       deadline=None):
+        if message_address is None:
+            message_address = self.radio_address
+        request = RadioRequest(message, message_address, ack_address_override=ack_address_override,
+                               tx_power=tx_power, double_take=double_take,
+                               expect_critical_follow_up=expect_critical_follow_up,
+                               priority=priority, deadline=deadline)
+        request.queued = self.clock.time()
+        listener = self.request_listener
+        if listener is not None:
+            listener(request)
+        with self.radio_lock:
+            if self.radio_thread is None:
+                raise PacketRadioError("Radio is stopped")
+            self._put_request(priority, request)
+        return request.future
 
     def send_message_get_message(self, message,
                                  message_address = None,
                                  ack_address_override=None,
                                  tx_power=None, double_take=False,
-                                 expect_critical_follow_up=False):
-        queued = time.time()
-        with self.radio_lock:
-            if self.radio_thread is None:
-                raise PacketRadioError("Radio is stopped")
-
-            self.pdm_message = message
-            if message_address is None:
-                self.pdm_message_address = self.radio_address
-            else:
-                self.pdm_message_address = message_address
-            self.ack_address_override = ack_address_override
-            self.pod_message = None
-            self.double_take = double_take
-            self.tx_power = tx_power
-            self.expect_critical_follow_up = expect_critical_follow_up
-
-            self.request_arrived.set()
-
-            self.response_received.wait()
-            self.response_received.clear()
-            self.current_exchange.queued = queued
-
-            if self.pod_message is None:
-                self.current_exchange.successful = False
-                self.stats.append(self.current_exchange)
-                raise self.response_exception
-
-            self.current_exchange.successful = True
-            self.stats.append(self.current_exchange)
-            return self.pod_message
+                                 expect_critical_follow_up=False,
+                                 priority=REQUEST_PRIORITY_NORMAL,
+                                 deadline=None):
+        future = self.submit_message(message, message_address=message_address,
+                                     ack_address_override=ack_address_override,
+                                     tx_power=tx_power, double_take=double_take,
+                                     expect_critical_follow_up=expect_critical_follow_up,
+                                     priority=priority, deadline=deadline)
+        radio_thread = self.radio_thread
+        while True:
+            try:
+                return future.result(timeout=5.0)
+            except FutureTimeoutError:
+                if (radio_thread is None or not radio_thread.is_alive()) and not future.done():
+                    raise PacketRadioError("Radio thread exited before completing the request")
+
+    def _put_request(self, priority, request):
+        # shutdown and preconnect entries share the queue, only requests are counted
+        if isinstance(request, RadioRequest):
+            with self.queued_requests_lock:
+                self.queued_requests += 1
+        self.requests.put((priority, next(self.request_counter), request))
+
+    def _take_request(self, request):
+        if isinstance(request, RadioRequest):
+            with self.queued_requests_lock:
+                self.queued_requests -= 1
+
+    def _fail_pending_requests(self):
+        while True:
+            try:
+                _, _, request = self.requests.get_nowait()
+            except Empty:
+                break
+            self._take_request(request)
+            if isinstance(request, RadioRequest) and request.future.set_running_or_notify_cancel():
+                request.future.set_exception(PacketRadioError("Radio is stopped"))
 
     def get_packet(self, timeout=30000):
         with self.radio_lock:
@@ -131,77 +249,143 @@ class PdmRadio:
         with self.radio_lock:
             self._disconnect()
 
-    def _disconnect(self):
+    def expect_request(self, at):
+        self.connection.expect_request(at)
+
+    def _disconnect(self, idle=False, reset=False):
+        self.connection.on_disconnected(idle)
         try:
-            self.packet_radio.disconnect(ignore_errors=True)
+            if reset:
+                self.packet_radio.reset_link()
+            else:
+                self.packet_radio.disconnect(ignore_errors=True)
         except Exception:
             self.logger.exception("Error while disconnecting")
 
+    def _preconnect(self):
+        self._put_request(REQUEST_PRIORITY_LOW, _PRECONNECT)
+
+    def _next_request(self):
+        if self.connection.connected:
+            try:
+                return self.requests.get(timeout=self.connection.get_idle_timeout(self.clock.time()))
+            except Empty:
+                self.logger.debug("Disconnecting idle radio")
+                self._disconnect(idle=True)
+        return self.requests.get()
+
+    def _ensure_connected(self):
+        if self.connection.connected:
+            return
+        started = self.clock.time()
+        try:
+            self.packet_radio.connect()
+        except PacketRadioError:
+            self.logger.exception("Error while connecting")
+            if not self._radio_init(3):
+                raise
+            return
+        self.connection.on_connected(self.clock.time() - started)
+
     def _radio_loop(self):
         while True:
-            if not self.request_arrived.wait(timeout=5.0):
-                self._disconnect()
-            self.request_arrived.wait()
-            self.request_arrived.clear()
-
-            if self.request_shutdown.wait(0):
+            priority, _, request = self._next_request()
+            self._take_request(request)
+            if request is None:
                 self._disconnect()
                 break
 
-            self.current_exchange = MessageExchange()
-            self.current_exchange.started = time.time()
+            if request is _PRECONNECT:
+                try:
+                    self.connection.on_preconnect()
+                    self._ensure_connected()
+                except Exception:
+                    self.logger.exception("Error while connecting ahead of an expected request")
+                continue
 
+            if not request.future.set_running_or_notify_cancel():
+                self.logger.debug("Skipping canceled request")
+                continue
+
+            if request.deadline is not None and self.clock.time() > request.deadline:
+                request.future.set_exception(OmnipyTimeoutError("Request deadline passed before it was sent"))
+                continue
+
+            self.packet_radio.begin_exchange(priority)
             try:
-                self.pod_message = self._send_and_get(self.pdm_message, self.pdm_message_address,
-                                                      self.ack_address_override,
-                                                      tx_power=self.tx_power, double_take=self.double_take,
-                                                      expect_critical_follow_up=self.expect_critical_follow_up)
-                self.response_exception = None
-            except Exception as e:
-                self.pod_message = None
-                self.response_exception = e
-
-            if self.response_exception is None:
-                ack_packet = self._final_ack(self.ack_address_override, self.packet_sequence)
-                self.current_exchange.ended = time.time()
-                self.response_received.set()
-
-                if not self.debug_cut_last_ack:
-                    try:
-                        self._send_packet(ack_packet, allow_premature_exit_after=3.5)
-                    except Exception:
-                        self.logger.exception("Error during ending conversation, ignored.")
-                else:
-                    self.message_sequence = (self.message_sequence - self.debug_cut_message_seq) % 16
-                    self.packet_sequence = (self.packet_sequence - self.debug_cut_packet_seq) % 16
-                    self.last_packet_received = None
-            else:
-                self.current_exchange.ended = time.time()
-                self.response_received.set()
+                self._process_request(request)
+            finally:
+                self.packet_radio.end_exchange()
+
+    def _process_request(self, request):
+        self.current_exchange = MessageExchange()
+        self.current_exchange.queued = request.queued
+        self.current_exchange.started = self.clock.time()
+
+        try:
+            self.connection.on_request(request.queued)
+            self._ensure_connected()
+            pod_message = self._send_and_get(request.message, request.message_address,
+                                             request.ack_address_override,
+                                             tx_power=request.tx_power, double_take=request.double_take,
+                                             expect_critical_follow_up=request.expect_critical_follow_up)
+        except Exception as e:
+            self.current_exchange.ended = self.clock.time()
+            self.current_exchange.successful = False
+            self._add_stats(request, e)
+            request.future.set_exception(e)
+            return
+
+        ack_packet = self._final_ack(request.ack_address_override, self.packet_sequence)
+        self.current_exchange.ended = self.clock.time()
+        self.current_exchange.successful = True
+        self._add_stats(request, None)
+        request.future.set_result(pod_message)
+
+        if not self.debug_cut_last_ack:
+            try:
+                self._send_packet(ack_packet, allow_premature_exit_after=self.final_ack_overlap_after)
+            except Exception:
+                self.logger.exception("Error during ending conversation, ignored.")
+        else:
+            self.message_sequence = (self.message_sequence - self.debug_cut_message_seq) % 16
+            self.packet_sequence = (self.packet_sequence - self.debug_cut_packet_seq) % 16
+            self.last_packet_received = None
+
+    def _add_stats(self, request, error):
+        self.stats.append(self.current_exchange)
+        try:
+            self.metrics.add(get_request_name(request.message), get_outcome(error), self.current_exchange)
+        except Exception:
+            self.logger.exception("Error while recording exchange metrics")
 
     def _interim_ack(self, ack_address_override, sequence):
         if ack_address_override is None:
-            return _ack_data(self.radio_address, self.radio_address, sequence)
+            return self.ack_frames.get(self.radio_address, sequence)
         else:
-            return _ack_data(self.radio_address, ack_address_override, sequence)
+            return self.ack_frames.get(ack_address_override, sequence)
 
     def _final_ack(self, ack_address_override, sequence):
         if ack_address_override is None:
-            return _ack_data(self.radio_address, 0, sequence)
+            return self.ack_frames.get(0, sequence)
         else:
-            return _ack_data(self.radio_address, ack_address_override, sequence)
+            return self.ack_frames.get(ack_address_override, sequence)
 
-    def _radio_init(self, retries=1):
+    def _radio_init(self, retries=1, reset=True):
         retry = 0
         while retry < retries:
             try:
-                self.packet_radio.disconnect()
+                if reset or retry > 0:
+                    self.packet_radio.reset_link()
+                started = self.clock.time()
                 self.packet_radio.connect(force_initialize=True)
+                self.connection.on_connected(self.clock.time() - started)
                 return True
             except:
                 self.logger.exception("Error during radio initialization")
+                self.connection.on_disconnected()
                 self._kill_btle_subprocess()
-                time.sleep(2)
+                self.clock.sleep(2)
                 retry += 1
         return False
 
@@ -232,7 +416,12 @@ class PdmRadio:
 
         try:
             if tx_power is not None:
+                self.tx_power_controller.enabled = False
+                self.tx_power_controller.invalidate()
                 self.packet_radio.set_tx_power(tx_power)
+            else:
+                self.tx_power_controller.enabled = True
+                self.tx_power_controller.apply(self.packet_radio)
         except PacketRadioError:
             if not self._radio_init(3):
                 raise
@@ -244,8 +433,10 @@ class PdmRadio:
 
         for part in range(0, packet_count):
             packet = packets[part]
+            position = get_part_position(part, packet_count)
             repeat_count = -1
-            timeout = 10
+            spent = 0
+            timeout = self.retry_policy.initial_timeout(position, self.link_statistics)
             while True:
                 repeat_count += 1
                 if repeat_count == 0:
@@ -259,88 +450,45 @@ class PdmRadio:
                 else:
                     expected_type = RadioPacketType.ACK
 
+                attempt_started = self.clock.time()
                 try:
                     if self.debug_cut_msg_after is None or self.debug_cut_msg_after != part:
                         received = self._exchange_packets(packet.with_sequence(self.packet_sequence),
                                                           expected_type=expected_type,
                                                           timeout=timeout)
+                        self._record_attempt(part, position, ATTEMPT_OK, attempt_started)
                         break
                     else:
                         raise Exception("debug cut here")
                 except OmnipyTimeoutError:
                     self.logger.debug("Trying to recover from timeout error")
-                    if part == 0:
-                        if repeat_count == 0:
-                            timeout = 15
-                            continue
-                        elif repeat_count == 1:
-                            timeout = 10
-                            time.sleep(2)
-                            continue
-                        elif repeat_count == 2:
-                            self._radio_init()
-                            timeout = 15
-                            continue
-                        else:
-                            self.logger.debug("Failed recovery")
-                            self._reset_sequences()
-                            raise
-                    elif part < packet_count - 1:
-                        if repeat_count < 2:
-                            timeout = 20
-                            continue
-                        else:
-                            raise
-                    else:
-                        if repeat_count < 10:
-                            timeout = 20
-                            continue
-                        else:
-                            raise
+                    spent += self._record_attempt(part, position, ATTEMPT_TIMEOUT, attempt_started)
+                    decision = self._apply_retry_policy(RETRY_TIMEOUT, position, repeat_count, spent)
+                    if not decision.retry:
+                        raise
+                    if decision.timeout is not None:
+                        timeout = decision.timeout
+                    continue
                 except PacketRadioError:
                     self.logger.debug("Trying to recover from radio error")
                     self.current_exchange.radio_errors += 1
-                    if part == 0:
-                        if repeat_count < 2:
-                            self._radio_init()
-                            continue
-                        elif repeat_count < 4:
-                            self._disconnect()
-                            self._kill_btle_subprocess()
-                            timeout = 10
-                            time.sleep(2)
-                            continue
-                        else:
-                            self.logger.debug("Failed recovery")
-                            raise
-                    elif part < packet_count - 1:
-                        if repeat_count < 6:
-                            self._disconnect()
-                            self._kill_btle_subprocess()
-                            timeout = 10
-                            time.sleep(2)
-                            continue
-                        else:
-                            self.logger.debug("Failed recovery")
-                            raise
-                    else:
-                        if repeat_count < 10:
-                            self._disconnect()
-                            self._kill_btle_subprocess()
-                            timeout = 10
-                            time.sleep(2)
-                            continue
-                        else:
-                            self.logger.debug("Failed recovery")
-                            raise
+                    spent += self._record_attempt(part, position, ATTEMPT_RADIO_ERROR, attempt_started)
+                    decision = self._apply_retry_policy(RETRY_RADIO_ERROR, position, repeat_count, spent)
+                    if not decision.retry:
+                        raise
+                    if decision.timeout is not None:
+                        timeout = decision.timeout
+                    continue
                 except RecoverableProtocolError as rpe:
                     self.logger.debug("Trying to recover from protocol error")
+                    self._record_attempt(part, position, ATTEMPT_PROTOCOL_ERROR, attempt_started)
                     self.packet_sequence = (rpe.packet.sequence + 1) % 32
                     if expected_type == RadioPacketType.POD and rpe.packet.type == RadioPacketType.ACK:
                         raise StatusUpdateRequired()
                     continue
                 except ProtocolError:
                     self.logger.debug("Trying to recover from protocol error")
+                    self._record_attempt(part, position, ATTEMPT_PROTOCOL_ERROR, attempt_started)
                     self.packet_sequence = (self.packet_sequence + 2) % 32
                     continue
 
@@ -365,83 +513,107 @@ class PdmRadio:
         self.packet_sequence = (received.sequence + 1) % 32
         return pod_response
 
+    def _record_attempt(self, part, position, kind, started):
+        elapsed = self.clock.time() - started
+        self.current_exchange.attempts.append((part, position, kind, elapsed))
+        self.link_statistics.add_attempt(kind, elapsed)
+        return elapsed
+
+    def _apply_retry_policy(self, kind, position, repeat_count, spent):
+        decision = self.retry_policy.on_error(kind, position, repeat_count, spent, self.link_statistics)
+        if not decision.retry:
+            self.logger.debug("Failed recovery")
+            if decision.reset_sequences:
+                self._reset_sequences()
+            return decision
+
+        if decision.recovery == RECOVERY_REINIT:
+            self._radio_init()
+        elif decision.recovery == RECOVERY_RESET:
+            self._disconnect(reset=True)
+            self._kill_btle_subprocess()
+        if decision.delay > 0:
+            self.clock.sleep(decision.delay)
+        return decision
+
     def _send_get(self, send_data):
-        if self.last_sync_timestamp is None or time.time() - self.last_sync_timestamp > 5:
-            received = self._send_get_with_ext(send_data)
+        if self.last_sync_timestamp is None:
+            gap = None
         else:
-            received = self._send_get_no_ext(send_data)
+            gap = self.clock.time() - self.last_sync_timestamp
+
+        received = None
+        encoded = self.ack_frames.get_encoded(send_data)
+        for candidate in self.wake_model.choose_plan(gap):
+            started = self.clock.time()
+            if encoded is None:
+                received = self.packet_radio.send_and_receive_packet(send_data, *candidate.params)
+            else:
+                received = self.packet_radio.send_and_receive_encoded(encoded, *candidate.params)
+            sample = (gap, self.wake_model.candidates.index(candidate), received is not None,
+                      self.clock.time() - started)
+            self.wake_model.observe(*sample)
+            self.current_exchange.wake_samples.append(sample)
+            self.packet_capture.add_wake_sample(started, *sample)
+            if received is not None:
+                break
 
         if received is None:
             self.last_sync_timestamp = None
         else:
-            self.last_sync_timestamp = time.time()
-
-        return received
-
-    def _send_get_with_ext(self, send_data):
-        received = self.packet_radio.send_and_receive_packet(send_data, 0, 0, 110, 0, 300)
-        if received is None:
-            return self._send_get_no_ext(send_data)
+            self.last_sync_timestamp = self.clock.time()
         return received
 
-    def _send_get_no_ext(self, send_data):
-        return self.packet_radio.send_and_receive_packet(send_data, 3, 0, 660, 0, 80)
-
     def _exchange_packets(self, packet_to_send, expected_type, timeout=10):
         #self.packet_radio.channel += 1
         start_time = None
         first = True
-        while start_time is None or time.time() - start_time < timeout:
+        while start_time is None or self.clock.time() - start_time < timeout:
             if first:
                 first = False
             else:
                 self.current_exchange.repeated_sends += 1
 
-            received = self._send_get(packet_to_send.get_data())
+            send_data = packet_to_send.get_data()
+            self.packet_capture.add(self.clock.time(), CAPTURE_SEND, send_data)
+            received = self._send_get(send_data)
 
             if start_time is None:
-                start_time = time.time()
-
-            self.packet_logger.info("SEND PKT %s" % packet_to_send)
+                start_time = self.clock.time()
 
             if received is None:
                 self.current_exchange.receive_timeouts += 1
-                self.packet_logger.debug("RECV PKT None")
-                self.packet_radio.tx_up()
+                self.packet_capture.add(self.clock.time(), CAPTURE_RECV_NONE)
+                self._tx_feedback(TX_EVENT_TIMEOUT)
                 continue
             p, rssi = self._get_packet(received)
             if p is None:
                 self.current_exchange.bad_packets += 1
-                self.packet_logger.debug("RECV PKT BAD DATA: %s" % received.hex())
-                self.packet_radio.tx_down()
+                self._tx_feedback(TX_EVENT_NOISE)
                 continue
 
-            self.packet_logger.info("RECV PKT %s" % p)
             if p.address != self.radio_address:
                 self.current_exchange.bad_packets += 1
-                self.packet_logger.debug("RECV PKT ADDR MISMATCH")
-                self.packet_radio.tx_down()
+                self._tx_feedback(TX_EVENT_NOISE)
                 continue
 
             if self.last_packet_received is not None and \
                         p.sequence == self.last_packet_received.sequence and \
                         p.type == self.last_packet_received.type:
                 self.current_exchange.repeated_receives += 1
-                self.packet_logger.debug("RECV PKT previous")
-                self.packet_radio.tx_up()
+                self._tx_feedback(TX_EVENT_REPEAT)
                 continue
 
             self.last_packet_received = p
             self.packet_sequence = (p.sequence + 1) % 32
+            self._tx_feedback(TX_EVENT_RESPONSE, rssi)
 
             if expected_type is not None and p.type != expected_type:
-                self.packet_logger.debug("RECV PKT unexpected type %s" % p)
                 self.current_exchange.protocol_errors += 1
                 raise RecoverableProtocolError("Unexpected packet type", p)
 
             if p.sequence != (packet_to_send.sequence + 1) % 32:
                 self.packet_sequence = (p.sequence + 1) % 32
-                self.packet_logger.debug("RECV PKT unexpected sequence %s" % p)
                 self.last_packet_received = p
                 self.current_exchange.protocol_errors += 1
                 raise RecoverableProtocolError("Incorrect packet sequence", p)
@@ -453,52 +625,51 @@ class PdmRadio:
     def _send_packet(self, packet_to_send, timeout=25, allow_premature_exit_after=None):
         start_time = None
         self.current_exchange.unique_packets += 1
-        while start_time is None or time.time() - start_time < timeout:
+        while start_time is None or self.clock.time() - start_time < timeout:
             try:
-                self.packet_logger.info("SEND PKT %s" % packet_to_send)
-                received = self._send_get(packet_to_send.get_data())
+                send_data = packet_to_send.get_data()
+                self.packet_capture.add(self.clock.time(), CAPTURE_SEND, send_data)
+                received = self._send_get(send_data)
                 if start_time is None:
-                    start_time = time.time()
+                    start_time = self.clock.time()
 
-                if allow_premature_exit_after is not None and \
-                        time.time() - start_time >= allow_premature_exit_after:
-                    if self.request_arrived.wait(timeout=0):
+                if allow_premature_exit_after is not None and self.queued_requests > 0:
+                    if received is None:
+                        self.logger.debug("Pod is silent, continuing with next request")
+                        self.packet_sequence = (self.packet_sequence + 1) % 32
+                        break
+                    if self.clock.time() - start_time >= allow_premature_exit_after:
                         self.logger.debug("Prematurely exiting final phase to process next request")
                         self.packet_sequence = (self.packet_sequence + 1) % 32
                         break
                 if received is None:
                     received = self.packet_radio.get_packet(0.6)
                     if received is None:
-                        self.packet_logger.debug("Silence")
+                        self.packet_capture.add(self.clock.time(), CAPTURE_SILENCE)
                         self.packet_sequence = (self.packet_sequence + 1) % 32
                         break
                 p, rssi = self._get_packet(received)
                 if p is None:
                     self.current_exchange.bad_packets += 1
-                    self.packet_logger.debug("RECV PKT bad %s" % received.hex())
-                    self.packet_radio.tx_down()
+                    self._tx_feedback(TX_EVENT_NOISE)
                     continue
 
                 if p.address != self.radio_address:
                     self.current_exchange.bad_packets += 1
-                    self.packet_logger.debug("RECV PKT ADDR MISMATCH")
-                    self.packet_radio.tx_down()
+                    self._tx_feedback(TX_EVENT_NOISE)
                     continue
 
                 if self.last_packet_received is not None:
                     self.current_exchange.repeated_receives += 1
                     if p.type == self.last_packet_received.type and p.sequence == self.last_packet_received.sequence:
-                        self.packet_logger.debug("RECV PKT previous")
-                        self.packet_radio.tx_up()
+                        self._tx_feedback(TX_EVENT_REPEAT)
                         continue
 
-                self.packet_logger.info("RECV PKT %s" % p)
-                self.packet_logger.debug("RECEIVED unexpected packet: %s" % p)
                 self.current_exchange.protocol_errors = 1
                 self.last_packet_received = p
                 self.packet_sequence = (p.sequence + 1) % 32
-                packet_to_send.with_sequence(self.packet_sequence)
-                start_time = time.time()
+                packet_to_send = packet_to_send.with_sequence(self.packet_sequence)
+                start_time = self.clock.time()
                 continue
 
 
@@ -507,19 +678,39 @@ class PdmRadio:
                 self.logger.exception("Radio error during send and receive, retrying")
                 if not self._radio_init(3):
                     raise
-                start_time = time.time()
+                start_time = self.clock.time()
         else:
             self.logger.warning("Exceeded timeout while waiting for silence to fall")
 
+    def _tx_feedback(self, event, rssi=None):
+        controller = self.tx_power_controller
+        if not controller.enabled:
+            return
+        if controller.level_count == 0:
+            if event == TX_EVENT_TIMEOUT or event == TX_EVENT_REPEAT:
+                self.packet_radio.tx_up()
+            elif event == TX_EVENT_NOISE:
+                self.packet_radio.tx_down()
+            return
+        controller.update(event, rssi)
+        controller.apply(self.packet_radio)
+
     def _get_packet(self, data):
         rssi = None
         if data is not None and len(data) > 2:
             rssi = (255 - data[0]) / -2 - 73
-            getLogger().debug("RSSI: %d" % (rssi))
             self.rssi_total += rssi
             self.rssi_count += 1
+            self.current_exchange.rssi.append(rssi)
+            self.link_statistics.add_rssi(rssi)
+            frame = memoryview(data)[2:]
             try:
-                return RadioPacket.parse(data[2:]), rssi
+                p = RadioPacket.parse(frame)
+                if p is None:
+                    self.packet_capture.add(self.clock.time(), CAPTURE_RECV_BAD, frame, rssi)
+                else:
+                    self.packet_capture.add(self.clock.time(), CAPTURE_RECV, frame, rssi)
+                return p, rssi
             except:
                 getLogger().exception("RECEIVED DATA: %s RSSI: %d" % (binascii.hexlify(data[2:]), rssi))
         return None, rssi
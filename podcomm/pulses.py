@@ -0,0 +1,87 @@
+from .exceptions import PdmError
+from decimal import Decimal
+from functools import total_ordering
+
+PULSES_PER_UNIT = 20
+TENTHS_PER_PULSE = 10
+
+
+@total_ordering
+class Pulses:
+    __slots__ = ("count",)
+
+    def __init__(self, count=0):
+        self.count = int(count)
+
+    @staticmethod
+    def from_units(value, exact=False):
+        if isinstance(value, Pulses):
+            return value
+        if isinstance(value, int):
+            return Pulses(value * PULSES_PER_UNIT)
+        if isinstance(value, float):
+            # repr gives the shortest string that round-trips, so 1.15 stays 1.15 here
+            value = repr(value)
+        try:
+            count = Decimal(value) * PULSES_PER_UNIT
+            if exact and count != count.to_integral_value():
+                raise PdmError("%s units is not a multiple of %.2fU" % (value, 1 / PULSES_PER_UNIT))
+            return Pulses(int(count))
+        except (ArithmeticError, TypeError, ValueError):
+            raise PdmError("%s is not a valid insulin amount" % value)
+
+    @staticmethod
+    def from_tenths(tenths):
+        return Pulses(tenths // TENTHS_PER_PULSE)
+
+    def to_units(self):
+        return self.count / PULSES_PER_UNIT
+
+    @property
+    def tenths(self):
+        return self.count * TENTHS_PER_PULSE
+
+    def __float__(self):
+        return self.count / PULSES_PER_UNIT
+
+    def __int__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count != 0
+
+    def __eq__(self, other):
+        if isinstance(other, Pulses):
+            return self.count == other.count
+        return NotImplemented
+
+    def __lt__(self, other):
+        if isinstance(other, Pulses):
+            return self.count < other.count
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.count)
+
+    def __add__(self, other):
+        if isinstance(other, Pulses):
+            return Pulses(self.count + other.count)
+        return NotImplemented
+
+    def __sub__(self, other):
+        if isinstance(other, Pulses):
+            return Pulses(self.count - other.count)
+        return NotImplemented
+
+    def __mul__(self, other):
+        if isinstance(other, int):
+            return Pulses(self.count * other)
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        return "Pulses(%d)" % self.count
+
+    def __str__(self):
+        return "%.2f" % self.to_units()
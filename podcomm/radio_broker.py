@@ -0,0 +1,222 @@
+from .packet_radio import PacketRadio
+from .exceptions import PacketRadioError
+from .definitions import *
+from threading import Condition, RLock
+import itertools
+import time
+
+BROKER_PRIORITY_DEFAULT = 0
+
+
+class RadioSession(PacketRadio):
+    def __init__(self, broker, name, priority=BROKER_PRIORITY_DEFAULT):
+        self.broker = broker
+        self.name = name
+        self.priority = priority
+        self.last_served = 0
+        self.exchange_depth = 0
+        self.tx_setting = None
+        self.exchanges = 0
+        self.wait_total = 0.0
+
+    def begin_exchange(self, priority=None):
+        self.broker.acquire(self, priority)
+
+    def end_exchange(self):
+        self.broker.release(self)
+
+    def connect(self, force_initialize=False):
+        self.begin_exchange()
+        try:
+            self.broker.connect(force_initialize)
+        finally:
+            self.end_exchange()
+
+    def disconnect(self, ignore_errors=True):
+        # the link is shared, only the broker disconnects it
+        pass
+
+    def reset_link(self):
+        self.broker.mark_failed()
+
+    def get_info(self):
+        return self._call(self.broker.packet_radio.get_info)
+
+    def init_radio(self, force_init=False):
+        return self._call(self.broker.packet_radio.init_radio, force_init)
+
+    def tx_up(self):
+        self.tx_setting = None
+        self.broker.tx_setting = None
+        self._call(self.broker.packet_radio.tx_up)
+
+    def tx_down(self):
+        self.tx_setting = None
+        self.broker.tx_setting = None
+        self._call(self.broker.packet_radio.tx_down)
+
+    def set_tx_power(self, tx_power):
+        self._set_tx(("power", tx_power))
+
+    def get_tx_level_count(self):
+        return self.broker.packet_radio.get_tx_level_count()
+
+    def get_tx_level(self, tx_power):
+        return self.broker.packet_radio.get_tx_level(tx_power)
+
+    def set_tx_level(self, level):
+        self._set_tx(("level", level))
+
+    def get_packet(self, timeout=5.0):
+        return self._call(self.broker.packet_radio.get_packet, timeout)
+
+    def send_and_receive_packet(self, packet, repeat_count, delay_ms, timeout_ms, retry_count, preamble_ext_ms):
+        return self._call(self.broker.packet_radio.send_and_receive_packet, packet, repeat_count, delay_ms,
+                          timeout_ms, retry_count, preamble_ext_ms)
+
+    def send_packet(self, packet, repeat_count, delay_ms, preamble_extension_ms):
+        return self._call(self.broker.packet_radio.send_packet, packet, repeat_count, delay_ms,
+                          preamble_extension_ms)
+
+    def encode_packet(self, packet):
+        return self.broker.packet_radio.encode_packet(packet)
+
+    def send_and_receive_encoded(self, encoded, repeat_count, delay_ms, timeout_ms, retry_count, preamble_ext_ms):
+        return self._call(self.broker.packet_radio.send_and_receive_encoded, encoded, repeat_count, delay_ms,
+                          timeout_ms, retry_count, preamble_ext_ms)
+
+    def _set_tx(self, setting):
+        self.tx_setting = setting
+        if self.broker.tx_setting != setting:
+            self._call(self.broker.apply_tx, setting)
+
+    def _call(self, method, *args):
+        try:
+            return method(*args)
+        except PacketRadioError:
+            self.broker.failed = True
+            raise
+
+
+class RadioBroker:
+    def __init__(self, packet_radio=None, clock=time):
+        self.logger = getLogger()
+        if packet_radio is None:
+            from .pr_rileylink import RileyLink
+            packet_radio = RileyLink()
+        self.packet_radio = packet_radio
+        self.clock = clock
+
+        self.sessions = []
+        self.condition = Condition()
+        self.link_lock = RLock()
+        self.owner = None
+        self.waiting = []
+        self.turns = itertools.count(1)
+        self.tickets = itertools.count()
+
+        self.connected = False
+        self.failed = False
+        self.reset_requested = False
+        self.tx_setting = None
+        self.connects = 0
+
+    def get_session(self, name, priority=BROKER_PRIORITY_DEFAULT):
+        session = RadioSession(self, name, priority)
+        with self.condition:
+            self.sessions.append(session)
+        return session
+
+    def acquire(self, session, priority=None):
+        with self.condition:
+            if self.owner is session:
+                session.exchange_depth += 1
+                return
+
+            # request priorities are offset by the priority of the pod, among
+            # equals the session served least recently goes first
+            if priority is None:
+                priority = 0
+            entry = (priority + session.priority, session.last_served, next(self.tickets), session)
+            self.waiting.append(entry)
+            started = self.clock.time()
+            while self.owner is not None or min(self.waiting)[3] is not session:
+                self.condition.wait()
+            self.waiting.remove(entry)
+            self.owner = session
+            session.exchange_depth = 1
+            session.exchanges += 1
+            session.wait_total += self.clock.time() - started
+
+        if session.tx_setting is not None and session.tx_setting != self.tx_setting:
+            try:
+                self.apply_tx(session.tx_setting)
+            except PacketRadioError:
+                self.logger.exception("Failed to restore tx setting for %s" % session.name)
+                self.failed = True
+
+    def release(self, session):
+        with self.condition:
+            if self.owner is not session:
+                return
+            session.exchange_depth -= 1
+            if session.exchange_depth > 0:
+                return
+            session.last_served = next(self.turns)
+            self.owner = None
+            self.condition.notify_all()
+
+    def connect(self, force_initialize=False):
+        with self.link_lock:
+            if self.connected and not self.failed:
+                return
+            if self.connected:
+                self._disconnect()
+            # a reconnect after a radio error keeps the registers the radio still has,
+            # only a reset through mark_failed starts the radio over
+            self.packet_radio.connect(force_initialize=force_initialize or self.reset_requested)
+            self.connected = True
+            self.failed = False
+            self.reset_requested = False
+            self.tx_setting = None
+            self.connects += 1
+
+    def mark_failed(self):
+        # connect() runs in the caller's exchange, so the link is only torn
+        # down once whoever is using it now has finished
+        with self.link_lock:
+            self.reset_requested = True
+            if self.connected:
+                self.failed = True
+
+    def disconnect(self):
+        with self.condition:
+            while self.owner is not None:
+                self.condition.wait()
+            with self.link_lock:
+                if self.connected:
+                    self._disconnect()
+
+    def apply_tx(self, setting):
+        with self.link_lock:
+            self.tx_setting = None
+            kind, value = setting
+            if kind == "power":
+                self.packet_radio.set_tx_power(value)
+            else:
+                self.packet_radio.set_tx_level(value)
+            self.tx_setting = setting
+
+    def get_statistics(self):
+        with self.condition:
+            return {"connects": self.connects,
+                    "sessions": [{"name": s.name, "priority": s.priority, "exchanges": s.exchanges,
+                                  "wait_total": s.wait_total} for s in self.sessions]}
+
+    def _disconnect(self):
+        self.connected = False
+        self.tx_setting = None
+        try:
+            self.packet_radio.disconnect(ignore_errors=True)
+        except Exception:
+            self.logger.exception("Error while disconnecting")
@@ -0,0 +1,258 @@
+from collections import deque
+
+RETRY_TIMEOUT = 0
+RETRY_RADIO_ERROR = 1
+
+PART_FIRST = 0
+PART_MIDDLE = 1
+PART_LAST = 2
+
+RECOVERY_NONE = 0
+RECOVERY_REINIT = 1
+RECOVERY_RESET = 2
+
+ATTEMPT_OK = 0
+ATTEMPT_TIMEOUT = 1
+ATTEMPT_RADIO_ERROR = 2
+ATTEMPT_PROTOCOL_ERROR = 3
+
+# seconds charged for a radio reinitialization or a bluepy reset when
+# evaluating policies offline
+RECOVERY_COSTS = {RECOVERY_NONE: 0.0, RECOVERY_REINIT: 3.0, RECOVERY_RESET: 5.0}
+
+
+def get_part_position(part, packet_count):
+    if part == 0:
+        return PART_FIRST
+    elif part < packet_count - 1:
+        return PART_MIDDLE
+    else:
+        return PART_LAST
+
+
+class RetryDecision:
+    __slots__ = ("retry", "timeout", "delay", "recovery", "reset_sequences")
+
+    def __init__(self, retry=True, timeout=None, delay=0, recovery=RECOVERY_NONE, reset_sequences=False):
+        self.retry = retry
+        self.timeout = timeout
+        self.delay = delay
+        self.recovery = recovery
+        self.reset_sequences = reset_sequences
+
+    def __repr__(self):
+        return "RetryDecision(retry=%s, timeout=%s, delay=%s, recovery=%d)" % \
+               (self.retry, self.timeout, self.delay, self.recovery)
+
+
+GIVE_UP = RetryDecision(retry=False)
+GIVE_UP_RESET = RetryDecision(retry=False, reset_sequences=True)
+
+_reinit = RetryDecision(recovery=RECOVERY_REINIT)
+_reset = RetryDecision(timeout=10, delay=2, recovery=RECOVERY_RESET)
+
+DEFAULT_INITIAL_TIMEOUT = 10
+
+DEFAULT_LADDER = {
+    (RETRY_TIMEOUT, PART_FIRST): [RetryDecision(timeout=15),
+                                  RetryDecision(timeout=10, delay=2),
+                                  RetryDecision(timeout=15, recovery=RECOVERY_REINIT)],
+    (RETRY_TIMEOUT, PART_MIDDLE): [RetryDecision(timeout=20)] * 2,
+    (RETRY_TIMEOUT, PART_LAST): [RetryDecision(timeout=20)] * 10,
+    (RETRY_RADIO_ERROR, PART_FIRST): [_reinit] * 2 + [_reset] * 2,
+    (RETRY_RADIO_ERROR, PART_MIDDLE): [_reset] * 6,
+    (RETRY_RADIO_ERROR, PART_LAST): [_reset] * 10,
+}
+
+DEFAULT_GIVE_UP = {
+    (RETRY_TIMEOUT, PART_FIRST): GIVE_UP_RESET,
+}
+
+
+class LinkStatistics:
+    def __init__(self, window=32):
+        self.rssi = deque(maxlen=window)
+        self.response_times = deque(maxlen=window)
+        self.attempts = deque(maxlen=window)
+
+    def add_rssi(self, rssi):
+        if rssi is not None:
+            self.rssi.append(rssi)
+
+    def add_attempt(self, kind, elapsed):
+        self.attempts.append(kind)
+        if kind == ATTEMPT_OK:
+            self.response_times.append(elapsed)
+
+    def add_exchange(self, exchange):
+        for part, position, kind, elapsed in exchange.attempts:
+            self.add_attempt(kind, elapsed)
+        for rssi in exchange.rssi:
+            self.add_rssi(rssi)
+
+    def get_rssi_average(self):
+        if len(self.rssi) == 0:
+            return None
+        return sum(self.rssi) / len(self.rssi)
+
+    def get_timeout_rate(self):
+        if len(self.attempts) == 0:
+            return 0.0
+        return self.attempts.count(ATTEMPT_TIMEOUT) / len(self.attempts)
+
+    def get_response_time(self, percentile=0.9):
+        if len(self.response_times) == 0:
+            return None
+        ordered = sorted(self.response_times)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile))]
+
+
+class RetryPolicy:
+    def initial_timeout(self, position, link):
+        raise NotImplementedError()
+
+    def on_error(self, kind, position, repeat_count, spent, link):
+        raise NotImplementedError()
+
+
+class LadderRetryPolicy(RetryPolicy):
+    def __init__(self, ladder=None, give_up=None, initial=DEFAULT_INITIAL_TIMEOUT):
+        if ladder is None:
+            ladder = DEFAULT_LADDER
+        if give_up is None:
+            give_up = DEFAULT_GIVE_UP
+        self.ladder = ladder
+        self.give_up = give_up
+        self.initial = initial
+
+    def initial_timeout(self, position, link):
+        return self.initial
+
+    def on_error(self, kind, position, repeat_count, spent, link):
+        steps = self.ladder.get((kind, position), [])
+        if repeat_count < len(steps):
+            return steps[repeat_count]
+        return self.give_up.get((kind, position), GIVE_UP)
+
+
+class AdaptiveRetryPolicy(LadderRetryPolicy):
+    def __init__(self, ladder=None, give_up=None, initial=DEFAULT_INITIAL_TIMEOUT,
+                 min_timeout=3.0, response_factor=3.0, weak_rssi=-90, congested_rate=0.5):
+        LadderRetryPolicy.__init__(self, ladder=ladder, give_up=give_up, initial=initial)
+        self.min_timeout = min_timeout
+        self.response_factor = response_factor
+        self.weak_rssi = weak_rssi
+        self.congested_rate = congested_rate
+        self.budgets = dict()
+        for key, steps in self.ladder.items():
+            self.budgets[key] = initial + sum([(s.timeout or initial) + s.delay for s in steps])
+
+    def initial_timeout(self, position, link):
+        return self._scale(self.initial, link)
+
+    def on_error(self, kind, position, repeat_count, spent, link):
+        if kind != RETRY_TIMEOUT:
+            return LadderRetryPolicy.on_error(self, kind, position, repeat_count, spent, link)
+
+        # shorter windows mean more attempts, so the ladder's total time is
+        # kept as the budget instead of its step count
+        steps = self.ladder.get((kind, position), [])
+        if repeat_count < len(steps):
+            step = steps[repeat_count]
+        elif len(steps) > 0:
+            step = RetryDecision(timeout=steps[-1].timeout)
+        else:
+            return self.give_up.get((kind, position), GIVE_UP)
+
+        timeout = self._scale(step.timeout or self.initial, link)
+        if spent + step.delay + timeout > self.budgets[(kind, position)]:
+            return self.give_up.get((kind, position), GIVE_UP)
+        return RetryDecision(timeout=timeout, delay=step.delay, recovery=step.recovery)
+
+    def _scale(self, timeout, link):
+        if link is None:
+            return timeout
+        response_time = link.get_response_time()
+        if response_time is None:
+            return timeout
+
+        scaled = max(self.min_timeout, response_time * self.response_factor)
+        rssi = link.get_rssi_average()
+        if link.get_timeout_rate() >= self.congested_rate or (rssi is not None and rssi < self.weak_rssi):
+            scaled *= 2
+        return min(timeout, scaled)
+
+
+class PolicyEvaluation:
+    def __init__(self):
+        self.exchanges = 0
+        self.successful = 0
+        self.duration = 0.0
+        self.attempts = 0
+
+    def __repr__(self):
+        return "PolicyEvaluation(exchanges=%d, successful=%d, duration=%.1f, attempts=%d)" % \
+               (self.exchanges, self.successful, self.duration, self.attempts)
+
+
+def _evaluate_part(policy, position, attempts, link, evaluation):
+    # the link is assumed to need the recorded active time before the pod
+    # answers; radio errors are replayed in the order they happened
+    needed = 0.0
+    answered = False
+    radio_errors = 0
+    for kind, elapsed in attempts:
+        if kind == ATTEMPT_RADIO_ERROR:
+            radio_errors += 1
+        elif kind != ATTEMPT_PROTOCOL_ERROR:
+            needed += elapsed
+            if kind == ATTEMPT_OK:
+                answered = True
+
+    spent = 0.0
+    repeat_count = 0
+    timeout = policy.initial_timeout(position, link)
+    while True:
+        evaluation.attempts += 1
+        if radio_errors > 0:
+            radio_errors -= 1
+            kind = RETRY_RADIO_ERROR
+        elif answered and needed <= timeout:
+            evaluation.duration += needed
+            return True
+        else:
+            needed -= timeout
+            spent += timeout
+            evaluation.duration += timeout
+            kind = RETRY_TIMEOUT
+
+        decision = policy.on_error(kind, position, repeat_count, spent, link)
+        if not decision.retry:
+            return False
+        spent += decision.delay
+        evaluation.duration += decision.delay + RECOVERY_COSTS[decision.recovery]
+        if decision.timeout is not None:
+            timeout = decision.timeout
+        repeat_count += 1
+
+
+def evaluate_policy(policy, exchanges, link=None):
+    if link is None:
+        link = LinkStatistics()
+    evaluation = PolicyEvaluation()
+    for exchange in exchanges:
+        parts = dict()
+        for part, position, kind, elapsed in exchange.attempts:
+            parts.setdefault(part, (position, []))[1].append((kind, elapsed))
+
+        evaluation.exchanges += 1
+        successful = len(parts) > 0
+        for part in sorted(parts):
+            position, attempts = parts[part]
+            if not _evaluate_part(policy, position, attempts, link, evaluation):
+                successful = False
+                break
+        if successful:
+            evaluation.successful += 1
+        link.add_exchange(exchange)
+    return evaluation
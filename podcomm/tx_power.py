@@ -0,0 +1,66 @@
+TX_EVENT_RESPONSE = 0
+TX_EVENT_TIMEOUT = 1
+TX_EVENT_REPEAT = 2
+TX_EVENT_NOISE = 3
+
+
+class TxPowerController:
+    def __init__(self, level_count, level=None, rssi_strong=-60, rssi_weak=-90,
+                 hysteresis=0.75, loss_gain=3.0, smoothing=0.25):
+        self.level_count = level_count
+        self.rssi_strong = rssi_strong
+        self.rssi_weak = rssi_weak
+        self.hysteresis = hysteresis
+        self.loss_gain = loss_gain
+        self.smoothing = smoothing
+
+        self.rssi = None
+        self.loss = 0.0
+        self.applied_level = None
+        self.enabled = True
+
+        if level is None:
+            level = level_count // 2
+        self.level = self._clamp(level)
+        self.initial_level = self.level
+
+    def update(self, event, rssi=None):
+        if event == TX_EVENT_RESPONSE:
+            self.loss *= 1.0 - self.smoothing
+            if rssi is not None:
+                if self.rssi is None:
+                    self.rssi = rssi
+                else:
+                    self.rssi += (rssi - self.rssi) * self.smoothing
+        elif event == TX_EVENT_TIMEOUT or event == TX_EVENT_REPEAT:
+            self.loss += (1.0 - self.loss) * self.smoothing
+        elif event == TX_EVENT_NOISE:
+            self.loss *= 1.0 - self.smoothing / 2
+
+        target = self.get_target_level()
+        # only move once the model is clearly past the current level, so the
+        # level does not flap between two neighbours on every packet, then go
+        # straight to the target instead of walking there one packet per step
+        if abs(target - self.level) >= self.hysteresis:
+            self.level = self._clamp(round(target))
+        return self.level
+
+    def get_target_level(self):
+        top = self.level_count - 1
+        if self.rssi is None:
+            base = self.initial_level
+        else:
+            base = (self.rssi_strong - self.rssi) / (self.rssi_strong - self.rssi_weak) * top
+            base = min(top, max(0, base))
+        return min(top, max(0, base + self.loss * self.loss_gain))
+
+    def apply(self, packet_radio):
+        if self.applied_level != self.level:
+            packet_radio.set_tx_level(self.level)
+            self.applied_level = self.level
+
+    def invalidate(self):
+        self.applied_level = None
+
+    def _clamp(self, level):
+        return min(max(0, level), max(0, self.level_count - 1))
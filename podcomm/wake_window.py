@@ -0,0 +1,199 @@
+import random
+
+GAP_BUCKETS = [1.0, 3.0, 5.0, 10.0, 30.0]
+
+WAKE_MODEL_STATE_VERSION = 1
+
+
+class SendCandidate:
+    def __init__(self, name, repeat_count, delay_ms, timeout_ms, retry_count, preamble_ext_ms,
+                 awake_success, asleep_success, success_latency, failure_cost):
+        self.name = name
+        self.params = (repeat_count, delay_ms, timeout_ms, retry_count, preamble_ext_ms)
+        self.awake_success = awake_success
+        self.asleep_success = asleep_success
+        self.success_latency = success_latency
+        self.failure_cost = failure_cost
+
+
+# the priors reproduce the previous fixed rule: no preamble extension while the
+# pod has been heard from within the last 5 seconds, extended preamble otherwise
+CANDIDATE_EXTENDED = SendCandidate("extended", 0, 0, 110, 0, 300, 0.5, 0.9, 0.35, 0.43)
+CANDIDATE_REPEATED = SendCandidate("repeated", 3, 0, 660, 0, 80, 0.95, 0.3, 0.45, 1.04)
+
+DEFAULT_CANDIDATES = [CANDIDATE_EXTENDED, CANDIDATE_REPEATED]
+
+
+def get_gap_bucket(gap):
+    if gap is None:
+        return len(GAP_BUCKETS)
+    for i in range(0, len(GAP_BUCKETS)):
+        if gap < GAP_BUCKETS[i]:
+            return i
+    return len(GAP_BUCKETS)
+
+
+class _CandidateStats:
+    __slots__ = ("successes", "failures", "latency", "latency_count", "cost", "cost_count")
+
+    def __init__(self, success_probability, latency, cost, weight):
+        self.successes = success_probability * weight
+        self.failures = (1.0 - success_probability) * weight
+        self.latency = latency
+        self.latency_count = weight
+        self.cost = cost
+        self.cost_count = weight
+
+    def observe(self, responded, duration):
+        if responded:
+            self.successes += 1
+            self.latency_count += 1
+            self.latency += (duration - self.latency) / self.latency_count
+        else:
+            self.failures += 1
+            self.cost_count += 1
+            self.cost += (duration - self.cost) / self.cost_count
+
+    def success_probability(self):
+        return self.successes / (self.successes + self.failures)
+
+    def get_state(self):
+        return [self.successes, self.failures, self.latency, self.latency_count, self.cost, self.cost_count]
+
+    def set_state(self, state):
+        self.successes, self.failures, self.latency, self.latency_count, self.cost, self.cost_count = state
+
+
+class WakeWindowModel:
+    def __init__(self, candidates=None, fallback=CANDIDATE_REPEATED, prior_weight=4.0,
+                 awake_within=5.0, exploration=0.0, state=None):
+        if candidates is None:
+            candidates = DEFAULT_CANDIDATES
+        self.candidates = candidates
+        self.fallback = fallback
+        self.exploration = exploration
+        self.random = random.Random(0)
+
+        self.stats = []
+        for bucket in range(0, len(GAP_BUCKETS) + 1):
+            awake = bucket < len(GAP_BUCKETS) and GAP_BUCKETS[bucket] <= awake_within
+            bucket_stats = []
+            for candidate in candidates:
+                if awake:
+                    probability = candidate.awake_success
+                else:
+                    probability = candidate.asleep_success
+                bucket_stats.append(_CandidateStats(probability, candidate.success_latency,
+                                                    candidate.failure_cost, prior_weight))
+            self.stats.append(bucket_stats)
+
+        if state is not None:
+            self._restore(state)
+
+    def get_plan(self, candidate):
+        if candidate is self.fallback or self.fallback is None:
+            return [candidate]
+        return [candidate, self.fallback]
+
+    def expected_time(self, gap, plan):
+        bucket_stats = self.stats[get_gap_bucket(gap)]
+        expected = 0.0
+        reach = 1.0
+        for candidate in plan:
+            stats = bucket_stats[self.candidates.index(candidate)]
+            p = stats.success_probability()
+            expected += reach * (p * stats.latency + (1.0 - p) * stats.cost)
+            reach *= 1.0 - p
+        # an unanswered plan costs at least another full round
+        return expected + reach * expected
+
+    def choose_plan(self, gap):
+        if self.exploration > 0 and self.random.random() < self.exploration:
+            return self.get_plan(self.random.choice(self.candidates))
+
+        best_plan = None
+        best_time = None
+        for candidate in self.candidates:
+            plan = self.get_plan(candidate)
+            t = self.expected_time(gap, plan)
+            if best_time is None or t < best_time:
+                best_plan = plan
+                best_time = t
+        return best_plan
+
+    def observe(self, gap, candidate_index, responded, duration):
+        self.stats[get_gap_bucket(gap)][candidate_index].observe(responded, duration)
+
+    def get_state(self):
+        return {"version": WAKE_MODEL_STATE_VERSION,
+                "candidates": [c.name for c in self.candidates],
+                "stats": [[s.get_state() for s in bucket] for bucket in self.stats]}
+
+    def _restore(self, state):
+        try:
+            if state.get("version") != WAKE_MODEL_STATE_VERSION:
+                return False
+            if state.get("candidates") != [c.name for c in self.candidates]:
+                return False
+            stats = state["stats"]
+            if len(stats) != len(self.stats):
+                return False
+            for bucket, bucket_state in zip(self.stats, stats):
+                for s, s_state in zip(bucket, bucket_state):
+                    s.set_state(s_state)
+            return True
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return False
+
+
+class WakeWindowEvaluation:
+    def __init__(self):
+        self.samples = 0
+        self.matched = 0
+        self.responded = 0
+        self.duration = 0.0
+
+    def get_mean_duration(self):
+        if self.matched == 0:
+            return None
+        return self.duration / self.matched
+
+    def __repr__(self):
+        return "WakeWindowEvaluation(samples=%d, matched=%d, responded=%d, mean_duration=%s)" % \
+               (self.samples, self.matched, self.responded, self.get_mean_duration())
+
+
+def evaluate_wake_model(model, samples):
+    # replay evaluation: only samples where the model would have made the same
+    # first choice as the recorded one are scored, all of them are learned from
+    evaluation = WakeWindowEvaluation()
+    for gap, candidate_index, responded, duration in samples:
+        evaluation.samples += 1
+        plan = model.choose_plan(gap)
+        if model.candidates.index(plan[0]) == candidate_index:
+            evaluation.matched += 1
+            evaluation.duration += duration
+            if responded:
+                evaluation.responded += 1
+        model.observe(gap, candidate_index, responded, duration)
+    return evaluation
+
+
+if __name__ == '__main__':
+    from .packet_capture import PacketCapture
+    from .definitions import DATA_PATH, OMNIPY_PACKET_LOGFILE, CAPTURE_SUFFIX
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay the wake window samples of a packet capture")
+    parser.add_argument("path", nargs="?", default=DATA_PATH + OMNIPY_PACKET_LOGFILE + CAPTURE_SUFFIX)
+    parser.add_argument("-n", "--last", type=int, default=None)
+    parser.add_argument("-e", "--exploration", type=float, default=0.0)
+    args = parser.parse_args()
+
+    samples = PacketCapture(args.path, record_count=None).get_wake_samples(args.last)
+    print("%d wake window samples" % len(samples))
+    for index, candidate in enumerate(DEFAULT_CANDIDATES):
+        recorded = [s for s in samples if s[1] == index]
+        responded = len([s for s in recorded if s[2]])
+        print("recorded %-10s %5d sent, %5d responded" % (candidate.name, len(recorded), responded))
+    print(evaluate_wake_model(WakeWindowModel(exploration=args.exploration), samples))
@@ -3,7 +3,6 @@ from threading import Thread
 import signal
 import base64
 from uuid import getnode as get_mac
-from decimal import *
 from threading import Lock
 from Crypto.Cipher import AES
 import simplejson as json
@@ -12,7 +11,10 @@ from datetime import datetime
 import time
 from podcomm.pdm import Pdm, PdmLock
 from podcomm.pod import Pod
+from podcomm.pulses import Pulses
+from podcomm.exceptions import PdmError
 from podcomm.pr_rileylink import RileyLink
+from podcomm.packet_capture import enable_packet_capture
 from podcomm.definitions import *
 from logging import FileHandler
 from batt_check import SpiBatteryVoltageChecker
@@ -32,6 +34,7 @@ app = Flask(__name__, static_url_path="/")
 configureLogging()
 logger = getLogger(with_console=True)
 get_packet_logger(with_console=True)
+enable_packet_capture()
 
 
 class RestApiException(Exception):
@@ -78,6 +81,7 @@ def _get_pdm():
     try:
         if g_pdm is None:
             g_pdm = Pdm(_get_pod())
+            g_pdm.start_nonce_priming()
         return g_pdm
     except:
         logger.exception("Error while creating pdm instance")
@@ -252,6 +256,14 @@ def _api_result(result_lambda, generic_err_message):
         return _create_response(False, response=e, pod_status=_get_pod())
 
 
+def _units_parameter(name):
+    # amounts the pod cannot deliver exactly are refused here rather than rounded down
+    try:
+        return Pulses.from_units(request.args.get(name), exact=True)
+    except PdmError as pe:
+        raise RestApiException(pe.error_message)
+
+
 def _get_pdm_address(timeout):
     packet = None
     with PdmLock():
@@ -357,7 +369,7 @@ def start_pod():
     schedule=[]
 
     for i in range(0,48):
-        rate = Decimal(request.args.get("h"+str(i)))
+        rate = _units_parameter("h"+str(i))
         schedule.append(rate)
 
     pdm.inject_and_start(schedule)
@@ -402,6 +414,7 @@ def set_pod_parameters():
         if reset_nonce:
             pod.nonce_last = None
             pod.nonce_seed = 0
+            pod.nonce_state = None
 
         if _int_parameter(pod, "radio_address"):
             pod.radio_packet_sequence = 0
@@ -438,11 +451,30 @@ def get_status():
         req_type = 0
 
     pdm = _get_pdm()
+    if request.args.get('cached') is not None:
+        snapshot = pdm.status_snapshot
+        if snapshot is None:
+            raise RestApiException("No status received from pod yet")
+        return snapshot.get_values()
+
     id = pdm.update_status(req_type)
 
     return {"row_id":id}
 
 
+def get_metrics():
+    _verify_auth(request)
+    w = request.args.get('window')
+    if w is not None:
+        window = float(w)
+    else:
+        window = None
+    pdm = _get_pdm()
+    snapshot = pdm.metrics.get_snapshot(window)
+    snapshot["connection"] = pdm.connection.get_statistics()
+    return snapshot
+
+
 def deactivate_pod():
     _verify_auth(request)
     pdm = _get_pdm()
@@ -455,7 +487,7 @@ def bolus():
     _verify_auth(request)
 
     pdm = _get_pdm()
-    amount = Decimal(request.args.get('amount'))
+    amount = _units_parameter('amount')
     id = pdm.bolus(amount)
     return {"row_id":id}
 
@@ -472,8 +504,8 @@ def set_temp_basal():
     _verify_auth(request)
 
     pdm = _get_pdm()
-    amount = Decimal(request.args.get('amount'))
-    hours = Decimal(request.args.get('hours'))
+    amount = _units_parameter('amount')
+    hours = float(request.args.get('hours'))
     id = pdm.set_temp_basal(amount, hours, False)
     return {"row_id":id}
 
@@ -493,7 +525,7 @@ def set_basal_schedule():
     schedule=[]
 
     for i in range(0,48):
-        rate = Decimal(request.args.get("h"+str(i)))
+        rate = _units_parameter("h"+str(i))
         schedule.append(rate)
 
     utc_offset = int(request.args.get("utc"))
@@ -511,7 +543,7 @@ def is_pdm_busy():
 def acknowledge_alerts():
     _verify_auth(request)
 
-    mask = Decimal(request.args.get('alertmask'))
+    mask = int(request.args.get('alertmask'))
     pdm = _get_pdm()
     id = pdm.acknowledge_alerts(mask)
     return {"row_id":id}
@@ -639,6 +671,10 @@ def a06():
 def a07():
     return _api_result(lambda: get_status(), "Failure while executing getting pod status")
 
+@app.route(REST_URL_METRICS)
+def a071():
+    return _api_result(lambda: get_metrics(), "Failure while getting radio metrics")
+
 @app.route(REST_URL_ACK_ALERTS)
 def a08():
     return _api_result(lambda: acknowledge_alerts(), "Failure while executing acknowledge alerts")
@@ -0,0 +1,69 @@
+from podcomm import pr_rileylink
+from podcomm.pr_rileylink import RileyLink
+from podcomm.pr_simulated_pod import SimulatedClock
+from podcomm.device_cache import DeviceCache
+from podcomm.definitions import set_log_path
+from tests.fake_peripheral import FakeRileyLinkPeripheral
+import os
+import tempfile
+
+SCENARIOS = [("2.0, write with response", False, b"ble_rfspy 2.0", 1, 185),
+             ("2.0", True, b"ble_rfspy 2.0", 1, 185),
+             ("2.0, mtu 23", True, b"ble_rfspy 2.0", 1, 23),
+             ("3.0, queue depth 4", True, b"ble_rfspy 3.0", 4, 185)]
+
+
+def run_scenario(path, write_without_response, version, queue_depth, mtu):
+    set_log_path(path)
+    pr_rileylink.g_rl_version = None
+    pr_rileylink.g_rl_shadows.clear()
+
+    clock = SimulatedClock(speed=0)
+    peripheral = FakeRileyLinkPeripheral(clock, queue_depth=queue_depth, version=version, mtu=mtu)
+    rl = RileyLink(clock=clock)
+    rl.address = "00:00:00:00:00:00"
+    rl.device_cache = DeviceCache(os.path.join(path, "devices.json"))
+    rl.peripheral = peripheral
+    rl.write_without_response = write_without_response
+
+    results = []
+    t = clock.time()
+    rl.connect(force_initialize=True)
+    results.append(("cold connect", clock.time() - t))
+
+    peripheral.disconnect()
+    t = clock.time()
+    rl.connect(force_initialize=True)
+    results.append(("reconnect", clock.time() - t))
+
+    t = clock.time()
+    rl.init_radio(force_init=True)
+    results.append(("verify init", clock.time() - t))
+
+    t = clock.time()
+    for level in [0, 7, 1, 6, 2, 5, 3, 4]:
+        rl.set_tx_level(level)
+    results.append(("8 tx changes", clock.time() - t))
+
+    t = clock.time()
+    rl.send_and_receive_packet(bytes(31), 0, 0, 100, 0, 0)
+    results.append(("send, listen", clock.time() - t))
+
+    return results, rl.get_transport_timings(), peripheral
+
+
+def main():
+    for name, write_without_response, version, queue_depth, mtu in SCENARIOS:
+        with tempfile.TemporaryDirectory() as path:
+            results, timings, peripheral = run_scenario(path, write_without_response, version, queue_depth, mtu)
+        print("%s: %d gatt operations, %d missed responses, %d truncated writes"
+              % (name, peripheral.gatt_operations, timings["missed_responses"], peripheral.truncated_writes))
+        for step, duration in results:
+            print("  %-14s %7.3fs" % (step, duration))
+        for operation in ("write", "notify", "read", "command"):
+            values = timings[operation]
+            print("  %-14s %5d ops, p50 %.3fs p95 %.3fs" % (operation, values["count"], values["p50"], values["p95"]))
+
+
+if __name__ == '__main__':
+    main()
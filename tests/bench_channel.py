@@ -0,0 +1,80 @@
+from podcomm.pdm import Pdm
+from podcomm.pod import Pod
+from podcomm.pr_simulated_pod import SimulatedPod, SimulatedClock
+from podcomm.pr_channel import ChannelModel, CHANNEL_PROFILES, PROFILE_CLEAN
+from podcomm.definitions import *
+import os
+import tempfile
+
+COMMANDS = ["status", "bolus", "temp_basal", "cancel_temp_basal"]
+
+
+def run_command(pdm, command):
+    if command == "status":
+        pdm.update_status()
+    elif command == "bolus":
+        pdm.bolus(0.1)
+    elif command == "temp_basal":
+        pdm.set_temp_basal(1.0, 0.5)
+    elif command == "cancel_temp_basal":
+        pdm.cancel_temp_basal()
+
+
+def run_profile(path, profile, rounds, seed):
+    # time never passes on its own, only radio airtime and sleeps advance it
+    clock = SimulatedClock(speed=0)
+    sim = SimulatedPod(clock=clock, seed=seed)
+    channel = ChannelModel(sim, profile=PROFILE_CLEAN, clock=clock, seed=seed)
+    pod = Pod()
+    pod.path = os.path.join(path, "pod_%s.json" % profile.name)
+    pod.path_db = os.path.join(path, "pod_%s.db" % profile.name)
+    pdm = Pdm(pod, packet_radio=channel, clock=clock)
+
+    pdm.pair_pod(0x1f0e89f0, 60)
+    pdm.activate_pod()
+    pdm.inject_and_start([1.0] * 48)
+
+    channel.profile = profile
+    results = dict()
+    for command in COMMANDS:
+        results[command] = []
+
+    for i in range(0, rounds):
+        for command in COMMANDS:
+            calls = channel.statistics.calls
+            started = clock.time()
+            ok = True
+            try:
+                run_command(pdm, command)
+            except Exception:
+                ok = False
+            results[command].append((clock.time() - started, channel.statistics.calls - calls, ok))
+            clock.sleep(60)
+
+    pdm.stop_radio()
+    return results
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def main():
+    rounds = 25
+    with tempfile.TemporaryDirectory() as path:
+        set_log_path(path)
+        print("%-8s %-18s %8s %8s %10s %8s" % ("profile", "command", "mean s", "p95 s", "exchanges", "failed"))
+        for profile in CHANNEL_PROFILES:
+            results = run_profile(path, profile, rounds, 1)
+            for command in COMMANDS:
+                times = [r[0] for r in results[command]]
+                exchanges = [r[1] for r in results[command]]
+                failed = len([r for r in results[command] if not r[2]])
+                print("%-8s %-18s %8.2f %8.2f %10.1f %8d" % (profile.name, command,
+                                                             sum(times) / len(times), percentile(times, 95),
+                                                             sum(exchanges) / len(exchanges), failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+from podcomm.crc import crc16, crc8, crc16_table, crc8_table, Crc16State, Crc8State
+import os
+import timeit
+
+
+def crc16_bytewise(msg):
+    crc = 0x0000
+    for x in msg:
+        crc = (crc >> 8) ^ crc16_table[(crc ^ x) & 0xff]
+    return crc
+
+
+def crc8_bytewise(msg):
+    crc = 0x0000
+    for x in msg:
+        crc = (crc >> 8) ^ crc8_table[(crc ^ x) & 0xff]
+    return crc
+
+
+def bench(name, fn, data, number):
+    elapsed = timeit.timeit(lambda: fn(data), number=number)
+    mb_per_s = len(data) * number / elapsed / 1000000
+    print("%-24s %6d bytes x %7d: %7.3fs %8.2f MB/s" % (name, len(data), number, elapsed, mb_per_s))
+    return elapsed
+
+
+def main():
+    for size, number in [(10, 200000), (37, 100000), (256, 20000), (4096, 1000), (1 << 20, 3)]:
+        data = os.urandom(size)
+        assert crc16(data) == crc16_bytewise(data)
+        assert crc8(data) == crc8_bytewise(data)
+
+        old = bench("crc16 bytewise", crc16_bytewise, data, number)
+        new = bench("crc16", crc16, data, number)
+        print("%-24s %.2fx" % ("", old / new))
+
+        old = bench("crc8 bytewise", crc8_bytewise, data, number)
+        new = bench("crc8", crc8, data, number)
+        print("%-24s %.2fx" % ("", old / new))
+
+        view = memoryview(data)
+        bench("Crc16State 31b chunks", lambda d: _chunked(Crc16State(), d), view, number)
+        bench("Crc8State 31b chunks", lambda d: _chunked(Crc8State(), d), view, number)
+        print()
+
+
+def _chunked(state, view):
+    for i in range(0, len(view), 31):
+        state.update(view[i:i + 31])
+    return state.digest()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+from podcomm.pdm import Pdm
+from podcomm.pod import Pod
+from podcomm.pr_simulated_pod import SimulatedPod, SimulatedClock
+from podcomm.definitions import *
+import os
+import tempfile
+import time
+
+
+def run_flow(path, clock):
+    sim = SimulatedPod(clock=clock, seed=0)
+    pod = Pod()
+    pod.path = os.path.join(path, "pod.json")
+    pod.path_db = os.path.join(path, "pod.db")
+    pdm = Pdm(pod, packet_radio=sim, clock=clock)
+
+    schedule = [1.0] * 16 + [0.55] * 16 + [1.35] * 16
+    pdm.pair_pod(0x1f0e89f0, 60)
+    pdm.activate_pod()
+    pdm.inject_and_start(schedule)
+    assert pod.state_progress == PodProgress.Running
+
+    pdm.bolus(1.5)
+    assert pod.state_bolus == BolusState.Immediate
+    clock.sleep(120)
+    pdm.update_status()
+    assert pod.state_bolus == BolusState.NotRunning
+
+    pdm.set_temp_basal(2.5, 1.5)
+    clock.sleep(3600)
+    pdm.cancel_temp_basal()
+    clock.sleep(3600)
+    pdm.update_status()
+
+    # force a nonce resync
+    pdm.get_nonce().reset()
+    pdm.set_temp_basal(0.5, 0.5)
+    pdm.bolus(0.2)
+    pdm.cancel_bolus()
+    pdm.cancel_temp_basal()
+    pdm.set_basal_schedule([0.8] * 48)
+    pdm.update_status(1)
+    pdm.update_status(2)
+    pdm.deactivate_pod()
+    assert pod.state_progress == PodProgress.Inactive
+    pdm.stop_radio()
+    return sim, pdm
+
+
+def main():
+    with tempfile.TemporaryDirectory() as path:
+        set_log_path(path)
+        for i in range(0, 5):
+            started = time.time()
+            sim, pdm = run_flow(path, SimulatedClock())
+            elapsed = time.time() - started
+            print("activation to deactivation: %.3fs, %d packets received, %d sent, %d resyncs, %.2fU delivered"
+                  % (elapsed, sim.packets_received, sim.packets_sent, sim.nonce_resyncs, sim.delivered / 20))
+
+        snapshot = pdm.metrics.get_snapshot()
+        for name, summary in sorted(snapshot["requests"].items()):
+            print("%-18s %4d exchanges, p50 %s" % (name, summary["count"], summary["outcomes"]["ok"]["p50"]))
+
+
+if __name__ == '__main__':
+    main()
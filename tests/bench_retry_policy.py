@@ -0,0 +1,67 @@
+from podcomm.pdm import Pdm
+from podcomm.pod import Pod
+from podcomm.pr_simulated_pod import SimulatedPod, SimulatedClock
+from podcomm.pr_channel import ChannelModel, CHANNEL_PROFILES, PROFILE_CLEAN
+from podcomm.retry_policy import LadderRetryPolicy, AdaptiveRetryPolicy, evaluate_policy
+from podcomm.definitions import *
+from tests.bench_channel import COMMANDS, run_command
+import os
+import tempfile
+
+POLICIES = [("ladder", LadderRetryPolicy), ("adaptive", AdaptiveRetryPolicy)]
+
+
+def run_profile(path, profile, policy_name, policy, rounds, seed):
+    # the exchanges recorded here are replayed against every policy afterwards
+    clock = SimulatedClock(speed=0)
+    sim = SimulatedPod(clock=clock, seed=seed)
+    channel = ChannelModel(sim, profile=PROFILE_CLEAN, clock=clock, seed=seed)
+    pod = Pod()
+    pod.path = os.path.join(path, "pod_%s_%s.json" % (profile.name, policy_name))
+    pod.path_db = os.path.join(path, "pod_%s_%s.db" % (profile.name, policy_name))
+    pdm = Pdm(pod, packet_radio=channel, clock=clock, retry_policy=policy)
+
+    pdm.pair_pod(0x1f0e89f0, 60)
+    pdm.activate_pod()
+    pdm.inject_and_start([1.0] * 48)
+    pdm.get_radio().stats.clear()
+
+    channel.profile = profile
+    exchanges = []
+    started = clock.time()
+    failed = 0
+    for i in range(0, rounds):
+        for command in COMMANDS:
+            try:
+                run_command(pdm, command)
+            except Exception:
+                failed += 1
+            radio = pdm.get_radio()
+            exchanges.extend(radio.stats)
+            radio.stats.clear()
+            clock.sleep(60)
+
+    elapsed = clock.time() - started - rounds * len(COMMANDS) * 60
+    pdm.stop_radio()
+    return exchanges, elapsed, failed
+
+
+def main():
+    rounds = 10
+    with tempfile.TemporaryDirectory() as path:
+        set_log_path(path)
+        print("%-8s %-9s %10s %8s | %-9s %10s %10s %10s" % ("profile", "live", "radio s", "failed",
+                                                          "replayed", "exchanges", "successful", "active s"))
+        for profile in CHANNEL_PROFILES:
+            for live_name, live_policy in POLICIES:
+                exchanges, elapsed, failed = run_profile(path, profile, live_name, live_policy(), rounds, 1)
+                for replay_name, replay_policy in POLICIES:
+                    evaluation = evaluate_policy(replay_policy(), exchanges)
+                    print("%-8s %-9s %10.1f %8d | %-9s %10d %10d %10.1f" % (profile.name, live_name, elapsed, failed,
+                                                                          replay_name, evaluation.exchanges,
+                                                                          evaluation.successful,
+                                                                          evaluation.duration))
+
+
+if __name__ == '__main__':
+    main()
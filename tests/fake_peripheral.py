@@ -0,0 +1,162 @@
+from podcomm.pr_rileylink import Command, Response, RILEYLINK_SERVICE_UUID, RILEYLINK_DATA_CHAR_UUID, \
+    RILEYLINK_RESPONSE_CHAR_UUID
+from podcomm.ble_transport import GATT_PROPERTY_WRITE_NO_RESPONSE
+from collections import deque
+import struct
+
+DATA_HANDLE = 0x10
+RESPONSE_HANDLE = 0x13
+
+
+class FakeCharacteristic:
+    def __init__(self, handle, properties):
+        self.handle = handle
+        self.properties = properties
+
+    def getHandle(self):
+        return self.handle
+
+
+class FakeService:
+    def __init__(self, characteristics):
+        self.characteristics = characteristics
+
+    def getCharacteristics(self, uuid):
+        return [self.characteristics[uuid]]
+
+
+class FakeRileyLinkPeripheral:
+    # ble_rfspy over a ble link with a fixed connection interval, on a clock
+    # that only moves when slept on. The firmware holds queue_depth commands,
+    # a command written while it is full replaces the last one.
+    def __init__(self, clock, connection_interval=0.015, connect_time=1.5, write_no_response=True,
+                 queue_depth=1, processing_time=0.001, version=b"ble_rfspy 2.0", mtu=23):
+        self.clock = clock
+        self.mtu = mtu
+        self.negotiated_mtu = 23
+        self.connection_interval = connection_interval
+        self.connect_time = connect_time
+        self.queue_depth = queue_depth
+        self.processing_time = processing_time
+        self.version = version
+
+        properties = 0x0a
+        if write_no_response:
+            properties |= GATT_PROPERTY_WRITE_NO_RESPONSE
+        self.service = FakeService({RILEYLINK_DATA_CHAR_UUID: FakeCharacteristic(DATA_HANDLE, properties),
+                                    RILEYLINK_RESPONSE_CHAR_UUID: FakeCharacteristic(RESPONSE_HANDLE, 0x12)})
+
+        self.delegate = None
+        self.connected = False
+        self.notifying = False
+        self.registers = dict()
+        self.pending = deque()
+        self.responses = deque()
+        self.notifications = deque()
+        self.busy_until = 0
+        self.response_count = 0
+        self.gatt_operations = 0
+        self.truncated_writes = 0
+
+    def getState(self):
+        if self.connected:
+            return "conn"
+        return "disc"
+
+    def connect(self, address):
+        self.clock.sleep(self.connect_time)
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+        self.notifying = False
+        self.negotiated_mtu = 23
+        self.pending.clear()
+        self.notifications.clear()
+
+    def setMTU(self, mtu):
+        self.clock.sleep(2 * self.connection_interval)
+        self.negotiated_mtu = min(mtu, self.mtu)
+        return {"state": ["conn"], "mtu": [self.negotiated_mtu]}
+
+    def withDelegate(self, delegate):
+        self.delegate = delegate
+
+    def getServiceByUUID(self, uuid):
+        self.clock.sleep(2 * self.connection_interval)
+        return self.service
+
+    def writeCharacteristic(self, handle, data, withResponse=False):
+        self.gatt_operations += 1
+        arrival = self.clock.time() + self.connection_interval
+        if handle == RESPONSE_HANDLE + 1:
+            self.notifying = data == b"\x01\x00"
+        elif handle == DATA_HANDLE:
+            if not withResponse and len(data) > self.negotiated_mtu - 3:
+                # an unacknowledged write longer than the mtu allows is cut short
+                data = data[:self.negotiated_mtu - 3]
+                self.truncated_writes += 1
+            self._process()
+            if len(self.pending) >= self.queue_depth:
+                self.pending.pop()
+            self.pending.append((arrival, bytes(data)))
+        if withResponse:
+            self.clock.sleep(2 * self.connection_interval)
+
+    def waitForNotifications(self, timeout):
+        deadline = self.clock.time() + timeout
+        self._process(deadline)
+        if len(self.notifications) == 0 or self.notifications[0][0] > deadline:
+            self.clock.sleep(timeout)
+            return False
+        at, count = self.notifications.popleft()
+        self.clock.sleep(max(0, at - self.clock.time()))
+        if self.delegate is not None:
+            self.delegate.handleNotification(RESPONSE_HANDLE, bytes([count]))
+        return True
+
+    def readCharacteristic(self, handle):
+        self.gatt_operations += 1
+        self.clock.sleep(2 * self.connection_interval)
+        self._process()
+        if len(self.responses) == 0:
+            return b""
+        return self.responses.popleft()
+
+    def _process(self, until=None):
+        if until is None:
+            until = self.clock.time()
+        while len(self.pending) > 0:
+            arrival, data = self.pending[0]
+            started = max(arrival, self.busy_until)
+            if started > until:
+                break
+            self.pending.popleft()
+            response, duration = self._execute(data[1], data[2:])
+            self.busy_until = started + duration
+            self.responses.append(response)
+            self.response_count = (self.response_count + 1) % 256
+            if self.notifying:
+                self.notifications.append((self.busy_until + self.connection_interval, self.response_count))
+
+    def _execute(self, command, body):
+        ok = bytes([Response.COMMAND_SUCCESS])
+        if command == Command.GET_VERSION:
+            return ok + self.version, self.processing_time
+        elif command == Command.GET_STATE:
+            return ok + b"OK", self.processing_time
+        elif command == Command.RADIO_RESET_CONFIG:
+            self.registers.clear()
+        elif command == Command.UPDATE_REGISTER:
+            self.registers[body[0]] = body[1]
+        elif command == Command.READ_REGISTER:
+            return ok + bytes([self.registers.get(body[0], 0)]), self.processing_time
+        elif command == Command.SEND_AND_LISTEN:
+            timeout_ms = struct.unpack(">L", body[5:9])[0]
+            return bytes([Response.RX_TIMEOUT]), self.processing_time + timeout_ms / 1000
+        elif command == Command.GET_PACKET:
+            timeout_ms = struct.unpack(">L", body[1:5])[0]
+            return bytes([Response.RX_TIMEOUT]), self.processing_time + timeout_ms / 1000
+        elif command not in (Command.SEND_PACKET, Command.SET_SW_ENCODING, Command.SET_PREAMBLE):
+            return bytes([Response.UNKNOWN_COMMAND]), self.processing_time
+        return ok, self.processing_time
@@ -0,0 +1,87 @@
+from podcomm.async_pdm import AsyncPdm
+from concurrent.futures import Future, CancelledError
+from threading import Event
+import asyncio
+
+
+class FakeRequest:
+    def __init__(self):
+        self.future = Future()
+
+
+class FakePdm:
+    # sends three exchanges, each waits in the queue until released
+    def __init__(self):
+        self.request_listener = None
+        self.log = []
+        self.queued = Event()
+        self.release = Event()
+
+    def bolus(self, amount):
+        for i in range(0, 3):
+            request = FakeRequest()
+            self.request_listener(request)
+            self.queued.set()
+            self.release.wait()
+            self.release.clear()
+            if not request.future.set_running_or_notify_cancel():
+                self.log.append(("cancelled", i))
+                raise CancelledError()
+            request.future.set_result(i)
+            self.log.append(("sent", i))
+        return amount
+
+    def is_busy(self):
+        return True
+
+
+async def wait_for(event):
+    await asyncio.get_running_loop().run_in_executor(None, event.wait)
+    event.clear()
+
+
+def test_cancel_stops_the_command_between_exchanges():
+    async def run():
+        pdm = FakePdm()
+        async_pdm = AsyncPdm(pdm)
+        task = asyncio.ensure_future(async_pdm.bolus(1))
+        await wait_for(pdm.queued)
+        assert async_pdm.exchange is not None
+        pdm.release.set()
+        await wait_for(pdm.queued)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        pdm.release.set()
+        while async_pdm.command is not None:
+            await asyncio.sleep(0.01)
+        assert pdm.log == [("sent", 0), ("cancelled", 1)]
+
+        follow_up = asyncio.ensure_future(async_pdm.bolus(2))
+        for i in range(0, 3):
+            await wait_for(pdm.queued)
+            pdm.release.set()
+        assert await follow_up == 2
+        async_pdm.close()
+
+    asyncio.run(run())
+
+
+def test_is_busy_does_not_wait_for_the_executor():
+    async def run():
+        pdm = FakePdm()
+        async_pdm = AsyncPdm(pdm)
+        task = asyncio.ensure_future(async_pdm.bolus(1))
+        await wait_for(pdm.queued)
+        assert await asyncio.wait_for(async_pdm.is_busy(), 1.0)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        pdm.release.set()
+        async_pdm.close()
+
+    asyncio.run(run())
@@ -0,0 +1,95 @@
+from podcomm.crc import crc16, crc8, crc16_table, crc8_table, crc16_update, crc8_update, crc16_patch, \
+    crc16_shift_zeros, Crc16State, Crc8State
+import random
+import pytest
+
+SIZES = [0, 1, 7, 8, 15, 16, 17, 31, 32, 33, 37, 64, 255, 1024]
+
+
+def crc16_bytewise(msg, crc=0x0000):
+    for x in msg:
+        crc = (crc >> 8) ^ crc16_table[(crc ^ x) & 0xff]
+    return crc
+
+
+def crc8_bytewise(msg, crc=0x00):
+    for x in msg:
+        crc = (crc >> 8) ^ crc8_table[(crc ^ x) & 0xff]
+    return crc
+
+
+def random_bytes(size, seed=0):
+    rng = random.Random(seed * 10007 + size)
+    return bytes([rng.randrange(256) for _ in range(size)])
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_crc_matches_bytewise(size):
+    data = random_bytes(size)
+    for value in (data, bytearray(data), memoryview(data), list(data), iter(data)):
+        assert crc16(value) == crc16_bytewise(data)
+    for value in (data, bytearray(data), memoryview(data), list(data), iter(data)):
+        assert crc8(value) == crc8_bytewise(data)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_crc_update_continues_from_initial_value(size):
+    data = random_bytes(size, 1)
+    assert crc16_update(0x1234, data) == crc16_bytewise(data, 0x1234)
+    assert crc8_update(0x5a, data) == crc8_bytewise(data, 0x5a)
+
+
+def test_crc_accepts_wide_memoryview():
+    data = random_bytes(64, 2)
+    view = memoryview(data).cast("H")
+    assert crc16(view) == crc16_bytewise(data)
+    assert crc8(view) == crc8_bytewise(data)
+
+
+@pytest.mark.parametrize("chunk", [1, 5, 8, 31, 100])
+def test_state_update_in_chunks(chunk):
+    data = random_bytes(300, 3)
+    state16 = Crc16State()
+    state8 = Crc8State()
+    for i in range(0, len(data), chunk):
+        state16.update(memoryview(data)[i:i + chunk])
+        state8.update(data[i:i + chunk])
+    assert state16.digest() == crc16_bytewise(data)
+    assert state8.digest() == crc8_bytewise(data)
+    assert state16.digest_bytes() == crc16_bytewise(data).to_bytes(2, "big")
+    assert state8.digest_bytes() == bytes([crc8_bytewise(data)])
+
+
+def test_state_copy_is_independent():
+    prefix = random_bytes(40, 4)
+    a = random_bytes(20, 5)
+    b = random_bytes(33, 6)
+
+    state16 = Crc16State(prefix)
+    forked16 = state16.copy().update(a)
+    state16.update(b)
+    assert forked16.digest() == crc16_bytewise(prefix + a)
+    assert state16.digest() == crc16_bytewise(prefix + b)
+
+    state8 = Crc8State(prefix)
+    forked8 = state8.copy().update(a)
+    state8.update(b)
+    assert forked8.digest() == crc8_bytewise(prefix + a)
+    assert state8.digest() == crc8_bytewise(prefix + b)
+
+
+@pytest.mark.parametrize("count", [0, 1, 2, 3, 8, 31, 100, 1000])
+def test_shift_zeros_matches_bytewise(count):
+    for crc in (0x0000, 0x0001, 0x8005, 0xffff, 0x1234):
+        assert crc16_shift_zeros(crc, count) == crc16_bytewise(bytes(count), crc)
+
+
+@pytest.mark.parametrize("offset,length", [(0, 4), (6, 4), (10, 1), (30, 7), (60, 4)])
+def test_patch_matches_recomputed_crc(offset, length):
+    message = bytearray(random_bytes(64, 7))
+    crc = crc16_bytewise(message)
+    old_data = bytes(message[offset:offset + length])
+    new_data = random_bytes(length, 8)
+    message[offset:offset + length] = new_data
+    trailing = len(message) - offset - length
+    assert crc16_patch(crc, old_data, new_data, trailing) == crc16_bytewise(message)
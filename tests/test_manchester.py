@@ -0,0 +1,45 @@
+from podcomm.manchester import ManchesterCodec, FRAME_LENGTH
+import random
+import pytest
+
+
+def random_bytes(size, seed=0):
+    rng = random.Random(seed * 10007 + size)
+    return bytes([rng.randrange(256) for _ in range(size)])
+
+
+@pytest.mark.parametrize("size", [0, 1, 10, 31, 39, 40, 45])
+def test_encode_into_matches_encode(size):
+    data = random_bytes(size)
+    a = ManchesterCodec()
+    b = ManchesterCodec()
+    b.noiseLines = a.noiseLines
+    buffer = bytearray(FRAME_LENGTH + 3)
+    length = b.encode_into(data, buffer, 3)
+    assert bytes(buffer[3:3 + length]) == a.encode(data)
+
+
+@pytest.mark.parametrize("size", [0, 1, 10, 31, 40])
+def test_decode_into_matches_decode(size):
+    codec = ManchesterCodec()
+    data = random_bytes(size, 1)
+    encoded = b"".join([codec.encode_table[x] for x in data])
+    buffer = bytearray(2 + size)
+    assert codec.decode_into(memoryview(encoded), buffer, 2) == (size, -1)
+    assert bytes(buffer[2:]) == data == codec.decode(encoded)
+
+
+def test_decode_into_stops_at_first_invalid_symbol():
+    codec = ManchesterCodec()
+    data = random_bytes(12, 2)
+    encoded = bytearray(b"".join([codec.encode_table[x] for x in data]))
+    encoded[14:16] = b"\xff\xff"
+    buffer = bytearray(12)
+    assert codec.decode_into(encoded, buffer) == (7, 7)
+    assert bytes(buffer[:7]) == data[:7] == codec.decode(encoded)
+
+
+def test_decode_into_rejects_small_buffer():
+    codec = ManchesterCodec()
+    with pytest.raises(ValueError):
+        codec.decode_into(bytes(8), bytearray(3))
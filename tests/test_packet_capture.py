@@ -0,0 +1,33 @@
+from podcomm.packet_capture import PacketCapture, CAPTURE_SEND, CAPTURE_WAKE
+from podcomm.wake_window import WakeWindowModel, evaluate_wake_model
+import pytest
+
+
+@pytest.fixture
+def capture(tmp_path):
+    capture = PacketCapture(str(tmp_path / "packets.cap"), record_count=16)
+    yield capture
+    capture.close()
+
+
+def test_wake_samples_round_trip(capture):
+    samples = [(None, 0, True, 0.35), (0.5, 1, False, 1.25), (42.0, 0, True, 0.5)]
+    capture.add(1000.0, CAPTURE_SEND, bytes(10))
+    for i, sample in enumerate(samples):
+        capture.add_wake_sample(1001.0 + i, *sample)
+
+    assert capture.get_wake_samples() == samples
+    records = capture.get_records()
+    assert [r.direction for r in records] == [CAPTURE_SEND] + [CAPTURE_WAKE] * 3
+    assert [r.timestamp for r in records] == [1000.0, 1001.0, 1002.0, 1003.0]
+    assert "Wake" in records[1].get_message()
+
+
+def test_wake_samples_replay(capture):
+    for i in range(0, 10):
+        capture.add_wake_sample(i * 10.0, None, 0, True, 0.3)
+        capture.add_wake_sample(i * 10.0 + 2, 2.0, 1, False, 1.0)
+
+    evaluation = evaluate_wake_model(WakeWindowModel(), capture.get_wake_samples())
+    assert evaluation.samples == 16
+    assert evaluation.matched > 0
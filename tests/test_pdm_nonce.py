@@ -0,0 +1,93 @@
+from podcomm.pdm import Pdm
+from podcomm.pod import Pod
+from podcomm.nonce import Nonce
+from podcomm.definitions import set_log_path
+import podcomm.pdm
+import pytest
+
+LOT = 44147
+TID = 1100256
+
+
+def nonces_at(seed, start, count):
+    nonce = Nonce(LOT, TID, seed=seed)
+    for i in range(0, start):
+        nonce.getNext(True)
+    return [nonce.getNext(True) for i in range(0, count)]
+
+
+def nonce_at(seed, position):
+    nonce = Nonce(LOT, TID, seed=seed)
+    for i in range(0, position):
+        nonce.getNext(True)
+    return nonce
+
+
+@pytest.fixture
+def pdm(tmp_path, monkeypatch):
+    set_log_path(str(tmp_path))
+    pod = Pod()
+    pod.id_lot = LOT
+    pod.id_t = TID
+    pod.path = str(tmp_path / "pod.json")
+    pod.path_db = str(tmp_path / "pod.db")
+    pdm = Pdm(pod)
+    monkeypatch.setattr(pdm, "get_radio", lambda new=False: None)
+    return pdm
+
+
+@pytest.fixture
+def recovered(monkeypatch):
+    calls = []
+
+    def recover(lot, tid, nonces, processes=None):
+        calls.append(nonces)
+        return recover.result
+
+    recover.result = None
+    monkeypatch.setattr(podcomm.pdm, "recover_nonce", recover)
+    return recover, calls
+
+
+def test_saved_state_behind_on_another_seed_is_replaced(pdm, recovered):
+    recover, calls = recovered
+    pdm.nonce = nonce_at(0x12, 5)
+    recover.result = nonce_at(0x34, 8)
+
+    assert pdm.prime_nonce(nonces_at(0x34, 5, 3))
+    assert len(calls) == 1
+    assert pdm.nonce is recover.result
+    assert pdm.pod.nonce_seed == 0x34
+    assert pdm.pod.nonce_last == recover.result.lastNonce
+
+
+def test_saved_state_that_seeks_forward_is_kept(pdm, recovered):
+    recover, calls = recovered
+    saved = nonce_at(0x12, 5)
+    pdm.nonce = saved
+
+    assert not pdm.prime_nonce(nonces_at(0x12, 6, 3))
+    assert calls == []
+    assert pdm.nonce is saved
+    assert saved.lastNonce == nonce_at(0x12, 5).lastNonce
+
+
+def test_saved_state_ahead_of_log_is_kept(pdm, recovered):
+    recover, calls = recovered
+    saved = nonce_at(0x12, 20)
+    pdm.nonce = saved
+    recover.result = nonce_at(0x12, 6)
+
+    assert not pdm.prime_nonce(nonces_at(0x12, 3, 3))
+    assert len(calls) == 1
+    assert pdm.nonce is saved
+
+
+def test_saved_state_matching_log_is_kept(pdm, recovered):
+    recover, calls = recovered
+    saved = nonce_at(0x12, 5)
+    pdm.nonce = saved
+
+    assert not pdm.prime_nonce(nonces_at(0x12, 2, 3))
+    assert calls == []
+    assert pdm.nonce is saved
@@ -0,0 +1,21 @@
+from podcomm.pulses import Pulses
+from podcomm.exceptions import PdmError
+import pytest
+
+
+@pytest.mark.parametrize("value,count", [("1.15", 23), (1.15, 23), (2, 40), ("0.05", 1), ("30", 600)])
+def test_exact_units(value, count):
+    assert Pulses.from_units(value, exact=True) == Pulses(count)
+
+
+@pytest.mark.parametrize("value", ["1.03", 0.01, "2.125"])
+def test_inexact_units_are_refused(value):
+    with pytest.raises(PdmError):
+        Pulses.from_units(value, exact=True)
+    assert Pulses.from_units(value) == Pulses(int(float(value) * 20))
+
+
+@pytest.mark.parametrize("value", [None, "", "abc", "nan", "inf"])
+def test_invalid_units_raise_pdm_error(value):
+    with pytest.raises(PdmError):
+        Pulses.from_units(value)
@@ -0,0 +1,89 @@
+from podcomm.radio_broker import RadioBroker
+from podcomm.packet_radio import PacketRadio
+from podcomm.exceptions import PacketRadioError
+import pytest
+
+
+class FakeRadio(PacketRadio):
+    def __init__(self):
+        self.connects = []
+        self.disconnects = 0
+        self.fail_next = False
+
+    def connect(self, force_initialize=False):
+        self.connects.append(force_initialize)
+
+    def disconnect(self, ignore_errors=True):
+        self.disconnects += 1
+
+    def get_info(self):
+        return {}
+
+    def init_radio(self, force_init=False):
+        pass
+
+    def tx_up(self):
+        pass
+
+    def tx_down(self):
+        pass
+
+    def set_tx_power(self, tx_power):
+        pass
+
+    def get_packet(self, timeout=5.0):
+        if self.fail_next:
+            self.fail_next = False
+            raise PacketRadioError("simulated")
+        return None
+
+    def send_and_receive_packet(self, packet, repeat_count, delay_ms, timeout_ms, retry_count, preamble_ext_ms):
+        return None
+
+    def send_packet(self, packet, repeat_count, delay_ms, preamble_extension_ms):
+        return None
+
+
+@pytest.fixture
+def broker():
+    return RadioBroker(packet_radio=FakeRadio())
+
+
+def test_connect_passes_force_initialize_through(broker):
+    session = broker.get_session("a")
+    session.connect()
+    assert broker.packet_radio.connects == [False]
+    broker.disconnect()
+    session.connect(force_initialize=True)
+    assert broker.packet_radio.connects == [False, True]
+
+
+def test_connected_link_is_reused(broker):
+    first = broker.get_session("a")
+    second = broker.get_session("b")
+    first.connect()
+    second.connect()
+    assert broker.packet_radio.connects == [False]
+
+
+def test_radio_error_reconnects_without_reinitializing(broker):
+    session = broker.get_session("a")
+    session.connect()
+    broker.packet_radio.fail_next = True
+    with pytest.raises(PacketRadioError):
+        session.get_packet()
+    session.connect()
+    assert broker.packet_radio.connects == [False, False]
+    assert broker.packet_radio.disconnects == 1
+
+
+def test_reset_forces_initialization_once(broker):
+    session = broker.get_session("a")
+    session.connect()
+    session.reset_link()
+    session.connect()
+    session.reset_link()
+    session.connect()
+    broker.disconnect()
+    session.connect()
+    assert broker.packet_radio.connects == [False, True, True, False]
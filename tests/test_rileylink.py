@@ -0,0 +1,47 @@
+from podcomm import pr_rileylink
+from podcomm.pr_rileylink import RileyLink, Register, PA_LEVELS, get_register_shadow
+from podcomm.pr_simulated_pod import SimulatedClock
+from podcomm.device_cache import DeviceCache
+from podcomm.definitions import set_log_path
+from tests.fake_peripheral import FakeRileyLinkPeripheral
+import os
+import pytest
+
+
+def connected_rileylink(path, version=b"ble_rfspy 2.0", queue_depth=1):
+    set_log_path(str(path))
+    pr_rileylink.g_rl_version = None
+    pr_rileylink.g_rl_shadows.clear()
+
+    clock = SimulatedClock(speed=0)
+    peripheral = FakeRileyLinkPeripheral(clock, queue_depth=queue_depth, version=version, mtu=185)
+    rl = RileyLink(clock=clock)
+    rl.address = "00:00:00:00:00:00"
+    rl.device_cache = DeviceCache(os.path.join(str(path), "devices.json"))
+    rl.peripheral = peripheral
+    rl.connect(force_initialize=True)
+    return rl, peripheral
+
+
+@pytest.mark.parametrize("version,depth", [(b"ble_rfspy 2.0", 1), (b"ble_rfspy 2.3", 1), (b"ble_rfspy 3.0", 4)])
+def test_command_depth_follows_firmware(tmp_path, version, depth):
+    rl, peripheral = connected_rileylink(tmp_path, version, queue_depth=depth)
+    assert rl.transport.depth == depth
+    assert rl.transport.write_without_response_limit == 185 - 3
+
+
+def test_tx_changes_go_out_with_the_next_packet(tmp_path):
+    rl, peripheral = connected_rileylink(tmp_path)
+    operations = peripheral.gatt_operations
+    for level in [0, 7, 1, 6, 2, 5, 3, 4]:
+        rl.set_tx_level(level)
+    assert peripheral.gatt_operations == operations
+
+    rl.send_and_receive_packet(bytes(31), 0, 0, 100, 0, 0)
+    assert peripheral.gatt_operations == operations + 4
+    assert peripheral.registers[Register.PATABLE0] == PA_LEVELS[4]
+    assert get_register_shadow(rl.address).values[Register.PATABLE0] == PA_LEVELS[4]
+
+    operations = peripheral.gatt_operations
+    rl.send_and_receive_packet(bytes(31), 0, 0, 100, 0, 0)
+    assert peripheral.gatt_operations == operations + 2
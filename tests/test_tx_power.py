@@ -0,0 +1,37 @@
+from podcomm.tx_power import TxPowerController, TX_EVENT_RESPONSE, TX_EVENT_TIMEOUT
+import pytest
+
+LEVELS = 11
+
+
+def test_strong_reading_moves_several_steps_at_once():
+    controller = TxPowerController(LEVELS, level=8)
+    assert controller.update(TX_EVENT_RESPONSE, -55) == 0
+
+
+def test_weak_reading_moves_several_steps_at_once():
+    controller = TxPowerController(LEVELS, level=2)
+    assert controller.update(TX_EVENT_RESPONSE, -95) == LEVELS - 1
+
+
+def test_target_is_rounded():
+    controller = TxPowerController(LEVELS, level=0)
+    # -80 dBm is two thirds of the way from strong to weak
+    assert controller.update(TX_EVENT_RESPONSE, -80) == round(20 / 30 * (LEVELS - 1))
+
+
+@pytest.mark.parametrize("offset", [-0.7, -0.4, 0.0, 0.4, 0.7])
+def test_readings_inside_the_hysteresis_band_do_not_move(offset):
+    controller = TxPowerController(LEVELS, level=5)
+    # -75 dBm puts the target on level 5
+    rssi = -75 - offset * 3
+    assert controller.update(TX_EVENT_RESPONSE, rssi) == 5
+    assert abs(controller.get_target_level() - 5) < controller.hysteresis
+
+
+def test_timeouts_raise_the_level():
+    controller = TxPowerController(LEVELS, level=5)
+    controller.update(TX_EVENT_RESPONSE, -75)
+    levels = [controller.update(TX_EVENT_TIMEOUT) for i in range(0, 6)]
+    assert levels[-1] > 5
+    assert levels == sorted(levels)